@@ -0,0 +1,3 @@
+"""
+Benchmarks of Pira hot paths, run with `python -m benchmarks` from the repository root.
+"""
@@ -0,0 +1,80 @@
+"""
+Runs benchmarks and writes machine-readable results (JSON), optionally comparing them with
+results of an earlier run.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --only log,can --max-rows 100000 --compare results.json
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import importlib
+import json
+import sys
+
+from .harness import Runner, compare, install_hardware_stubs, load_report
+
+# Benchmark groups, each module has a run(runner) function.
+GROUPS = collections.OrderedDict([
+    ('log', 'benchmarks.bench_log'),
+    ('processing', 'benchmarks.bench_processing'),
+    ('can', 'benchmarks.bench_can'),
+    ('can_sim', 'benchmarks.bench_can_sim'),
+    ('lora', 'benchmarks.bench_lora'),
+    ('light', 'benchmarks.bench_light'),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmark Pira hot paths.')
+    parser.add_argument('--only', help='comma separated benchmark groups ({})'.format(','.join(GROUPS)))
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions of every benchmark (default 5)')
+    parser.add_argument('--max-rows', type=int, default=10 ** 7, help='largest log size (default 10000000)')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    parser.add_argument('--workdir', help='directory for generated data (default is a temporary directory)')
+    args = parser.parse_args()
+
+    groups = list(GROUPS)
+    if args.only:
+        groups = [group.strip() for group in args.only.split(',')]
+        unknown = [group for group in groups if group not in GROUPS]
+        if unknown:
+            parser.error('unknown benchmark groups: {}'.format(','.join(unknown)))
+
+    install_hardware_stubs()
+    runner = Runner(repeat=args.repeat, max_rows=args.max_rows, workdir=args.workdir)
+    try:
+        for group in groups:
+            try:
+                module = importlib.import_module(GROUPS[group])
+                module.run(runner)
+            except ImportError as error:
+                # Dependencies of some modules (e.g. pycrypto, python-can) may not be installed.
+                runner.skip(group, str(error))
+            except Exception as error:
+                # A failing group must not prevent the others from running and the report.
+                runner.error(group, error)
+    finally:
+        if not args.workdir:
+            runner.cleanup()
+
+    report = runner.report()
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        print('{:<40} {:<24} {:>12} {:>12} {:>8}'.format('benchmark', 'params', 'baseline us', 'current us', 'ratio'), file=sys.stderr)
+        for name, params, baseline, current, ratio in compare(load_report(args.compare), report):
+            print('{:<40} {:<24} {:>12.1f} {:>12.1f} {:>8}'.format(
+                name, params, baseline * 1e6, current * 1e6, '{:.2f}'.format(ratio) if ratio is not None else '-'
+            ), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
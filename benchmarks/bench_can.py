@@ -0,0 +1,143 @@
+"""
+bench_can.py
+
+Decoding of sensor replies alone and reading of sensor data over CAN, against a fake bus that replays the frames of a
+sensor with VARIABLES variables and a growing number of data/time frame pairs per variable,
+and polling of a growing number of such sensors whose replies are interleaved on the bus.
+"""
+import random
+
+from .harness import BenchBoot
+
+SENSOR_ID = 0x401
+
+VARIABLES = 4
+
+# Data/time frame pairs per variable.
+FRAMES = (4, 16, 64)
+
+# Number of polled sensors, with POLL_FRAMES data/time frame pairs per variable.
+SENSORS = (1, 8, 32)
+POLL_FRAMES = 16
+
+
+class Frame(object):
+    """Received CAN frame."""
+
+    def __init__(self, arbitration_id, data):
+        self.arbitration_id = arbitration_id
+        self.data = bytearray(data)
+        self.dlc = len(data)
+
+
+def _int16(value):
+    value &= 0xffff
+    return [value & 0xff, value >> 8]
+
+
+def sensor_frames(sensor_id, variables, frames, seed=0):
+    """Frames sent by a sensor in reply to a data request: header, then data and time frames."""
+    generator = random.Random(seed)
+    replies = [Frame(sensor_id, [frames, variables] + _int16(1200))]
+    for _ in range(variables):
+        for _ in range(frames):
+            data = []
+            delta = []
+            for _ in range(4):
+                data += _int16(generator.randint(-2000, 2000))
+                # Time between measurements in tenths of a second.
+                delta += _int16(generator.randint(590, 610))
+            replies.append(Frame(sensor_id, data))
+            replies.append(Frame(sensor_id, delta))
+
+    return replies
+
+
+class FakeDriver(object):
+    """MCP2515 driver stand-in, replies to data requests with prepared frames.
+
+    Replies of sensors requested before anything was received are interleaved frame by frame.
+    """
+
+    def __init__(self, replies):
+        self._replies = replies
+        self._requested = []
+        self._pending = []
+        self.rx_frames = 0
+        self.tx_frames = 0
+
+    def send_data(self, ID, DATA, EXTID):
+        self.tx_frames += 1
+        self._requested.append(self._replies.get(ID, []))
+
+    def receive(self, timeout):
+        if self._requested:
+            frames = []
+            for index in range(max(len(reply) for reply in self._requested)):
+                frames.extend(reply[index] for reply in self._requested if index < len(reply))
+            self._pending[:0] = reversed(frames)
+            self._requested = []
+        if not self._pending:
+            return None
+
+        self.rx_frames += 1
+        return self._pending.pop()
+
+    def get_raw_data(self):
+        return self.receive(1.0)
+
+    get_data = get_raw_data
+
+    def flush_buffer(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+def run(runner):
+    from pira.modules import can
+    from pira.modules.can_poller import SensorPoller, decode_sensor_data
+
+    boot = BenchBoot(runner.workdir)
+    for frames in FRAMES:
+        reply = sensor_frames(SENSOR_ID, VARIABLES, frames)
+        send_time = boot.clock.now()
+        runner.measure(
+            'can.decode',
+            lambda: decode_sensor_data(reply[0], reply[1:], send_time),
+            number=10,
+            variables=VARIABLES,
+            frames=frames
+        )
+
+        # Driver construction configures the CAN interface, so the module is set up by hand.
+        module = can.Module.__new__(can.Module)
+        module._boot = boot
+        module._driver = FakeDriver({SENSOR_ID: sensor_frames(SENSOR_ID, VARIABLES, frames)})
+        module._poller = SensorPoller(module._driver, boot.clock)
+
+        runner.measure(
+            'can.get_data_json',
+            lambda: module.get_data_json(SENSOR_ID),
+            number=10,
+            variables=VARIABLES,
+            frames=frames
+        )
+
+    for sensors in SENSORS:
+        sensor_ids = [0x101 + 0x100 * (index // 8) + index % 8 for index in range(sensors)]
+        driver = FakeDriver(dict(
+            (sensor_id, sensor_frames(sensor_id, VARIABLES, POLL_FRAMES, seed=sensor_id))
+            for sensor_id in sensor_ids
+        ))
+        poller = SensorPoller(driver, boot.clock, window=len(sensor_ids))
+
+        runner.measure(
+            'can.poll',
+            lambda: poller.poll(sensor_ids),
+            number=10,
+            sensors=sensors,
+            variables=VARIABLES,
+            frames=POLL_FRAMES
+        )
@@ -0,0 +1,81 @@
+"""
+bench_can_sim.py
+
+End to end CAN module throughput against simulated sensors (benchmarks/can_simulator.py) on
+python-can's virtual bus: scanning the bus when the module starts and polling all sensors,
+decoding their replies and writing a raw file, for a growing number of sensors (SENSORS per
+device on DEVICES devices), and with sensors dropping requests. Frames are paced at BITRATE.
+"""
+import os
+
+from .harness import BenchBoot
+from .can_simulator import simulate
+
+# Virtual bus shared by the simulator and the module.
+CHANNEL = 'pira-bench'
+
+BITRATE = 500000
+
+VARIABLES = 4
+FRAMES = 2
+
+# Devices and sensors per device, 4, 16 and 64 sensors.
+TOPOLOGIES = ((1, 4), (2, 8), (4, 16))
+
+# Sensors polled at the same time, the largest window the CAN module allows.
+WINDOW = 8
+
+# Probability a request is not answered. A sensor missing a single poll is only counted as silent,
+# the bus is rescanned after CAN_SILENT_POLLS (default 3) consecutive missed polls of a sensor, so
+# rescans are rare and most missed polls cost the reply timeout of the silent sensor.
+DROPOUT = 0.05
+
+
+def run(runner):
+    import can as python_can
+    from pira.modules import can
+
+    can.RAW_DATA_STORAGE_PATH = runner.directory('raw-sim')
+    environ = dict(os.environ)
+
+    def scenario(devices, sensors, dropout):
+        os.environ.update({
+            'CAN_BUSTYPE': 'virtual',
+            'CAN_INTERFACE': CHANNEL,
+            'CAN_NUM_DEV': str(devices),
+            'CAN_NUM_SEN': str(sensors),
+            'CAN_POLL_WINDOW': str(WINDOW),
+        })
+        bus = python_can.interface.Bus(channel=CHANNEL, bustype='virtual')
+        simulator = simulate(
+            bus, devices=devices, sensors=sensors, variables=VARIABLES, frames=FRAMES,
+            bitrate=BITRATE, dropout=dropout
+        )
+        simulator.start()
+        try:
+            modules = {}
+            started = []
+
+            def start():
+                started.append(can.Module(BenchBoot(runner.workdir)))
+
+            def close():
+                # Every module has its own virtual bus, which receives all frames until shut down.
+                while started:
+                    started.pop().shutdown(modules)
+
+            params = dict(devices=devices, sensors=devices * sensors, variables=VARIABLES, frames=FRAMES, dropout=dropout)
+            runner.measure('can_sim.scan', start, setup=close, **params)
+            close()
+            module = can.Module(BenchBoot(runner.workdir))
+            runner.measure('can_sim.process', lambda: module.process(modules), **params)
+            module.shutdown(modules)
+        finally:
+            simulator.stop()
+            bus.shutdown()
+            os.environ.clear()
+            os.environ.update(environ)
+
+    for devices, sensors in TOPOLOGIES:
+        scenario(devices, sensors, 0.0)
+    scenario(2, 8, DROPOUT)
@@ -0,0 +1,29 @@
+"""
+bench_light.py
+
+NDVI and PIR calculation from raw light sensor channels, over a batch of READINGS readings.
+"""
+import random
+
+READINGS = 1000
+
+
+def run(runner):
+    from pira.modules import light_calculator
+
+    generator = random.Random(0)
+    readings = [
+        [generator.uniform(0.01, 2.0) for _ in light_calculator.LIGHT_CH_NAMES]
+        for _ in range(READINGS)
+    ]
+
+    def ndvi():
+        for raws in readings:
+            light_calculator.calculate_ndvi(raws)
+
+    def pir():
+        for raws in readings:
+            light_calculator.calculate_pir(raws)
+
+    runner.measure('light_calculator.calculate_ndvi', ndvi, readings=READINGS)
+    runner.measure('light_calculator.calculate_pir', pir, readings=READINGS)
@@ -0,0 +1,117 @@
+"""
+bench_log.py
+
+Log database inserts and queries, and measurement messages built from log queries, on
+logs of growing size. Rows are spread over LOG_SPAN with keys taken in turn from LOG_KEYS.
+"""
+import datetime
+import random
+import time
+
+from pira import log as pira_log
+from pira.const import LOG_DEVICE_TEMPERATURE, LOG_DEVICE_VOLTAGE
+from pira.const import MEASUREMENT_DEVICE_TEMPERATURE, MEASUREMENT_DEVICE_VOLTAGE
+from pira.messages import MeasurementConfig, create_measurements_message
+
+from .harness import BENCH_START, BenchBoot
+
+# Keys of generated rows.
+LOG_KEYS = (
+    LOG_DEVICE_VOLTAGE,
+    LOG_DEVICE_TEMPERATURE,
+    'ultrasonic.distance',
+    'depth.depth',
+    'plantower.pm10',
+    'plantower.pm25',
+    'plantower.pm100',
+    'system',
+)
+
+# Ranges of generated values, so measurement conversions stay within message limits.
+VALUE_RANGES = {
+    LOG_DEVICE_VOLTAGE: (3.0, 4.2),
+    LOG_DEVICE_TEMPERATURE: (-20.0, 60.0),
+    'ultrasonic.distance': (300.0, 5000.0),
+}
+
+# Time span covered by generated rows.
+LOG_SPAN = datetime.timedelta(days=30)
+
+# Query window, a day of data like a module reporting once per day.
+QUERY_WINDOW = datetime.timedelta(days=1)
+
+# Inserts timed together.
+INSERTS = 100
+
+# Measurements included in the message, like the LoRa module.
+MEASUREMENTS = [
+    MEASUREMENT_DEVICE_VOLTAGE,
+    MEASUREMENT_DEVICE_TEMPERATURE,
+    MeasurementConfig('ultrasonic.distance', int),
+]
+
+
+def _sizes(max_rows):
+    size = 10 ** 3
+    while size <= max_rows:
+        yield size
+        size *= 10
+
+
+def _value(key, generator):
+    if key == 'system':
+        return 'boot'
+    low, high = VALUE_RANGES.get(key, (0.0, 100.0))
+    return round(generator.uniform(low, high), 2)
+
+
+def _fill(log, count, rows):
+    """Insert rows count..rows-1 in a single transaction."""
+    generator = random.Random(count)
+    span = LOG_SPAN.total_seconds()
+    end = int(time.mktime(BENCH_START.timetuple()))
+
+    def generate():
+        # Plain loop instead of range, which would build a list of all indices on Python 2.
+        index = count
+        while index < rows:
+            key = LOG_KEYS[index % len(LOG_KEYS)]
+            # Rows of every size are spread over the whole span.
+            timestamp = end - int(span * generator.random())
+            yield timestamp, key, str(_value(key, generator))
+            index += 1
+
+    with log._db:
+        log._db.executemany('INSERT INTO log (timestamp, key, value) VALUES(?, ?, ?)', generate())
+
+
+def run(runner):
+    pira_log.LOG_FILE = runner.path('log', 'pira-zero-log.db')
+    log = pira_log.Log()
+    boot = BenchBoot(runner.workdir, log=log)
+    since = BENCH_START - QUERY_WINDOW
+
+    rows = 0
+    try:
+        for size in _sizes(runner.max_rows):
+            _fill(log, rows, size)
+            rows = size
+
+            runner.measure(
+                'log.insert',
+                lambda: log.insert(LOG_DEVICE_VOLTAGE, 3.7, timestamp=BENCH_START),
+                number=INSERTS,
+                rows=size
+            )
+            runner.measure(
+                'log.query',
+                lambda: log.query(since, LOG_DEVICE_VOLTAGE, only_numeric=True),
+                rows=size
+            )
+            runner.measure(
+                'messages.create_measurements_message',
+                lambda: create_measurements_message(boot, since, MEASUREMENTS),
+                rows=size
+            )
+    finally:
+        log.close()
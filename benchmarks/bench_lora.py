@@ -0,0 +1,63 @@
+"""
+bench_lora.py
+
+LoRaWAN uplink creation (with payload encryption) and MIC computation, for growing payload
+sizes. Payloads of 8 bytes correspond to a measurements message with one measurement.
+"""
+import os
+import random
+import sys
+
+import pira
+
+# LoRaWAN MAC package, imported on its own as the radio driver next to it requires SPI.
+LORAWAN_PATH = os.path.join(os.path.dirname(pira.__file__), 'hardware', 'lora')
+
+# Payload sizes in bytes, 51 is the maximum at the slowest data rate in EU868.
+PAYLOAD_SIZES = (8, 24, 51)
+
+DEVICE_ADDR = [0x26, 0x01, 0x1b, 0x4c]
+
+
+def _import_lorawan():
+    sys.path.insert(0, LORAWAN_PATH)
+    try:
+        import LoRaWAN
+        from LoRaWAN.MHDR import MHDR
+    finally:
+        sys.path.remove(LORAWAN_PATH)
+
+    return LoRaWAN, MHDR
+
+
+def run(runner):
+    LoRaWAN, MHDR = _import_lorawan()
+
+    generator = random.Random(0)
+    nws_key = [generator.randint(0, 255) for _ in range(16)]
+    apps_key = [generator.randint(0, 255) for _ in range(16)]
+
+    for size in PAYLOAD_SIZES:
+        args = {
+            'devaddr': DEVICE_ADDR,
+            'fcnt': 1234,
+            'data': [generator.randint(0, 255) for _ in range(size)],
+        }
+
+        def create():
+            payload = LoRaWAN.new(nws_key, apps_key)
+            payload.create(MHDR.UNCONF_DATA_UP, args)
+            return payload
+
+        payload = create()
+        frm_payload = payload.get_mac_payload().frm_payload
+
+        runner.measure('lora.create', create, number=100, size=size)
+        runner.measure(
+            'lora.encrypt',
+            lambda: frm_payload.encrypt_payload(apps_key, 0x00, args['data']),
+            number=100,
+            size=size
+        )
+        runner.measure('lora.mic', payload.compute_mic, number=100, size=size)
+        runner.measure('lora.to_raw', lambda: create().to_raw(), number=100, size=size)
@@ -0,0 +1,167 @@
+"""
+bench_processing.py
+
+Processing of raw CAN files into the calculated .csv file, on generated raw files covering
+a growing number of days. One raw file is written per hour, with SAMPLES_PER_HOUR samples of
+every series in SERIES, using the lookup table from docs/sample-config.json. Processing is
+measured with JSON raw files and with the same files converted to the binary format.
+"""
+import copy
+import datetime
+import json
+import os
+import random
+
+from .harness import BENCH_START, BenchBoot
+
+# Series (device_sensor_variable) written to raw files and their lookup table entries.
+SERIES = {
+    '4_8_0': 'bat_vol',
+    '4_8_2': 'bat_cur',
+    '4_8_3': 'bat',
+    '1_3_0': 'air_pres_top',
+    '1_3_1': 'temp_top',
+    '1_3_2': 'hum_top',
+    '2_3_0': 'air_pres_mid1',
+    '2_3_1': 'temp_mid1',
+    '2_3_2': 'hum_mid1',
+    '1_6_0': 'co2',
+    '4_7_0': 'tdr_water',
+    '4_7_1': 'tdr_temp',
+    '4_7_2': 'tdr_perm',
+    '4_7_3': 'tdr_ec',
+}
+
+SAMPLES_PER_HOUR = 6
+
+# Number of days covered by raw files, processing time grows quadratically with days.
+DAYS = (1, 7)
+
+# Raw file timestamp format, as written by the CAN module.
+RAW_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+def generate_raw_files(path, config, days):
+    """Write one raw file per hour for the given number of days before BENCH_START.
+
+    :return: List of written file names
+    """
+    generator = random.Random(days)
+    end = BENCH_START.replace(minute=0, second=0, microsecond=0)
+    start = end - datetime.timedelta(days=days)
+    names = []
+    hour = start
+    while hour < end:
+        devices = {}
+        for series, sensor in sorted(SERIES.items()):
+            device, address, variable = series.split('_')
+            limits = config[sensor]['vars']
+            values = {}
+            for index in range(SAMPLES_PER_HOUR):
+                values[str(index)] = {
+                    # sensors send int16 values
+                    'data': float(generator.randint(limits['min'], limits['max'])),
+                    'time': (hour + datetime.timedelta(minutes=index * 60 // SAMPLES_PER_HOUR)).strftime(RAW_TIME_FORMAT),
+                }
+            devices.setdefault(device, {}).setdefault(address, {})[variable] = values
+
+        name = 'raw_values-' + hour.strftime('%m%d%Y-%H%M%S') + '.json'
+        with open(os.path.join(path, name), 'w') as fp:
+            json.dump(devices, fp)
+        names.append(name)
+        hour += datetime.timedelta(hours=1)
+
+    return names
+
+
+def load_raw_files(path, names):
+    """Read raw files into the structure kept by the processing module."""
+    raw_data = {}
+    for name in names:
+        with open(os.path.join(path, name)) as fp:
+            devices = json.load(fp)
+
+        for device, sensors in devices.items():
+            for sensor, variables in sensors.items():
+                for variable, values in variables.items():
+                    series = raw_data.setdefault('{}_{}_{}'.format(device, sensor, variable), {})
+                    for value in values.values():
+                        series[datetime.datetime.strptime(value['time'], RAW_TIME_FORMAT)] = value['data']
+
+    return raw_data
+
+
+def run(runner):
+    from pira import rawdata
+    from pira.modules import processing
+
+    processing.CSV_DATA_STORAGE_PATH = runner.directory('calculated')
+    boot = BenchBoot(runner.workdir)
+    config = boot.config.sensors
+    modules = {'pira.modules.can': None}
+
+    for days in DAYS:
+        raw_path = runner.directory('raw-{}'.format(days))
+        names = generate_raw_files(raw_path, config, days)
+        raw_data = load_raw_files(raw_path, names)
+        module = processing.Module(boot)
+
+        def reset_csv():
+            if os.path.exists(module._csv_filename):
+                os.remove(module._csv_filename)
+
+        def reset_process_data():
+            module._raw_data = copy.deepcopy(raw_data)
+            module._calculated_data = {}
+
+        runner.measure('processing.process_data', module.process_data, setup=reset_process_data, days=days)
+        calculated_data = module._calculated_data
+
+        # Hourly temperatures as read from the .csv file.
+        file_timestamps = dict(
+            (timestamp, str(values[module._gdd_sensor]))
+            for timestamp, values in calculated_data.items()
+            if module._gdd_sensor in values
+        )
+
+        def reset_gdd():
+            module._file_timestamps = dict(file_timestamps)
+            module._gdd_dict = {}
+            module._old_gdd = 0
+
+        runner.measure('processing.get_all_gdd', module.get_all_gdd, setup=reset_gdd, days=days)
+
+        newest_csv_timestamp = BENCH_START - datetime.timedelta(days=days + 1)
+
+        def reset_append():
+            reset_csv()
+            module._calculated_data = copy.deepcopy(calculated_data)
+            module._file_timestamps = {}
+            module._write_header = True
+            module._data_ready = True
+
+        runner.measure(
+            'processing.append_to_csv_file',
+            lambda: module.append_to_csv_file(newest_csv_timestamp),
+            setup=reset_append,
+            days=days
+        )
+
+        def reset_process():
+            reset_csv()
+            module._raw_data = {}
+            module._calculated_data = {}
+            module._file_timestamps = {}
+            module._gdd_dict = {}
+
+        processing.RAW_DATA_STORAGE_PATH = raw_path
+        runner.measure('processing.process', lambda: module.process(modules), setup=reset_process, days=days)
+
+        binary_path = runner.directory('raw-binary-{}'.format(days))
+        for name in names:
+            target = os.path.join(binary_path, os.path.splitext(name)[0] + rawdata.RAW_EXTENSION)
+            with open(target, 'wb') as fp:
+                fp.write(rawdata.encode(rawdata.read_json(os.path.join(raw_path, name))))
+
+        processing.RAW_DATA_STORAGE_PATH = binary_path
+        runner.measure('processing.process', lambda: module.process(modules), setup=reset_process, days=days, format='binary')
@@ -0,0 +1,215 @@
+"""
+can_simulator.py
+
+Simulated CAN sensors, the sensor side of the protocol of pira/modules/can_poller.py, for load
+testing the CAN module without sensor hardware. Sensors reply to scan (0x02) and data (0x01)
+requests with a header (data frames per variable, number of variables, time since the last
+measurement) followed by alternating data and time frames of every variable, every device
+address (0x100, 0x200, ...) replies with nothing to read.
+
+Replies are sent after a configurable latency, frames of all sensors are serialized on the bus
+at the configured bitrate, so replies of concurrently polled sensors interleave as on a real
+bus. Requests are ignored with the dropout probability (sensor does not respond) and single
+frames are lost with the frame loss probability (incomplete reply).
+
+The simulator runs on python-can's in-process virtual bus (used by the can_sim benchmarks) or
+on a virtual socketcan interface, against a Pira started with CAN_INTERFACE=vcan0:
+
+    sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+    python -m benchmarks.can_simulator --channel vcan0 --devices 4 --sensors 16
+"""
+from __future__ import print_function
+
+import argparse
+import heapq
+import random
+import threading
+import time
+
+# Requests sent by the CAN module.
+COMMAND_DATA = 0x01
+COMMAND_SCAN = 0x02
+
+# Int16 values in a data frame, and deltas in a time frame.
+VALUES_PER_FRAME = 4
+
+# Bits of a standard 8 byte frame on the wire, without stuffing.
+FRAME_BITS = 111
+
+
+def _int16(value):
+    value &= 0xffff
+    return [value & 0xff, value >> 8]
+
+
+def sensor_addresses(devices, sensors):
+    """Addresses of simulated sensors, sensors 1..sensors on every device."""
+    return [0x100 * (device + 1) + sensor for device in range(devices) for sensor in range(1, sensors + 1)]
+
+
+class SimulatedSensor(object):
+    """Sensor reporting random measurements of its variables.
+
+    :param address: Sensor address (arbitration id)
+    :param variables: Number of variables, 0 for an address with nothing to read
+    :param frames: Data frames per variable in every reply
+    :param interval: Seconds between measurements
+    """
+
+    def __init__(self, address, variables=4, frames=4, interval=60, seed=0):
+        self.address = address
+        self.variables = variables
+        self.frames = frames
+        self.interval = interval
+        self._random = random.Random(seed)
+
+    def reply(self):
+        """Payloads of the reply to a scan or data request."""
+        if not self.variables or not self.frames:
+            # Sensor sends back zeros if there is nothing to read.
+            return [[0, 0]]
+
+        payloads = [[self.frames, self.variables] + _int16(self._random.randint(0, self.interval * 10))]
+        for _ in range(self.variables):
+            for _ in range(self.frames):
+                data = []
+                deltas = []
+                for _ in range(VALUES_PER_FRAME):
+                    data += _int16(self._random.randint(-2000, 2000))
+                    deltas += _int16(self.interval * 10)
+                payloads.append(data)
+                payloads.append(deltas)
+        return payloads
+
+
+class CanSimulator(object):
+    """Replies to requests on a python-can bus on behalf of simulated sensors.
+
+    :param bus: python-can bus, the simulator has to be its only user
+    :param sensors: List of SimulatedSensor
+    :param latency: Seconds between a request and the first frame of the reply
+    :param bitrate: Bus speed used to pace frames, None to send them as fast as possible
+    :param dropout: Probability that a request is not answered
+    :param frame_loss: Probability that a single reply frame is lost
+    """
+
+    def __init__(self, bus, sensors, latency=0.002, bitrate=500000, dropout=0.0, frame_loss=0.0, seed=0):
+        import can
+
+        self._can = can
+        self._bus = bus
+        self._sensors = dict((sensor.address, sensor) for sensor in sensors)
+        # Device addresses are present but have nothing to read.
+        for device in set(address - address % 0x100 for address in self._sensors):
+            self._sensors.setdefault(device, SimulatedSensor(device, variables=0))
+        self._latency = latency
+        self._frame_time = float(FRAME_BITS) / bitrate if bitrate else 0.0
+        self._dropout = dropout
+        self._frame_loss = frame_loss
+        self._random = random.Random(seed)
+        # Frames waiting to be sent, (send time, sequence, arbitration id, payload).
+        self._pending = []
+        self._sequence = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        # Number of requests received, requests dropped and frames sent.
+        self.requests = 0
+        self.dropped = 0
+        self.tx_frames = 0
+
+    def start(self):
+        """Start replying in a background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='can-simulator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _handle(self, message, now):
+        sensor = self._sensors.get(message.arbitration_id)
+        if sensor is None or not message.dlc or message.data[0] not in (COMMAND_DATA, COMMAND_SCAN):
+            return
+
+        self.requests += 1
+        if self._random.random() < self._dropout:
+            self.dropped += 1
+            return
+
+        for index, payload in enumerate(sensor.reply()):
+            self._sequence += 1
+            heapq.heappush(self._pending, (now + self._latency + index * self._frame_time, self._sequence, sensor.address, payload))
+
+    def _run(self):
+        bus_free = 0.0
+        while not self._stopped.is_set():
+            now = time.time()
+            # Due frames are sent one at a time, the bus carries a single frame at once.
+            while self._pending and self._pending[0][0] <= now and bus_free <= now:
+                _, _, address, payload = heapq.heappop(self._pending)
+                bus_free = now + self._frame_time
+                if self._random.random() < self._frame_loss:
+                    continue
+                self._bus.send(self._can.Message(arbitration_id=address, data=payload, is_extended_id=False))
+                self.tx_frames += 1
+
+            timeout = 0.05
+            if self._pending:
+                timeout = min(timeout, max(0, self._pending[0][0] - now, bus_free - now))
+            message = self._bus.recv(timeout=timeout)
+            if message is not None:
+                self._handle(message, time.time())
+
+
+def simulate(bus, devices=1, sensors=8, variables=4, frames=4, interval=60, **options):
+    """Simulator with sensors 1..sensors on each of devices, options as in CanSimulator."""
+    return CanSimulator(
+        bus,
+        [
+            SimulatedSensor(address, variables=variables, frames=frames, interval=interval, seed=address)
+            for address in sensor_addresses(devices, sensors)
+        ],
+        **options
+    )
+
+
+def main():
+    import can
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.can_simulator', description='Simulate CAN sensors.')
+    parser.add_argument('--channel', default='vcan0', help='CAN interface (default vcan0)')
+    parser.add_argument('--bustype', default='socketcan', help='python-can interface (default socketcan)')
+    parser.add_argument('--devices', type=int, default=1, help='number of devices (default 1)')
+    parser.add_argument('--sensors', type=int, default=8, help='sensors per device (default 8)')
+    parser.add_argument('--variables', type=int, default=4, help='variables per sensor (default 4)')
+    parser.add_argument('--frames', type=int, default=4, help='data frames per variable in a reply (default 4)')
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds before a reply (default 0.002)')
+    parser.add_argument('--bitrate', type=int, default=500000, help='bus speed used to pace frames, 0 to disable (default 500000)')
+    parser.add_argument('--dropout', type=float, default=0.0, help='probability a request is not answered (default 0)')
+    parser.add_argument('--frame-loss', type=float, default=0.0, help='probability a reply frame is lost (default 0)')
+    args = parser.parse_args()
+
+    bus = can.interface.Bus(channel=args.channel, bustype=args.bustype)
+    simulator = simulate(
+        bus, devices=args.devices, sensors=args.sensors, variables=args.variables, frames=args.frames,
+        latency=args.latency, bitrate=args.bitrate, dropout=args.dropout, frame_loss=args.frame_loss
+    )
+    simulator.start()
+    print('Simulating {} sensors on {}, press Ctrl-C to stop.'.format(args.devices * args.sensors, args.channel))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+        bus.shutdown()
+    print('{} requests, {} dropped, {} frames sent.'.format(simulator.requests, simulator.dropped, simulator.tx_frames))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+harness.py
+
+Timing harness and stand-ins for the boot object, so hot paths can be measured on a plain
+Linux machine without Pira hardware.
+"""
+from __future__ import print_function
+
+import datetime
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import traceback
+import types
+
+from pira.bus import Bus
+from pira.clock import SimulatedClock
+from pira.config import Config
+from pira.metrics import Metrics
+
+# Fixed wall clock time used by all benchmarks, so generated data is the same on every run.
+BENCH_START = datetime.datetime(2019, 7, 15, 12, 30, 0)
+
+# Lookup table used by the processing module.
+SAMPLE_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs', 'sample-config.json')
+
+# Results format version, bumped whenever the meaning of fields changes.
+RESULTS_VERSION = 1
+
+
+# Hardware libraries which are not in requirements.txt (only available on the device) and
+# classes they provide, replaced by stand-ins when missing: module -> class names.
+HARDWARE_STUBS = {
+    'smbus': ('SMBus',),
+}
+
+
+class HardwareStub(object):
+    """Stand-in for a class of a hardware library, any access to the hardware fails."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        raise IOError("Hardware is not available in benchmarks.")
+
+
+def install_hardware_stubs():
+    """Replace missing hardware libraries, so modules importing them can be benchmarked."""
+    for name, classes in sorted(HARDWARE_STUBS.items()):
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            module = types.ModuleType(name)
+            for class_name in classes:
+                setattr(module, class_name, HardwareStub)
+            sys.modules[name] = module
+
+
+class BenchStorage(object):
+    """Storage stand-in that allows every write."""
+
+    def request_write(self, category, size=0):
+        return True
+
+    def add(self, category, path):
+        pass
+
+    def mark_uploaded(self, path):
+        pass
+
+    def retain_after(self, category, timestamp):
+        pass
+
+
+class BenchState(dict):
+    """State stand-in, missing keys are None as in pira.state.State."""
+
+    def __missing__(self, name):
+        return None
+
+
+class BenchBoot(object):
+    """Reduced boot object given to modules under benchmark."""
+
+    def __init__(self, workdir, log=None):
+        self.clock = SimulatedClock(time.mktime(BENCH_START.timetuple()))
+        self.metrics = Metrics()
+        self.bus = Bus()
+        self.storage = BenchStorage()
+        self.state = BenchState()
+        self.log = log
+
+        config_file = os.path.join(workdir, 'config.json')
+        shutil.copy(SAMPLE_CONFIG, config_file)
+        self.config = Config(environ={}, config_file=config_file)
+
+
+def _git_revision():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Runner(object):
+    """Runs benchmarks and collects their results."""
+
+    def __init__(self, repeat=5, max_rows=10 ** 7, workdir=None):
+        self.repeat = repeat
+        self.max_rows = max_rows
+        self.workdir = workdir or tempfile.mkdtemp(prefix='pira-bench-')
+        self.results = []
+        self.skipped = []
+        self.errors = []
+
+    def path(self, *names):
+        """Path inside the benchmark working directory, parent directories are created."""
+        path = os.path.join(self.workdir, *names)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        return path
+
+    def directory(self, *names):
+        """Directory inside the benchmark working directory, created if needed."""
+        path = os.path.join(self.workdir, *names)
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+        return path
+
+    def measure(self, name, func, number=1, setup=None, **params):
+        """Measure func, called number times per repetition.
+
+        :param name: Benchmark name
+        :param func: Callable to measure
+        :param number: Number of calls timed together, results are per call
+        :param setup: Callable invoked before every repetition, not timed
+        :param params: Benchmark parameters (e.g. rows), stored with results
+        """
+        timings = []
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+
+            start = timeit.default_timer()
+            for _ in range(number):
+                func()
+            timings.append((timeit.default_timer() - start) / number)
+
+        timings.sort()
+        result = {
+            'name': name,
+            'params': params,
+            'number': number,
+            'repeat': self.repeat,
+            'min': timings[0],
+            'median': timings[len(timings) // 2],
+            'mean': sum(timings) / len(timings),
+            'max': timings[-1],
+        }
+        self.results.append(result)
+        print('{:<40} {:<24} {:>12.1f} us'.format(name, _format_params(params), result['median'] * 1e6), file=sys.stderr)
+        return result
+
+    def skip(self, group, reason):
+        """Record a benchmark group that could not run."""
+        self.skipped.append({'group': group, 'reason': reason})
+        print('{:<40} skipped: {}'.format(group, reason), file=sys.stderr)
+
+    def error(self, group, error):
+        """Record a benchmark group that failed, called while handling the exception."""
+        self.errors.append({'group': group, 'error': '{}: {}'.format(type(error).__name__, error)})
+        print('{:<40} failed: {}'.format(group, error), file=sys.stderr)
+        traceback.print_exc()
+
+    def report(self):
+        """Machine-readable results of the run."""
+        return {
+            'version': RESULTS_VERSION,
+            'created': datetime.datetime.utcnow().isoformat(),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'repeat': self.repeat,
+            'results': self.results,
+            'skipped': self.skipped,
+            'errors': self.errors,
+        }
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def _format_params(params):
+    return ','.join('{}={}'.format(key, value) for key, value in sorted(params.items()))
+
+
+def _key(result):
+    return result['name'], _format_params(result['params'])
+
+
+def compare(baseline, current):
+    """Compare medians of two reports, returns list of (name, params, baseline, current, ratio)."""
+    previous = dict((_key(result), result) for result in baseline['results'])
+    rows = []
+    for result in current['results']:
+        old = previous.get(_key(result))
+        if old is None:
+            continue
+
+        ratio = result['median'] / old['median'] if old['median'] else None
+        rows.append(_key(result) + (old['median'], result['median'], ratio))
+
+    return rows
+
+
+def load_report(path):
+    with open(path) as fp:
+        return json.load(fp)
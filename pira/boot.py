@@ -1,35 +1,60 @@
 from __future__ import print_function
 
 import collections
-import importlib
 import os
 import subprocess
 import time
 import datetime
-import traceback
 import json
 import urllib
 
 import RPi.GPIO as gpio
 
+from .logger import get_logger, manager as log_manager
+
+logger = get_logger(__name__)
+
 # Optional Resin support.
 try:
-    print("Importing resin...")
+    logger.info("Importing resin...")
     from resin import Resin
     RESIN_ENABLED = True
 except ImportError:
     RESIN_ENABLED = False
-    print("Importing resin failed.")
+    logger.warning("Importing resin failed.")
 '''
 # DEBUG
 RESIN_ENABLED = False
-print("resin commented out")
+logger.debug("resin commented out")
 '''
 
 from .hardware import devices, pirasmartuart
 from .state import State
 from .log import Log
-from .const import LOG_SYSTEM, LOG_DEVICE_VOLTAGE, LOG_DEVICE_TEMPERATURE
+from .metrics import Metrics
+from .bus import Bus
+from .clock import create_clock
+from .config import Config
+from .memory import MemoryTracker
+from .worker import UploadWorker, UPLOADER_MODULES
+from .energy import EnergyAccounting
+from .loader import ModuleLoader
+from .storage import Storage
+from . import files
+from . import iostats
+from .const import LOG_SYSTEM, LOG_DEVICE_VOLTAGE, LOG_DEVICE_TEMPERATURE, LOG_PIRA_VOLTAGE, LOG_PIRA_OVERVIEW
+
+# Pira is considered connected while its telemetry is at most this many seconds old.
+PIRA_TELEMETRY_MAX_AGE = 10
+
+# RTC is written only when it is behind system time by more than this many seconds.
+PIRA_TIME_TOLERANCE = 2
+
+# Telemetry fields whose changes are stored in the log.
+PIRA_TRANSITION_LOG = {
+    'voltage': LOG_PIRA_VOLTAGE,
+    'on_timer_set': LOG_PIRA_OVERVIEW,
+}
 
 
 class Boot(object):
@@ -62,29 +87,61 @@ class Boot(object):
         self.shutdown = False
         self.shutdown_hold = None
         self._charging_status = collections.deque(maxlen=4)
+        self.metrics = Metrics()
+        iostats.stats.bind(self.metrics)
+        files.writer.bind(self.metrics)
+        self.bus = Bus()
+        self.clock = create_clock(os.environ)
+        self.config = Config()
+        self.memory = MemoryTracker(metrics=self.metrics)
+        self.worker = None
+        self.worker_modules = []
 
     def setup_gpio(self):
         """Initialize GPIO."""
-        print("Initializing GPIO...")
+        logger.info("Initializing GPIO...")
         gpio.setmode(gpio.BCM)
 
         gpio.setup(devices.GPIO_PIRA_STATUS_PIN, gpio.OUT, initial=gpio.HIGH)
         # Power switch output for external loads
         gpio.setup(devices.GPIO_SOFT_POWER_PIN, gpio.OUT, initial=gpio.LOW)
 
+    def setup_worker(self):
+        """Select enabled modules and start the upload worker for uploader modules.
+
+        The worker is started before any threads (pira smart reader, module initialization),
+        so it is not forked while another thread holds a lock.
+        """
+        # Override module list if configured.
+        override_modules = os.environ.get('MODULES', None)
+        if override_modules:
+            logger.info("Only loading configured modules.")
+            self.enabled_modules = override_modules.strip().split(',')
+
+        # Uploader modules may run in a separate worker process.
+        self.worker_modules = []
+        if os.environ.get('UPLOAD_WORKER', '0') == '1':
+            self.worker_modules = [name for name in self.enabled_modules if name in UPLOADER_MODULES]
+
+        if self.worker_modules:
+            main_modules = [name for name in self.enabled_modules if name not in self.worker_modules]
+            self.worker = UploadWorker(self, self.worker_modules, main_modules)
+            self.worker.start()
+
     def setup_devices(self):
         """Initialize device drivers."""
-        print("Initializing device drivers...")
-        self.pirasmart = pirasmartuart.PIRASMARTUART(devices.PIRASMART_UART)
+        logger.info("Initializing device drivers...")
+        self.pirasmart = pirasmartuart.PIRASMARTUART(devices.PIRASMART_UART, clock=self.clock)
+        self.pirasmart.start()
 
     def setup_wifi(self):
         """Setup wifi."""
         if not self.is_wifi_enabled:
-            print("Not starting wifi as it is disabled.")
+            logger.info("Not starting wifi as it is disabled.")
             return
 
         # Enable wifi.
-        print("Enabling wifi.")
+        logger.info("Enabling wifi.")
         try:
             if RESIN_ENABLED:
                 self._wifi = subprocess.Popen(["./scripts/wifi-connect-start.sh"])
@@ -92,33 +149,47 @@ class Boot(object):
             else:
                 subprocess.call(["./scripts/start-networking.sh"])
         except:
-            print("ERROR: Failed to start wifi-connect.")
+            logger.exception("Failed to start wifi-connect.")
 
     def boot(self):
         """Perform boot sequence."""
-        print("Performing boot sequence.")
+        log_manager.install_handlers()
+        logger.info("Performing boot sequence.")
 
         if os.environ.get('BOOT_DISABLE', '0') == '1':
-            print("Boot has been disabled (BOOT_DISABLE=1). Not booting further.")
+            logger.warning("Boot has been disabled (BOOT_DISABLE=1). Not booting further.")
             while True:
                 time.sleep(1)
 
         self.setup_gpio()
+        self.setup_worker()
         self.setup_devices()
         self.setup_wifi()
 
         self.state = State()
-        self.log = Log()
+        self.log = Log(metrics=self.metrics, clock=self.clock)
+        self.log.set_deadband(LOG_DEVICE_VOLTAGE)
         self.log.insert(LOG_SYSTEM, 'boot')
+        self.storage = Storage(self)
 
         self._update_charging()
 
         # Initialize Resin
         if RESIN_ENABLED:
             self._resin = Resin()
+            if os.environ.get('RESIN_API_KEY', None):
+                self.config.env_source = self._get_resin_environment
 
         self.process()
 
+    def _get_resin_environment(self):
+        """Get device environment variables from Resin."""
+        if not self._resin.auth.is_logged_in():
+            self._resin.auth.login_with_token(os.environ['RESIN_API_KEY'])
+
+        variables = self._resin.models.environment_variables.device.get_all(os.environ['RESIN_DEVICE_UUID'])
+        return dict((variable.get('name', variable.get('env_var_name')), variable['value']) for variable in variables)
+
     def parse_environ(self, env):
         """Parse environment variable"""
         try:
@@ -138,27 +209,30 @@ class Boot(object):
         #https://forums.resin.io/t/check-ntp-synchronization-status-from-python/1262
         # Simplest logic is to take the latest of the system and RTC time
         # This assumes the clock that is behind is always wrong
-        # Get latest values from pira smart
+        # Wait for values from pira smart
 
-        self.pira_ok = self.pirasmart.read()
+        self.pira_ok = self.pirasmart.wait()
         if self.pira_ok:
             rtc_time = self.get_time()
         else:
-            rtc_time = datetime.datetime.now()
+            rtc_time = self.clock.now()
 
-        system_time = datetime.datetime.now()
+        system_time = self.clock.now()
 
-        if rtc_time > system_time:
+        if self.clock.simulated:
+            # Simulated time must never be written to the system clock or RTC
+            logger.info("Simulated clock, not synchronizing system time and RTC")
+        elif rtc_time > system_time:
             #write RTC to system
-            print("Writing RTC to system time")
+            logger.info("Writing RTC to system time")
             args = ['date', '-s', rtc_time.strftime("%Y-%m-%d %H:%M:%S")]
             subprocess.Popen(args)
             #note if ntp is running it will override this, meaning there is network time
-        elif rtc_time < system_time:
+        elif (system_time - rtc_time).total_seconds() > PIRA_TIME_TOLERANCE:
             #write system_time to rtc
-            print("Writing system time to RTC")
-            epoch_string = datetime.datetime.now().strftime('%s')
-            self.pirasmart.set_time(epoch_string)
+            logger.info("Writing system time to RTC")
+            epoch_string = self.clock.now().strftime('%s')
+            self.pirasmart.queue('t', epoch_string)
 
         else:
             #if equal no need to do anything
@@ -171,87 +245,111 @@ class Boot(object):
             pira_wakeup_time = self.parse_environ(os.environ.get('PIRA_WAKEUP', None))
 
             if (pira_on_time is not None):
-                print("PIRA BLE: Setting new safety on (p) value.")
-                self.pirasmart.set_on_time(pira_on_time)
-                time.sleep(0.1)
+                logger.info("PIRA BLE: Setting new safety on (p) value.")
+                self.pirasmart.queue('p', pira_on_time)
             if (pira_off_time is not None):
-                print("PIRA BLE: Setting new safety off (s) value.")
-                self.pirasmart.set_off_time(pira_off_time)
-                time.sleep(0.1)
+                logger.info("PIRA BLE: Setting new safety off (s) value.")
+                self.pirasmart.queue('s', pira_off_time)
             if (pira_reboot_time is not None):
-                print("PIRA BLE: Setting new reboot (r) value.")
-                self.pirasmart.set_reboot_time(pira_reboot_time)
-                time.sleep(0.1)
+                logger.info("PIRA BLE: Setting new reboot (r) value.")
+                self.pirasmart.queue('r', pira_reboot_time)
             if (pira_wakeup_time is not None):
-                print("PIRA BLE: Setting new wakeup (w) value.")
-                self.pirasmart.set_wakeup_time(pira_wakeup_time)
-                time.sleep(0.1)
-
-        # Override module list if configured.
-        override_modules = os.environ.get('MODULES', None)
-        if override_modules:
-            print("Only loading configured modules.")
-            self.enabled_modules = override_modules.strip().split(',')
-
-        # Initialize modules.
-        print("Initializing modules...")
-        self.modules = collections.OrderedDict()
-        for module_name in self.enabled_modules:
-            try:
-                module = importlib.import_module(module_name)
-            except ImportError:
-                print("ImportError  * {} [IMPORT FAILED]".format(module_name))
-                traceback.print_exc()
-                continue
-            except ValueError:
-                print("ValueError  * {} [IMPORT FAILED]".format(module_name))
-                continue
+                logger.info("PIRA BLE: Setting new wakeup (w) value.")
+                self.pirasmart.queue('w', pira_wakeup_time)
 
-            print("  * {}".format(module.__name__))
+        if self.pira_ok:
+            # Queued values are written in one burst and confirmed by telemetry
+            self.pirasmart.flush()
 
-            try:
-                instance = module.Module(self)
-                self.modules[module.__name__] = instance
-            except:
-                print("Error while initializing a module.")
-                traceback.print_exc()
+        # Initialize modules, uploader modules were started in the worker.
+        logger.info("Initializing modules...")
+        self.loader = ModuleLoader(self)
+        self.modules = self.loader.load([name for name in self.enabled_modules if name not in self.worker_modules])
 
+        self.energy = EnergyAccounting(self)
         self.log.insert(LOG_SYSTEM, 'main_loop')
 
+        loop_duration = self.metrics.histogram(
+            'pira_loop_duration_seconds',
+            'Duration of a single processing loop iteration (without the loop delay).'
+        )
+        module_duration = self.metrics.histogram(
+            'pira_module_duration_seconds',
+            'Duration of module processing.'
+        )
+        battery_voltage = self.metrics.gauge('pira_battery_voltage_volts', 'Battery voltage reported by Pira.')
+
+        io_log_interval = float(os.environ.get('IO_LOG_INTERVAL', '3600'))
+        io_logged = self.clock.time()
 
         # Enter main loop.
-        print("Starting processing loop.")
+        logger.info("Starting processing loop.")
         while True:
+            loop_start = time.time()
+
+            # Apply configuration changes.
+            self.config.reload()
 
-            # Get latest values from pira smart
-            self.pira_ok = self.pirasmart.read()
+            # Add modules which finished initialization in background.
+            self.loader.update(self.modules)
+
+            # Latest values from pira smart are read in background
+            self.pira_ok = self._is_pira_connected()
+            self._store_pira_transitions()
             # Shutdown hold is reset in every loop
             self.shutdown_hold = None
 
+            self.energy.account()
+
             # TODO:Store some general log entries.
             self.log.insert(LOG_DEVICE_VOLTAGE, self.get_voltage())
+            battery_voltage.set(self.get_voltage())
             #self.log.insert(LOG_DEVICE_TEMPERATURE, self.rtc.temperature)
 
             # Process all modules.
             for name, module in self.modules.items():
+                self.memory.before(name)
+                module_start = time.time()
                 try:
                     module.process(self.modules)
                 except:
-                    print("Error while running processing in module '{}'.".format(name))
-                    traceback.print_exc()
+                    logger.exception("Error while running processing in module '{}'.", name)
+                module_time = time.time() - module_start
+                module_duration.observe(module_time, module=name)
+                self.energy.record_module(name, module_time)
+                self.memory.after(name)
+
+            if self.worker is not None:
+                self.worker.tick()
 
             # If pira is connected, check if battery voltage is below threshold and shutdown
             if self.pira_ok:
-                if ((self.get_voltage() is not None) and (self.get_voltage() <= float(os.environ.get('SHUTDOWN_VOLTAGE', '2.6')))):
-                    print("Voltage is under the threshold, need to shutdown.")
+                if ((self.get_voltage() is not None) and (self.get_voltage() <= self.config.shutdown_voltage)):
+                    logger.warning("Voltage is under the threshold, need to shutdown.")
                     self.shutdown = True
 
             # Save state.
             try:
                 self.state.save()
             except:
-                print("Error while saving state.")
-                traceback.print_exc()
+                logger.exception("Error while saving state.")
+
+            # Store counts of change-only log keys, so a power cut loses at most this loop.
+            try:
+                self.log.flush()
+            except:
+                logger.exception("Error while flushing log.")
+
+            # Sync files written in this loop.
+            try:
+                files.sync()
+            except:
+                logger.exception("Error while syncing files.")
+
+            # Store I/O totals.
+            if self.clock.time() - io_logged >= io_log_interval:
+                iostats.stats.log_totals(self.log)
+                io_logged = self.clock.time()
 
             # Perform shutdown when requested. This will either request the Resin
             # supervisor to shut down and block forever or the shutdown request will
@@ -260,16 +358,33 @@ class Boot(object):
                 self.shutdown = False
                 self._perform_shutdown()
 
-            time.sleep(float(os.environ.get('LOOP_DELAY', "60")))
+            loop_duration.observe(time.time() - loop_start)
+            self.clock.sleep(self.config.loop_delay)
 
     def _update_charging(self):
         """Get charging status."""
         # TODO
         self._charging_status.append(False)
 
+    def _is_pira_connected(self):
+        """Check that complete and recent telemetry from pira smart is available."""
+        age = self.get_pira_telemetry_age()
+        return self.pirasmart.snapshot.complete and age is not None and age <= PIRA_TELEMETRY_MAX_AGE
+
+    def _store_pira_transitions(self):
+        """Store changes of pira smart values in the log."""
+        self.log.insert_many(
+            (PIRA_TRANSITION_LOG[field], value, datetime.datetime.fromtimestamp(timestamp))
+            for timestamp, field, value in self.pirasmart.pop_transitions()
+        )
+
+    def get_pira_telemetry_age(self):
+        """Get age of pira smart values in seconds, None if nothing was received """
+        return self.pirasmart.age()
+
     def get_voltage(self):  # b variable
         """Get voltage """
-        voltage = self.pirasmart.pira_voltage
+        voltage = self.pirasmart.snapshot.voltage
         return voltage
 
     def get_temperature(self):
@@ -279,32 +394,32 @@ class Boot(object):
 
     def get_time(self): # t variable
         """Get time """
-        t_utc = datetime.datetime.utcfromtimestamp(self.pirasmart.pira_time)
+        t_utc = datetime.datetime.utcfromtimestamp(self.pirasmart.snapshot.time)
         return t_utc
 
     def get_pira_on_timer(self):    # p variable
         """Get pira on timer """
-        timer_pira = self.pirasmart.pira_on_timer_get
+        timer_pira = self.pirasmart.snapshot.on_timer_get
         return timer_pira
 
     def get_pira_on_timer_set(self):    # o variable
         """Get pira overwiev - status value """
-        timer_pira = self.pirasmart.pira_on_timer_set
+        timer_pira = self.pirasmart.snapshot.on_timer_set
         return timer_pira
 
     def get_pira_sleep_timer(self): # s variable
         """Get pira sleep timer"""
-        sleep_timer = self.pirasmart.pira_sleep
+        sleep_timer = self.pirasmart.snapshot.sleep
         return sleep_timer
 
     def get_pira_reboot_timer(self):    # r variable
         """Get pira reboot period duration"""
-        reboot_timer = self.pirasmart.pira_reboot
+        reboot_timer = self.pirasmart.snapshot.reboot
         return reboot_timer
 
     def get_pira_wakeup_timer(self):    # w variable
         """Get pira next scheduled wakeup  """
-        wakeup_timer = self.pirasmart.pira_next_wakeup_get
+        wakeup_timer = self.pirasmart.snapshot.next_wakeup_get
         return wakeup_timer
 
     @property
@@ -313,7 +428,7 @@ class Boot(object):
 
     @property
     def is_wifi_enabled(self):
-        wifi_mode = os.environ.get('WIFI_ENABLE_MODE', 'charging')
+        wifi_mode = self.config.wifi_enable_mode
 
         if wifi_mode == 'charging':
             return self.is_charging == 1
@@ -326,7 +441,7 @@ class Boot(object):
 
     @property
     def is_debug_enabled(self):
-        debug_mode = os.environ.get('DEBUG_ENABLE_MODE', 'none')
+        debug_mode = self.config.debug_enable_mode
 
         if debug_mode.startswith('gpio:'):
             # Based on GPIO.
@@ -334,7 +449,7 @@ class Boot(object):
                 _, pin = debug_mode.split(':')
                 pin = int(pin)
             except ValueError:
-                print("Invalid GPIO pin specified for debug.")
+                logger.error("Invalid GPIO pin specified for debug.")
                 return True
 
             # Read from given GPIO pin.
@@ -343,7 +458,7 @@ class Boot(object):
 
     def shutdown(self):
         """Request shutdown."""
-        print("Module has requested shutdown.")
+        logger.info("Module has requested shutdown.")
         self.shutdown = True
 
     def _perform_shutdown(self):
@@ -354,56 +469,60 @@ class Boot(object):
             device_status = self._resin.models.supervisor.get_device_state()
             #print (device_status)
             if device_status['status'] != 'Idle' or device_status['update_pending']:
-                print ("Device not ready to shutdown...")
+                logger.info("Device not ready to shutdown...")
                 return
         
-        sleep_mode = os.environ.get('SLEEP_ENABLE_MODE', 'sleep')
+        sleep_mode = self.config.sleep_enable_mode
 
         if sleep_mode == 'charging' and self.is_charging == 1:
-            print("Not shutting down: Charging.")
+            logger.info("Not shutting down: Charging.")
             return
         elif sleep_mode == 'off':
-            print("Not shutting down: Sleep off.")
+            logger.info("Not shutting down: Sleep off.")
             return
         elif sleep_mode == 'sleep':
             pass
 
         if sleep_mode == 'debug' and self.is_debug_enabled == 1:
-            print("Shutting down even during debug.")
+            logger.info("Shutting down even during debug.")
             pass
         elif self.is_debug_enabled == 1:
-            print("Not shutting down: Debug on.")
+            logger.info("Not shutting down: Debug on.")
             return
 
         if not self.shutdown_hold == None:
-            print("Not shutting down: On hold due to: "+self.shutdown_hold)
+            logger.info("Not shutting down: On hold due to: {}", self.shutdown_hold)
             return
 
         self.log.insert(LOG_SYSTEM, 'shutdown')
+        self.energy.account()
+        self.energy.report_cycle()
 
-        print("Requesting all modules to shut down.")
+        logger.info("Requesting all modules to shut down.")
         for name, module in self.modules.items():
             try:
                 module.shutdown(self.modules)
             except:
-                print("Error while running shutdown in module '{}'.".format(name))
-                traceback.print_exc()
+                logger.exception("Error while running shutdown in module '{}'.", name)
+
+        if self.worker is not None:
+            self.worker.shutdown()
 
         # Shut down devices.
         try:
             if self.is_wifi_enabled and self._wifi:
                 self._wifi.kill()
         except:
-            print("Error while shutting down devices.")
-            traceback.print_exc()
+            logger.exception("Error while shutting down devices.")
 
         # Save state.
         try:
             self.state.save()
+            files.sync()
         except:
-            print("Error while saving state.")
-            traceback.print_exc()
+            logger.exception("Error while saving state.")
 
+        iostats.stats.log_totals(self.log)
         self.log.insert(LOG_SYSTEM, 'halt')
         self.log.close()
 
@@ -411,13 +530,12 @@ class Boot(object):
         try:
             subprocess.call('sync')
         except:
-            print("Error while forcing filesystem sync.")
-            traceback.print_exc()
+            logger.exception("Error while forcing filesystem sync.")
 
         # TODO: handle error curl: (7) Failed to connect to 127.0.0.1 port 48484: Connection refused RESIN ERROR
 
         # Turn off the pira status pin then shutdown
-        print('Shutting down as scheduled with shutdown.')
+        logger.warning('Shutting down as scheduled with shutdown.')
         gpio.output(devices.GPIO_PIRA_STATUS_PIN, gpio.LOW)
 
         if RESIN_ENABLED:
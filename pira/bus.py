@@ -0,0 +1,130 @@
+"""
+bus.py
+
+In-process publish/subscribe bus used by modules to share samples without serializing
+them. Producers publish immutable batches (tuples of samples) to typed topics and
+consumers read them through cursors, which return the very same batch objects.
+"""
+import collections
+import itertools
+import threading
+
+# Default number of batches retained per topic.
+DEFAULT_RETENTION = 64
+
+# Generic sample, series identifies the measured value (e.g. "1_2_0" for CAN).
+Sample = collections.namedtuple('Sample', ['series', 'timestamp', 'value'])
+
+# Published batch of samples.
+Batch = collections.namedtuple('Batch', ['sequence', 'timestamp', 'samples'])
+
+
+class Topic(object):
+    """Bounded sequence of batches of a single sample type."""
+
+    def __init__(self, name, sample_type=None, retention=DEFAULT_RETENTION):
+        self.name = name
+        self.sample_type = sample_type
+        self.batches = collections.deque(maxlen=retention)
+        # Sequence number of the next published batch.
+        self.next_sequence = 0
+
+
+class Cursor(object):
+    """Read position of a single consumer in a topic."""
+
+    def __init__(self, bus, topic, sequence):
+        self._bus = bus
+        self._topic = topic
+        self.sequence = sequence
+        # Number of batches dropped from the topic before this cursor could read them.
+        self.missed = 0
+
+    def read(self):
+        """Return list of batches published since the last read."""
+        with self._bus._lock:
+            batches = self._topic.batches
+            if not batches or self.sequence >= self._topic.next_sequence:
+                return []
+
+            first = batches[0].sequence
+            if self.sequence < first:
+                self.missed += first - self.sequence
+                self.sequence = first
+
+            result = list(itertools.islice(batches, self.sequence - first, None))
+            self.sequence = self._topic.next_sequence
+
+        return result
+
+    def samples(self):
+        """Return all samples published since the last read."""
+        return [sample for batch in self.read() for sample in batch.samples]
+
+
+class Bus(object):
+    """Publish/subscribe bus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._topics = {}
+
+    def _topic(self, name):
+        topic = self._topics.get(name)
+        if topic is None:
+            topic = self._topics[name] = Topic(name)
+        return topic
+
+    def declare(self, name, sample_type=Sample, retention=DEFAULT_RETENTION):
+        """Declare topic and the type of samples published to it."""
+        with self._lock:
+            topic = self._topic(name)
+            if topic.sample_type is not None and topic.sample_type is not sample_type:
+                raise TypeError("Topic '{}' already declared with a different sample type.".format(name))
+
+            topic.sample_type = sample_type
+            if topic.batches.maxlen != retention:
+                topic.batches = collections.deque(topic.batches, maxlen=retention)
+
+    def publish(self, name, samples, timestamp=None):
+        """Publish batch of samples, returns the published batch."""
+        samples = tuple(samples)
+
+        with self._lock:
+            topic = self._topic(name)
+            if topic.sample_type is None:
+                raise KeyError("Topic '{}' has not been declared.".format(name))
+
+            for sample in samples:
+                if not isinstance(sample, topic.sample_type):
+                    raise TypeError("Topic '{}' only accepts {} samples.".format(name, topic.sample_type.__name__))
+
+            batch = Batch(topic.next_sequence, timestamp, samples)
+            topic.batches.append(batch)
+            topic.next_sequence += 1
+
+        return batch
+
+    def cursor(self, name, from_start=False):
+        """Create cursor for the topic, by default only batches published from now on are read.
+
+        :param name: Topic name (topic may be declared later)
+        :param from_start: Also read batches that are still retained
+        """
+        with self._lock:
+            topic = self._topic(name)
+            if from_start and topic.batches:
+                sequence = topic.batches[0].sequence
+            else:
+                sequence = topic.next_sequence
+
+            return Cursor(self, topic, sequence)
+
+    def latest(self, name):
+        """Return the most recently published batch or None."""
+        with self._lock:
+            topic = self._topics.get(name)
+            if topic is None or not topic.batches:
+                return None
+
+            return topic.batches[-1]
@@ -0,0 +1,98 @@
+"""
+clock.py
+
+Clock service used by boot, modules and drivers instead of calling time/datetime directly.
+In simulated mode time runs from a configurable start and jumps ahead whenever something
+sleeps, so days of operation can be run in seconds.
+
+ENV VARS:
+    - CLOCK_MODE (default real), options are real or simulated
+    - CLOCK_START (default now), simulated start time, epoch seconds or YYYY-MM-DD HH:MM:SS
+"""
+import datetime
+import threading
+import time
+
+
+class RealClock(object):
+    """Wall clock."""
+
+    simulated = False
+
+    def time(self):
+        """Current time in seconds since epoch."""
+        return time.time()
+
+    def now(self):
+        """Current local time."""
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def utcnow(self):
+        """Current UTC time."""
+        return datetime.datetime.utcfromtimestamp(self.time())
+
+    def today(self):
+        """Current local date."""
+        return self.now().date()
+
+    def sleep(self, seconds):
+        """Block for the given number of seconds."""
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedClock(RealClock):
+    """Clock that follows the wall clock from a start time, but skips all sleeps."""
+
+    simulated = True
+
+    def __init__(self, start=None):
+        self._lock = threading.Lock()
+        self._offset = 0.0
+        if start is not None:
+            self._offset = start - time.time()
+
+    def time(self):
+        return time.time() + self._offset
+
+    def sleep(self, seconds):
+        """Jump ahead instead of blocking."""
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        """Move clock forward by the given number of seconds."""
+        if seconds <= 0:
+            return
+
+        with self._lock:
+            self._offset += seconds
+
+
+def _parse_start(value):
+    """Parse simulated start time."""
+    if not value:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    try:
+        start = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+    return time.mktime(start.timetuple())
+
+
+def create_clock(environ):
+    """Create clock as configured in the environment."""
+    if environ.get('CLOCK_MODE', 'real') == 'simulated':
+        return SimulatedClock(_parse_start(environ.get('CLOCK_START', None)))
+
+    return RealClock()
+
+
+# Default clock for drivers that are not given one explicitly.
+real_clock = RealClock()
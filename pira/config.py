@@ -0,0 +1,193 @@
+"""
+config.py
+
+Typed configuration. Environment variables used by the main loop and modules are parsed
+and validated once into typed attributes (e.g. config.loop_delay), so nothing is parsed
+in the loop. The sensor lookup table /data/config.json is loaded into config.sensors.
+
+The configuration is reloaded by boot once per loop: config.json is re-read when it
+changes on disk and, when an environment source is set (Resin device variables), the
+environment is polled periodically. The environment source makes network calls, so it is
+called in a background thread and reload() only applies the latest fetched environment,
+the loop never waits for the network. Modules subscribe to the fields they are interested
+in and get called with the names of the changed fields.
+
+ENV VARS:
+    - CONFIG_ENV_POLL_INTERVAL (default 900), seconds between polls of the environment source
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Sensor lookup table location.
+CONFIG_FILE = '/data/config.json'
+
+
+def _positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise ValueError("must be positive")
+    return value
+
+
+def _flag(value):
+    return str(value) == '1'
+
+
+def _choice(*options):
+    def parse(value):
+        if value not in options:
+            raise ValueError("must be one of {}".format(', '.join(options)))
+        return value
+    return parse
+
+
+# Single configuration field, parse raises ValueError for invalid values.
+Field = collections.namedtuple('Field', ['name', 'env', 'parse', 'default'])
+
+FIELDS = (
+    Field('loop_delay', 'LOOP_DELAY', _positive_float, 60.0),
+    Field('shutdown_voltage', 'SHUTDOWN_VOLTAGE', float, 2.6),
+    Field('sleep_enable_mode', 'SLEEP_ENABLE_MODE', _choice('sleep', 'charging', 'debug', 'off'), 'sleep'),
+    Field('wifi_enable_mode', 'WIFI_ENABLE_MODE', _choice('on', 'charging', 'debug', 'off'), 'charging'),
+    Field('debug_enable_mode', 'DEBUG_ENABLE_MODE', str, 'none'),
+    Field('sleep_when_charging', 'SLEEP_WHEN_CHARGING', _flag, False),
+    Field('camera_fail_shutdown', 'CAMERA_FAIL_SHUTDOWN', _flag, False),
+    Field('can_run', 'CAN_RUN', _choice('cont', 'once'), 'cont'),
+    Field('processing_run', 'PROCESSING_RUN', _choice('cont', 'once'), 'cont'),
+    Field('azure_run', 'AZURE_RUN', _choice('cont', 'once', 'daily', 'retry'), 'cont'),
+    Field('m2x_run', 'M2X_RUN', _choice('cont', 'once'), 'cont'),
+)
+
+
+class Config(object):
+    """Typed configuration with change notifications."""
+
+    def __init__(self, environ=os.environ, config_file=CONFIG_FILE, env_source=None):
+        self._environ = dict(environ)
+        self._config_file = config_file
+        self._config_mtime = None
+        self._subscribers = []
+        self._env_poll_interval = float(environ.get('CONFIG_ENV_POLL_INTERVAL', '900'))
+        self._env_polled = 0
+        self._env_lock = threading.Lock()
+        # Background fetch of the environment and its result, until applied.
+        self._env_fetch = None
+        self._env_overrides = None
+        self.env_source = env_source
+
+        for field in FIELDS:
+            setattr(self, field.name, field.default)
+        self.sensors = None
+
+        self._apply_environ(self._environ)
+        self._load_sensors()
+
+    def _apply_environ(self, environ):
+        """Parse environment, returns set of changed field names."""
+        changed = set()
+        for field in FIELDS:
+            raw = environ.get(field.env, None)
+            if raw is None:
+                value = field.default
+            else:
+                try:
+                    value = field.parse(raw)
+                except (TypeError, ValueError) as e:
+                    logger.warning("Invalid value of {}, using default.", field.env, value=raw, error=e, default=field.default)
+                    value = field.default
+
+            if getattr(self, field.name) != value:
+                setattr(self, field.name, value)
+                changed.add(field.name)
+
+        return changed
+
+    def _load_sensors(self):
+        """Load sensor lookup table if it changed, returns True on change."""
+        try:
+            mtime = os.stat(self._config_file).st_mtime
+        except OSError:
+            mtime = None
+
+        if mtime == self._config_mtime:
+            return False
+
+        self._config_mtime = mtime
+        sensors = None
+        if mtime is not None:
+            # Empty file is deleted, so the azure module will download it again.
+            if os.path.getsize(self._config_file) == 0:
+                logger.warning("config.json file is empty, deleting it.")
+                os.remove(self._config_file)
+                self._config_mtime = None
+            else:
+                try:
+                    with open(self._config_file, 'rb') as fp:
+                        sensors = json.load(fp)
+                except (IOError, ValueError) as e:
+                    logger.error("Failed to load config.json: {}", e)
+
+        if sensors == self.sensors:
+            return False
+
+        self.sensors = sensors
+        return True
+
+    def subscribe(self, callback, *names):
+        """Call callback(config, changed) when any of the given fields (or any field if none given) changes."""
+        self._subscribers.append((callback, set(names)))
+
+    def _fetch_environ(self, env_source):
+        """Get environment from the source, called in a background thread."""
+        try:
+            overrides = env_source()
+        except Exception as e:
+            logger.warning("Failed to get environment: {}", e)
+            return
+
+        if overrides is not None:
+            with self._env_lock:
+                self._env_overrides = overrides
+
+    def reload(self):
+        """Reload changed configuration and notify subscribers."""
+        changed = set()
+        if self._load_sensors():
+            changed.add('sensors')
+
+        now = time.time()
+        fetching = self._env_fetch is not None and self._env_fetch.is_alive()
+        if self.env_source is not None and not fetching and now - self._env_polled >= self._env_poll_interval:
+            self._env_polled = now
+            self._env_fetch = threading.Thread(target=self._fetch_environ, args=(self.env_source,), name='config-environ')
+            self._env_fetch.daemon = True
+            self._env_fetch.start()
+
+        with self._env_lock:
+            overrides, self._env_overrides = self._env_overrides, None
+        if overrides is not None:
+            environ = dict(self._environ)
+            environ.update(overrides)
+            changed |= self._apply_environ(environ)
+
+        if not changed:
+            return changed
+
+        logger.info("Configuration changed.", fields=','.join(sorted(changed)))
+        for callback, names in self._subscribers:
+            if names and not names & changed:
+                continue
+
+            try:
+                callback(self, changed)
+            except:
+                logger.exception("Error while applying configuration change.")
+
+        return changed
@@ -4,7 +4,16 @@ from .messages import MeasurementConfig
 LOG_SYSTEM = 'system'
 LOG_DEVICE_VOLTAGE = 'device.voltage'
 LOG_DEVICE_TEMPERATURE = 'device.temperature'
+LOG_PIRA_VOLTAGE = 'pira.voltage'
+LOG_PIRA_OVERVIEW = 'pira.overview'
+
+# Bus topics.
+TOPIC_CAN_SAMPLES = 'can.samples'
+TOPIC_ULTRASONIC_DISTANCE = 'ultrasonic.distance'
 
 # Measurement configuration.
 MEASUREMENT_DEVICE_VOLTAGE = MeasurementConfig(LOG_DEVICE_VOLTAGE, lambda value: int(value * 1000))
 MEASUREMENT_DEVICE_TEMPERATURE = MeasurementConfig(LOG_DEVICE_TEMPERATURE, lambda value: int(value + 128))
+
+# Metrics.
+METRIC_UPLOADED_BYTES = 'pira_uploaded_bytes_total'
@@ -0,0 +1,171 @@
+"""
+energy.py
+
+Per-module energy accounting. Energy is estimated from module runtime and configurable
+power profiles of the peripherals used by each module, on top of the base power draw of
+the board. Time outside of modules is accounted to the system and, when wifi is enabled,
+wifi is accounted for the whole loop.
+
+Daily totals (in mWh) are kept in state across wake cycles and stored in the log when
+the day changes. To cross-check the estimate, the measured drop of Pira battery voltage
+(while not charging) is stored together with the drop expected from the estimate.
+
+ENV VARS:
+    - ENERGY_BASE_POWER (default 600), board power draw in mW
+    - ENERGY_PROFILES (default empty), overrides of peripheral power draw in mW,
+      e.g. "pira.modules.camera=1200,wifi=400"
+    - ENERGY_BATTERY_CAPACITY (default 9.6), battery capacity in Wh
+    - ENERGY_BATTERY_FULL (default 4.2), battery voltage when full
+    - ENERGY_BATTERY_EMPTY (default 3.0), battery voltage when empty
+"""
+import os
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Default peripheral power draw in mW (in addition to the base power).
+DEFAULT_PROFILES = {
+    'pira.modules.camera': 1000.0,
+    'pira.modules.can': 250.0,
+    'pira.modules.rockblock': 800.0,
+    'pira.modules.lora': 400.0,
+    'wifi': 400.0,
+}
+
+# Accounting names for time outside of modules and for wifi.
+SYSTEM = 'system'
+WIFI = 'wifi'
+
+# Log events.
+LOG_ENERGY_DAILY = 'energy.daily'
+LOG_ENERGY_VOLTAGE_DROP = 'energy.daily.voltage_drop'
+LOG_ENERGY_EXPECTED_VOLTAGE_DROP = 'energy.daily.expected_voltage_drop'
+
+# State keys.
+STATE_ENERGY_DAY = 'energy.day'
+STATE_ENERGY_TOTALS = 'energy.totals'
+STATE_ENERGY_DISCHARGE = 'energy.discharge'
+
+
+def parse_profiles(value):
+    """Parse power profile overrides, returns dict of name -> mW."""
+    profiles = dict(DEFAULT_PROFILES)
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+
+        name, power = item.split('=', 1)
+        try:
+            profiles[name.strip()] = float(power)
+        except ValueError:
+            logger.warning("Ignoring invalid power profile.", profile=item)
+
+    return profiles
+
+
+class EnergyAccounting(object):
+    """Estimates energy used by modules."""
+
+    def __init__(self, boot, environ=os.environ):
+        self._boot = boot
+        self.base_power = float(environ.get('ENERGY_BASE_POWER', '600'))
+        self.profiles = parse_profiles(environ.get('ENERGY_PROFILES', ''))
+        capacity = float(environ.get('ENERGY_BATTERY_CAPACITY', '9.6')) * 1000.0
+        voltage_range = float(environ.get('ENERGY_BATTERY_FULL', '4.2')) - float(environ.get('ENERGY_BATTERY_EMPTY', '3.0'))
+        # Expected voltage drop per mWh, assuming linear discharge.
+        self._volts_per_mwh = voltage_range / capacity
+
+        self._last_time = boot.clock.time()
+        self._last_voltage = boot.get_voltage()
+        self._module_time = 0.0
+        # Energy used since the previous voltage sample, in mWh.
+        self._loop_energy = 0.0
+        # Energy used in this wake cycle, name -> mWh.
+        self.cycle = {}
+
+        self._energy_total = boot.metrics.counter(
+            'pira_energy_joules_total',
+            'Estimated energy used, by module.'
+        )
+
+    def _add(self, name, energy):
+        """Add energy (in mWh) to cycle and daily totals."""
+        self.cycle[name] = self.cycle.get(name, 0.0) + energy
+        self._loop_energy += energy
+        totals = self._boot.state[STATE_ENERGY_TOTALS] or {}
+        totals[name] = totals.get(name, 0.0) + energy
+        self._boot.state[STATE_ENERGY_TOTALS] = totals
+        self._energy_total.inc(energy * 3.6, module=name)
+
+    def record_module(self, name, duration):
+        """Account module run of the given duration (in seconds)."""
+        power = self.base_power + self.profiles.get(name, 0.0)
+        self._add(name, power * duration / 3600.0)
+        self._module_time += duration
+
+    def account(self):
+        """Account time since the previous call, called once per loop and at shutdown."""
+        now = self._boot.clock.time()
+        interval = max(0.0, now - self._last_time)
+        idle = max(0.0, interval - self._module_time)
+        self._last_time = now
+        self._module_time = 0.0
+
+        self._add(SYSTEM, self.base_power * idle / 3600.0)
+        if self._boot.is_wifi_enabled:
+            self._add(WIFI, self.profiles.get(WIFI, 0.0) * interval / 3600.0)
+
+        self._check_voltage()
+        self._check_day()
+
+    def _check_voltage(self):
+        """Track measured battery voltage drop and estimated energy while discharging."""
+        voltage = self._boot.get_voltage()
+        previous, self._last_voltage = self._last_voltage, voltage
+        energy, self._loop_energy = self._loop_energy, 0.0
+        if voltage is None or previous is None or self._boot.is_charging:
+            return
+
+        discharge = self._boot.state[STATE_ENERGY_DISCHARGE] or {'voltage_drop': 0.0, 'energy': 0.0}
+        discharge['voltage_drop'] += previous - voltage
+        discharge['energy'] += energy
+        self._boot.state[STATE_ENERGY_DISCHARGE] = discharge
+
+    def _check_day(self):
+        """Store daily totals in the log when the day changes."""
+        today = self._boot.clock.today()
+        day = self._boot.state[STATE_ENERGY_DAY]
+        if day is None:
+            self._boot.state[STATE_ENERGY_DAY] = today
+            return
+        if day == today:
+            return
+
+        totals = self._boot.state[STATE_ENERGY_TOTALS] or {}
+        discharge = self._boot.state[STATE_ENERGY_DISCHARGE]
+        timestamp = self._boot.clock.now()
+        for name, energy in sorted(totals.items()):
+            self._boot.log.insert('{}.{}'.format(LOG_ENERGY_DAILY, name), round(energy, 3), timestamp=timestamp)
+
+        if discharge is not None:
+            self._boot.log.insert(LOG_ENERGY_VOLTAGE_DROP, round(discharge['voltage_drop'], 3), timestamp=timestamp)
+            self._boot.log.insert(
+                LOG_ENERGY_EXPECTED_VOLTAGE_DROP,
+                round(discharge['energy'] * self._volts_per_mwh, 3),
+                timestamp=timestamp
+            )
+
+        logger.info("Daily energy budget", day=day, total=round(sum(totals.values()), 1), **dict(
+            (name, round(energy, 1)) for name, energy in totals.items()
+        ))
+
+        self._boot.state[STATE_ENERGY_DAY] = today
+        self._boot.state[STATE_ENERGY_TOTALS] = {}
+        self._boot.state[STATE_ENERGY_DISCHARGE] = None
+
+    def report_cycle(self):
+        """Log energy used in this wake cycle."""
+        logger.info("Wake cycle energy (mWh)", total=round(sum(self.cycle.values()), 1), **dict(
+            (name, round(energy, 1)) for name, energy in self.cycle.items()
+        ))
@@ -0,0 +1,131 @@
+"""
+files.py
+
+File output shared by all modules. Files are written either by atomic replace (data is
+written to a temporary file which is synced and renamed over the target, so readers and a
+crash only ever see the old or the new version) or by append. Appends do not wait for the
+data to reach storage and neither does the rename of a replaced file, instead appended
+files and directories of replaced files written since the previous sync are synced
+together once per loop by boot, so a loop costs one batch of flush barriers for them.
+
+Writes are accounted in iostats under the given subsystem.
+"""
+import os
+import threading
+import time
+
+from . import iostats
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Suffix of temporary files used for atomic replace.
+TEMP_SUFFIX = '.tmp'
+
+
+class FileWriter(object):
+    """Atomic replace and append with a group sync."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Path -> subsystem of files and directories waiting for sync.
+        self._files = {}
+        self._directories = {}
+        self._sync_duration = None
+
+    def after_fork(self):
+        """Forget files of the parent in a forked child process, the parent syncs them."""
+        self._lock = threading.Lock()
+        self._files = {}
+        self._directories = {}
+        self._sync_duration = None
+
+    def bind(self, metrics):
+        """Export sync duration as a metric."""
+        self._sync_duration = metrics.histogram('pira_file_sync_seconds', 'Duration of the group sync of written files.')
+
+    def _schedule(self, subsystem, path, file=True, directory=False):
+        with self._lock:
+            if file:
+                self._files[path] = subsystem
+            if directory:
+                self._directories[os.path.dirname(os.path.abspath(path))] = subsystem
+
+    def replace(self, subsystem, path, data):
+        """Atomically replace file contents with data."""
+        temp_path = path + TEMP_SUFFIX
+        try:
+            with iostats.open_file(subsystem, temp_path, 'wb') as fp:
+                fp.write(data)
+                # Data must be on storage before the rename, else a power loss may leave an
+                # empty or partially written target.
+                fp.fsync()
+            os.rename(temp_path, path)
+        except:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self._schedule(subsystem, path, file=False, directory=True)
+
+    def append(self, subsystem, path, data):
+        """Append data to file, the file is created if it does not exist."""
+        created = not os.path.exists(path)
+        with iostats.open_file(subsystem, path, 'ab') as fp:
+            fp.write(data)
+
+        self._schedule(subsystem, path, directory=created)
+
+    def _fsync(self, subsystem, path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            # File was removed (e.g. evicted) before it was synced.
+            return
+
+        try:
+            os.fsync(fd)
+            iostats.record(subsystem, fsyncs=1)
+        except OSError:
+            logger.warning("Failed to sync file.", path=path)
+        finally:
+            os.close(fd)
+
+    def sync(self):
+        """Sync all files written since the previous sync, then their directories."""
+        with self._lock:
+            files, self._files = self._files, {}
+            directories, self._directories = self._directories, {}
+
+        if not files and not directories:
+            return
+
+        start = time.time()
+        for path, subsystem in sorted(files.items()):
+            self._fsync(subsystem, path)
+        for path, subsystem in sorted(directories.items()):
+            self._fsync(subsystem, path)
+
+        if self._sync_duration is not None:
+            self._sync_duration.observe(time.time() - start)
+
+
+# Process-wide file writer.
+writer = FileWriter()
+
+
+def replace(subsystem, path, data):
+    """Atomically replace file contents with data."""
+    writer.replace(subsystem, path, data)
+
+
+def append(subsystem, path, data):
+    """Append data to file."""
+    writer.append(subsystem, path, data)
+
+
+def sync():
+    """Sync all files written since the previous sync."""
+    writer.sync()
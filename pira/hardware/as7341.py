@@ -6,6 +6,10 @@ SMUX multiplexer configuration doc: AN_AS7341_SMUX_configuration_1V0.pdf
 import smbus
 from time import sleep
 
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 # I2C init infos
 I2C_CHANNEL = 1      # selected i2c channel on rpi
 LIGHT_ADDR = 0x39    # sensor address
@@ -26,8 +30,7 @@ class AS7341(object):
         try:
             self._bus = smbus.SMBus(I2C_CHANNEL)
         except:
-            print("Bus on channel {} is not available.").format(I2C_CHANNEL)
-            print("Available busses are listed as /dev/i2c*")
+            logger.error("Bus on channel {} is not available, available busses are listed as /dev/i2c*", I2C_CHANNEL)
             self._bus = None
 
     def init(self):
@@ -49,7 +52,7 @@ class AS7341(object):
 
         except Exception as e:
             #print("ERROR - AS7341: init has failed - {}".format(e))
-            print("ERROR - AS7341: initializaton has failed.")
+            logger.error("AS7341: initializaton has failed.")
             return False
 
     def get_data(self, part_num):
@@ -61,7 +64,7 @@ class AS7341(object):
         Returns list of results from all channels or empty list if error
         '''
         if part_num < 0 or part_num > 1:
-            print("ERROR - AS7341: Wrong channels selected (options are 0 and 1!")
+            logger.error("AS7341: Wrong channels selected (options are 0 and 1)!")
             return [] 
 
         # configure to read specified part of channels
@@ -79,7 +82,7 @@ class AS7341(object):
             enabled = self.get_smux_status()
             timeout += 1
             if timeout >= self.AS_READ_TIMEOUT:
-                print("WARNING - AS7341: smux config wait has timed out!")
+                logger.warning("AS7341: smux config wait has timed out!")
                 return []
             sleep(0.01)
 
@@ -94,7 +97,7 @@ class AS7341(object):
             data_ready = self.is_data_ready()
             timeout += 1
             if timeout >= self.AS_READ_TIMEOUT:
-                print("WARNING - AS7341: data wait has timed out!")
+                logger.warning("AS7341: data wait has timed out!")
                 return []
             sleep(0.01)
         #print("AS7341: Configuration {} done, data available to read.").format(part_num)
@@ -13,6 +13,10 @@ __version__ = "1.0"
 import smbus
 import time
 
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 # Global variables to quickly reference to groups of LEDs or individual ones.
 # The LED* ones can only be used on their own
 LED_ALL = (1, 2, 3, 4, 5, 6, 7, 8)
@@ -143,7 +147,7 @@ class BrightPiSpecialEffects(BrightPi):
                 self.set_led_on_off((2, 3), ON)
                 time.sleep(interval)
             else:
-                print("Wrong parameter for orientation")
+                logger.error("Wrong parameter for orientation")
 
     def night_rider(self, repetitions, delay, rotation = ROT_CW):
         # This method flashes one white LED after another as to give the impression of a rotating sequence
@@ -161,7 +165,7 @@ class BrightPiSpecialEffects(BrightPi):
                     time.sleep(delay)
                     self.set_led_on_off((i,), OFF)
         else:
-            print("Wrong parameter for rotation")
+            logger.error("Wrong parameter for rotation")
 
     def beacon(self, repetitions, speed):
         # This method changes the gain on all LEDs from min (0b0000) to max (0b1111)
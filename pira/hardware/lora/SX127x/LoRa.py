@@ -24,6 +24,9 @@ import sys
 import time
 from .constants import *
 from .board_config import BOARD
+from ....logger import get_logger
+
+logger = get_logger(__name__)
 
 
 ################################################## Some utility functions ##############################################
@@ -102,17 +105,17 @@ class LoRa(object):
             self.set_mode(MODE.SLEEP)
             returned_mode = self.get_mode()
             if returned_mode & 0b00000110 is not 0:
-                print('LoRa: Entered incorrect mode: 0x%.2x'%(returned_mode))
+                logger.warning('LoRa: Entered incorrect mode: 0x%.2x'%(returned_mode))
                 time.sleep(0.05)
             else:
                 break;
 
         if returned_mode is 0 :
-            print('LoRa: Failed to configure mode, check HW: 0x%.2x'%(returned_mode))
+            logger.error('LoRa: Failed to configure mode, check HW: 0x%.2x'%(returned_mode))
             assert False
         elif returned_mode & 0b00000110 is not 0 :
             #checking two sleep bytes only
-            print('LoRa: Entered incorrect mode: 0x%.2x'%(returned_mode))
+            logger.error('LoRa: Entered incorrect mode: 0x%.2x'%(returned_mode))
             assert False
         else:
             pass
@@ -5,6 +5,10 @@ Doc: MAX11612-MAX11617.pdf
 import smbus
 from time import sleep
 
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 # I2C init infos
 I2C_CHANNEL = 1      # selected i2c channel on rpi
 NDVI_ADDR = 0x33     # NDVI/PIR sensor address
@@ -23,8 +27,7 @@ class MAX11615(object):
         try:
             self._bus = smbus.SMBus(I2C_CHANNEL)
         except:
-            print("Bus on channel {} is not available.").format(I2C_CHANNEL)
-            print("Available busses are listed as /dev/i2c*")
+            logger.error("Bus on channel {} is not available, available busses are listed as /dev/i2c*", I2C_CHANNEL)
             self._bus = None
 
     def init(self):
@@ -48,7 +51,7 @@ class MAX11615(object):
 
         except Exception as e:
             #print("ERROR - MAX11616: init has failed - {}".format(e))
-            print("ERROR - MAX11616: initializaton has failed.")
+            logger.error("MAX11616: initializaton has failed.")
             return False
 
     def config(self, channel):
@@ -63,7 +66,7 @@ class MAX11615(object):
     def read_channel(self, channel):
         ''' Read one channel, returns received data converted to a number '''
         if channel < 0 or channel >= self.ADC_CHANNEL_COUNT:
-            print("ERROR - MAX11616: Nonexisting channel selected!")
+            logger.error("MAX11616: Nonexisting channel selected!")
             return -1
         
         # configure adc to read desired channel
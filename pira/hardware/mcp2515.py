@@ -5,6 +5,8 @@ Is the hardware that connects to the mcp2515
 
 ENV VARS:
     - CAN_SPEED (default 500000)
+    - CAN_INTERFACE (default can0), e.g. vcan0 for a virtual socketcan interface
+    - CAN_BUSTYPE (default socketcan_native), python-can interface, e.g. virtual for an in-process bus
 """
 
 from __future__ import print_function
@@ -13,6 +15,16 @@ import os
 import time
 import can
 
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
+# Mask matching standard frame identifiers exactly.
+CAN_SFF_MASK = 0x7FF
+
+# Seconds to wait for room in the transmit queue before sending fails.
+SEND_TIMEOUT = 0.1
+
 class MCP2515():
     
     def __init__(self):
@@ -20,35 +32,65 @@ class MCP2515():
         Inits MCP2515 at a baudrate and sets up the bus and the link
         """
         self._bitrate = os.environ.get('CAN_SPEED', '125000')
+        self._channel = os.environ.get('CAN_INTERFACE', 'can0')
+        self._bustype = os.environ.get('CAN_BUSTYPE', 'socketcan_native')
+        # Only a hardware interface has its link configured, virtual ones are set up by the user.
+        self._link = self._bustype.startswith('socketcan') and not self._channel.startswith('vcan')
         self._enabled = False
+        # Number of frames received and sent over the bus.
+        self.rx_frames = 0
+        self.tx_frames = 0
         # DEBUG
         #os.system("ifconfig")
         
         # setup the link
-        self.os_string = 'ip link set can0 up type can bitrate {}'.format(self._bitrate)
-        print("Executing {}".format(self.os_string))
+        self.os_string = 'ip link set {} up type can bitrate {}'.format(self._channel, self._bitrate)
         try:
-            # execute the link
-            os.system(self.os_string)
+            if self._link:
+                # execute the link
+                logger.debug("Executing {}", self.os_string)
+                os.system(self.os_string)
             
             try:
                 # create can object
-                self._bus = can.interface.Bus(channel='can0', bustype='socketcan_native')
+                self._bus = can.interface.Bus(channel=self._channel, bustype=self._bustype)
                 self._enabled = True
             except OSError:
-                print("Cannot find CAN board")
+                logger.error("Cannot find CAN board")
                 self._enabled = False
 
         except OSError:
-            print("Failed to os execute")
+            logger.error("Failed to os execute")
 
     def get_enabled(self):
         """ check if enabled """
         return self._enabled
     
+    def set_filters(self, ids):
+        """ Accept only frames with the given standard identifiers, all frames if ids is None
+
+        Filters are installed in the kernel (socketcan), frames from other identifiers never
+        reach the process.
+        """
+        filters = None
+        if ids is not None:
+            filters = [{'can_id': can_id, 'can_mask': CAN_SFF_MASK, 'extended': False} for can_id in sorted(ids)]
+        try:
+            self._bus.set_filters(filters)
+        except (NotImplementedError, OSError) as error:
+            logger.warning("Failed to set CAN filters: {}", error)
+
+    def receive(self, timeout):
+        """ Receive a frame, waiting up to timeout seconds, None if nothing was received """
+        message = self._bus.recv(timeout=timeout)
+        if message is not None:
+            self.rx_frames += 1
+        return message
+
     def get_raw_data(self):
         self._message = self._bus.recv(timeout=1.0)
         if self._message is not None:
+            self.rx_frames += 1
             return self._message
         return None
 
@@ -56,6 +98,7 @@ class MCP2515():
         """ waits until nothing received """
         self._message = self._bus.recv(timeout=1.0)
         if self._message is not None:
+            self.rx_frames += 1
             c = '{0:f} {1:x} {2:x} '.format(self._message.timestamp, self._message.arbitration_id, self._message.dlc)
             s = ''
             for i in range(self._message.dlc):
@@ -76,7 +119,8 @@ class MCP2515():
         self._DATA = DATA
         self._EXTID = EXTID
         self._message = can.Message(arbitration_id=self._ID, data=self._DATA, extended_id=self._EXTID)
-        self._bus.send(self._message)
+        self._bus.send(self._message, timeout=SEND_TIMEOUT)
+        self.tx_frames += 1
         #print("CAN: Sent to {}, data: {}".format(hex(self._ID), self._DATA))
 
     def format_data_timestamp(self, msg):
@@ -96,4 +140,7 @@ class MCP2515():
     
     def shutdown(self):
         """ shutdown the link """
-        os.system("ip link set can0 down")
+        if self._link:
+            os.system("ip link set {} down".format(self._channel))
+        else:
+            self._bus.shutdown()
@@ -2,6 +2,10 @@
 import smbus, os
 from time import sleep
 
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 # Models
 MODEL_02BA = 0
 MODEL_30BA = 1
@@ -50,8 +54,7 @@ class MS5837(object):
         try:
             self._bus = smbus.SMBus(bus)
         except:
-            print("Bus %d is not available.") % bus
-            print("Available busses are listed as /dev/i2c*")
+            logger.error("Bus {} is not available, available busses are listed as /dev/i2c*", bus)
             self._bus = None
 
         self._fluidDensity = DENSITY_FRESHWATER
@@ -80,7 +83,7 @@ class MS5837(object):
 
         crc = (self._C[0] & 0xF000) >> 12
         if crc != self._crc4(self._C):
-            print "PROM read error, CRC failed!"
+            logger.error("PROM read error, CRC failed!")
             return False
 
 
@@ -89,11 +92,11 @@ class MS5837(object):
 
     def read(self, oversampling=OSR_8192):
         if self._bus is None:
-            print "No bus!"
+            logger.error("No bus!")
             return False
 
         if oversampling < OSR_256 or oversampling > OSR_8192:
-            print "Invalid oversampling option!"
+            logger.error("Invalid oversampling option!")
             return False
 
         # Request D1 conversion (temperature)
@@ -1,3 +1,5 @@
+import collections
+import threading
 import time
 import RPi.GPIO as gpio
 import serial
@@ -5,155 +7,318 @@ import datetime
 import struct
 from binascii import unhexlify
 
+from ..logger import get_logger
+from ..clock import real_clock
+
+logger = get_logger(__name__)
+
+# Frame layout: <key>:<uint32_t, big endian>\n
+FRAME_LENGTH = 7
+FRAME_SEPARATOR = ord(':')
+FRAME_END = ord('\n')
+
+# Telemetry frame key -> (snapshot field, scale).
+TELEMETRY = {
+    't': ('time', 1.0),
+    'o': ('on_timer_set', 1.0),
+    'b': ('voltage', 0.0164),       # value for pirasmart v1, 0.0020698 for pirasmart v2
+    'p': ('on_timer_get', 1.0),
+    's': ('sleep', 1.0),
+    'r': ('reboot', 1.0),
+    'w': ('next_wakeup_get', 1.0),
+    'a': ('rpi_gpio', 1.0),
+}
+TELEMETRY_KEYS = bytearray(''.join(TELEMETRY.keys()).encode('ascii'))
+TELEMETRY_FIELDS = ('time', 'on_timer_set', 'voltage', 'on_timer_get', 'sleep', 'reboot', 'next_wakeup_get', 'rpi_gpio')
+
+# Frame keys whose value changes are recorded as transitions.
+TRANSITION_KEYS = ('b', 'o')
+# Maximum number of transitions kept until they are collected.
+TRANSITIONS_SIZE = 1000
+
+# Seconds to wait for the first complete set of telemetry values, longer than the period of Pira telemetry.
+READ_TIMEOUT = 2
+
+# Seconds a single read from the port waits for data.
+PORT_TIMEOUT = 0.1
+
+# Command frame key -> telemetry field reporting the value in place.
+COMMANDS = {
+    't': 'time',
+    'p': 'on_timer_get',
+    's': 'sleep',
+    'r': 'reboot',
+    'w': 'next_wakeup_get',
+}
+# Allowed difference between a written and a reported value, time advances while confirming.
+COMMAND_TOLERANCE = {
+    't': 2,
+}
+# Seconds to wait for telemetry confirming written values, and number of retries.
+COMMAND_TIMEOUT = 2
+COMMAND_RETRIES = 2
+
+
+class FrameParser(object):
+    """Incremental parser of Pira UART frames.
+
+    Bytes can be fed in chunks of any size. Frames are recognized by their fixed layout
+    (key, separator, four byte payload, end of frame), so payloads containing a newline
+    are parsed correctly. Bytes that do not start a frame are skipped one at a time until
+    the parser is in sync again, an incomplete frame is kept until more bytes arrive.
+    """
+
+    def __init__(self, keys=TELEMETRY_KEYS):
+        self._keys = keys
+        self._buffer = bytearray()
+        # Number of bytes skipped while looking for frames.
+        self.skipped = 0
+
+    def feed(self, data):
+        """Add received bytes, returns list of (key, value) of all complete frames."""
+        buf = self._buffer
+        buf.extend(data)
+
+        frames = []
+        position = 0
+        while len(buf) - position >= FRAME_LENGTH:
+            if (buf[position] in self._keys and buf[position + 1] == FRAME_SEPARATOR and
+                    buf[position + FRAME_LENGTH - 1] == FRAME_END):
+                frames.append((chr(buf[position]), struct.unpack_from('>L', buf, position + 2)[0]))
+                position += FRAME_LENGTH
+            else:
+                position += 1
+                self.skipped += 1
+
+        del buf[:position]
+        return frames
+
+
+class Snapshot(collections.namedtuple('Snapshot', ('timestamp',) + TELEMETRY_FIELDS)):
+    """Immutable telemetry snapshot, timestamp is the time of the newest frame.
+
+    t:<uint32_t> time - seconds in epoch format
+    o:<uint32_t> overwiev - time left until next sleep
+    b:<uint32_t> battery - level in ADC units (voltage in the snapshot)
+    p:<uint32_t> power - safety on period
+    s:<uint32_t> sleep - safety off period
+    r:<uint32_t> reboot - reboot period duration
+    w:<uint32_t> wakeup - period for next wakeup
+    a:<uint32_t> active - Pi status pin value
+    c:<uint32_t> command - not yet implemented
+    """
+
+    __slots__ = ()
+
+    @property
+    def complete(self):
+        """True when all values have been received."""
+        return all(getattr(self, field) is not None for field in TELEMETRY_FIELDS)
+
+
+EMPTY_SNAPSHOT = Snapshot(None, *([None] * len(TELEMETRY_FIELDS)))
+
+
 class PIRASMARTUART(object):
-    """PIRASMARTUART driver."""
+    """PIRASMARTUART driver.
 
-    # Last measured values that can be accessed by other modules.
-    pira_time = None
-    pira_voltage = None
-    pira_on_timer = None
+    A daemon reader thread parses telemetry sent by Pira and publishes it as an immutable
+    snapshot, so the latest values can be read at any time without blocking.
+    """
 
-    def __init__(self, portId):
+    def __init__(self, portId, clock=None):
 
         self.ser = None
+        self._clock = clock or real_clock
         self.portId = portId
+        self._parser = FrameParser()
+        # Latest telemetry, replaced (never modified) by the reader thread.
+        self.snapshot = EMPTY_SNAPSHOT
+        self._complete = threading.Event()
+        self._transitions = collections.deque(maxlen=TRANSITIONS_SIZE)
+        # Frames are counted so that commands are confirmed only by telemetry received after them.
+        self._received = threading.Condition()
+        self._frames = 0
+        self._field_frames = {}
+        # Command key -> value waiting to be written.
+        self._commands = collections.OrderedDict()
+        self._stop = threading.Event()
+        self._thread = None
 
         try:
 
-            self.ser = serial.Serial(self.portId, baudrate=115200, stopbits=1, parity="N",  timeout=2)
+            self.ser = serial.Serial(self.portId, baudrate=115200, stopbits=1, parity="N",  timeout=PORT_TIMEOUT)
 
         except (Exception):
             raise pirasmartuartException
 
-    def read(self, timeout=5, preamble="t:"):
-        """Read value from pira smart via uart.
-
-        :param timeout: Timeout
-        :return: Value
-
-        t:<uint32_t> time - seconds in epoch format
-        o:<uint32_t> overwiev - time left until next sleep
-        b:<uint32_t> battery - level in ADC units
-        p:<uint32_t> power - safety on period
-        s:<uint32_t> sleep - safety off period
-        r:<uint32_t> reboot - reboot period duration
-        w:<uint32_t> wakeup - period for next wakeup
-        a:<uint32_t> active - Pi status pin value
-        c:<uint32_t> command - not yet implemented
+    def start(self):
+        """Start the reader thread."""
+        self._thread = threading.Thread(target=self._run, name='pirasmart-reader')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _receive(self):
+        """Read everything buffered, waiting up to the port timeout for at least one byte."""
+        return self.ser.read(max(1, self.ser.in_waiting))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                data = self._receive()
+            except (serial.SerialException, OSError):
+                logger.warning("Read from Pira failed.")
+                self._stop.wait(1)
+                continue
+
+            skipped = self._parser.skipped
+            frames = self._parser.feed(data)
+            if self._parser.skipped > skipped:
+                logger.debug("Skipped bytes not forming Pira frames.", count=self._parser.skipped - skipped)
+            if frames:
+                self._publish(frames)
+
+    def _publish(self, frames):
+        """Publish a new snapshot updated with the given frames."""
+        timestamp = self._clock.time()
+        previous = self.snapshot
+        values = previous._asdict()
+        for key, value in frames:
+            field, scale = TELEMETRY[key]
+            value = float(value) * scale
+            if key in TRANSITION_KEYS and value != values[field]:
+                self._transitions.append((timestamp, field, value))
+            values[field] = value
+
+        values['timestamp'] = timestamp
+        self.snapshot = snapshot = Snapshot(**values)
+        with self._received:
+            self._frames += 1
+            for key, _ in frames:
+                self._field_frames[TELEMETRY[key][0]] = self._frames
+            self._received.notify_all()
+        if snapshot.rpi_gpio != previous.rpi_gpio:
+            logger.debug("Pira reports Pi status pin value: {}", snapshot.rpi_gpio)
+        if snapshot.complete:
+            self._complete.set()
+
+    def wait(self, timeout=READ_TIMEOUT):
+        """Wait until all telemetry values have been received.
+
+        :param timeout: Seconds to wait
+        :return: True if a complete snapshot is available
         """
+        return self._complete.wait(timeout) or self.snapshot.complete
 
-        start = time.time()
-        #reset values
-        self.pira_time = None # t
-        self.pira_on_timer_set = None # o
-        self.pira_voltage = None # b
-        self.pira_on_timer_get = None # p
-        self.pira_sleep = None # s
-        self.pira_reboot = None # r
-        self.pira_next_wakeup_get = None # w
-        self.pira_rpi_gpio = None # a
+    def age(self):
+        """Seconds since the newest frame was received, None if nothing was received."""
+        timestamp = self.snapshot.timestamp
+        if timestamp is None:
+            return None
+        return max(0.0, self._clock.time() - timestamp)
 
-        read_timeout = 0    # handles when pira ble is not connected
-        value = 0.0         # float that pira ble will use
+    def pop_transitions(self):
+        """Return and forget recorded transitions, list of (timestamp, field, value)."""
+        transitions = []
+        while self._transitions:
+            transitions.append(self._transitions.popleft())
+        return transitions
 
-        try:
-            self.ser.flushInput()
-        except:
-            print("WARNING: Pira input buffer flush failed.")
-
-        while (self.pira_time == None) or \
-                (self.pira_on_timer_set == None) or \
-                (self.pira_voltage == None) or \
-                (self.pira_on_timer_get == None) or \
-                (self.pira_sleep == None) or \
-                (self.pira_reboot == None) or \
-                (self.pira_next_wakeup_get == None) or \
-                (self.pira_rpi_gpio == None) and not \
-                (time.time() - start < timeout):
+    def _in_place(self, key, value, snapshot):
+        """Check if the snapshot reports the value of a command."""
+        current = getattr(snapshot, COMMANDS[key])
+        return current is not None and abs(current - int(value)) <= COMMAND_TOLERANCE.get(key, 0)
 
-            try:
-                x = ""
-                x = self.ser.readline()
-                #print "Preamble: " + x[0:2] + "Data: " + x[2:-1].encode('hex') + " Line: " + str(x.startswith(preamble))
-                #' '.join(map(lambda x:x.encode('hex'),x))
-                #struct.unpack('<h', unhexlify(s1))[0]
-                value = float(struct.unpack('>L', x[2:6])[0])
-            except:
-                print("WARNING: read from Pira BLE the following: " + str(x[2:6]))
-                time.sleep(1)
-                read_timeout += 1
-                if read_timeout >= 5:   # after failing 5 or more times stop Pira BLE reading
-                    return False
+    def queue(self, key, value):
+        """Queue a value to be written by the next flush, replacing a queued value of the same key.
+
+        :param key: Command key, one of COMMANDS
+        :param value: Value in seconds
+        """
+        if key not in COMMANDS:
+            raise ValueError("Unknown Pira command '{}'.".format(key))
+        self._commands[key] = int(value)
 
-            if x.startswith(str('t:')):
-                self.pira_time = float(value)
-                #print "Pira time: " + str(self.pira_time)
-            elif x.startswith(str('o:')):
-                self.pira_on_timer_set = float(value)
-                #print "Pira overwiev: " + str(self.pira_on_timer_set)
-            elif x.startswith(str('b:')):
-                self.pira_voltage = float(value)*0.0164     # value for pirasmart v1
-                #self.pira_voltage = float(value)*0.0020698 # value for pirasmart v2 
-                #print "Pira battery: " + str(self.pira_voltage)
-            elif x.startswith(str('p:')):
-                self.pira_on_timer_get = float(value)
-                #print "Pira get safety on period: " + str(self.pira_on_timer_get)
-            elif x.startswith(str('s:')):
-                self.pira_sleep = float(value)
-                #print "Pira get safety off period: " + str(self.pira_sleep)
-            elif x.startswith(str('r:')):
-                self.pira_reboot = float(value)
-                #print "Pira get reboot period: " + str(self.pira_reboot)
-            elif x.startswith(str('w:')):
-                self.pira_next_wakeup_get = float(value)
-                #print "Pira next wakeup get : " + str(self.pira_next_wakeup_get)
-            elif x.startswith(str('a:')):
-                self.pira_rpi_gpio = float(value)
-                print "Pira reports Pi status pin value: " + str(self.pira_rpi_gpio)
+    def flush(self, timeout=COMMAND_TIMEOUT, retries=COMMAND_RETRIES):
+        """Write queued values in one burst and confirm them against telemetry.
+
+        Values already reported by Pira are not written. After writing, the next telemetry
+        frames are compared with written values and only those that differ are written again.
+
+        :param timeout: Seconds to wait for confirming telemetry of every attempt
+        :param retries: Number of attempts after the first one
+        :return: True if all queued values are in place
+        """
+        commands, self._commands = self._commands, collections.OrderedDict()
+        pending = commands
+        for attempt in range(retries + 1):
+            snapshot = self.snapshot
+            pending = collections.OrderedDict(
+                (key, value) for key, value in pending.items() if not self._in_place(key, value, snapshot)
+            )
+            if not pending:
+                return True
+            if attempt:
+                logger.info("Retrying Pira commands not confirmed by telemetry.", keys=','.join(pending))
 
+            with self._received:
+                written = self._frames
+            self._write(pending.items())
+            self._wait_for(written, [COMMANDS[key] for key in pending], timeout)
+
+        snapshot = self.snapshot
+        failed = [key for key, value in pending.items() if not self._in_place(key, value, snapshot)]
+        if failed:
+            logger.warning("Pira did not confirm commands.", keys=','.join(failed))
+        return not failed
+
+    def _wait_for(self, frames, fields, timeout):
+        """Wait until all fields are reported by a frame received after the given frame count."""
+        deadline = time.time() + timeout
+        with self._received:
+            while any(self._field_frames.get(field, 0) <= frames for field in fields):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._received.wait(remaining)
         return True
 
-    """
-        t:<uint32_t> time - seconds in epoch format
-        p:<uint32_t> power - safety on period
-        s:<uint32_t> sleep - safety off period
-        r:<uint32_t> reboot - reboot period duration
-        w:<uint32_t> wakeup - period for next wakeup
-        c:<uint32_t> command - TODO
-    """
+    def _write(self, commands):
+        """Write (key, value) command frames in a single burst."""
+        data = b''.join(
+            key.encode('ascii') + b':' + struct.pack('>L', int(value)) + b'\n'
+            for key, value in commands
+        )
+        self.ser.write(data)
 
     def set_time(self, new_time_epoch):
         """Writes new time to pira"""
-        data = "t:" + struct.pack('>L', int(new_time_epoch))
-        self.ser.write(data+'\n')
+        self._write([('t', new_time_epoch)])
 
     def set_on_time(self, time_seconds):
         """Writes new on period time to pira"""
-        print "New on period time: " + str(time_seconds)
-        data = "p:" + struct.pack('>L', int(time_seconds))
-        self.ser.write(data+'\n')
+        logger.info("New on period time: {}", time_seconds)
+        self._write([('p', time_seconds)])
 
     def set_off_time(self, time_seconds):
         """Writes new off period time to pira"""
-        print "New off period time: " + str(time_seconds)
-        data = "s:" + struct.pack('>L', int(time_seconds))
-        self.ser.write(data+'\n')
+        logger.info("New off period time: {}", time_seconds)
+        self._write([('s', time_seconds)])
 
     def set_reboot_time(self, time_seconds):
         """Writes new reboot time to pira"""
-        data = "r:" + struct.pack('>L', int(time_seconds))
-        self.ser.write(data+'\n')
+        self._write([('r', time_seconds)])
 
     def set_wakeup_time(self, time_seconds):
         """Writes new wakeup time to pira"""
-        data = "w:" + struct.pack('>L', int(time_seconds))
-        self.ser.write(data+'\n')
+        self._write([('w', time_seconds)])
 
     def send_command(self, command):    # TO DO
         """Sends command to pira"""
-        data = "c:" + struct.pack('>L', int(command))
-        self.ser.write(data+'\n')
+        self._write([('c', command)])
 
     def close(self):
         """Close device."""
-        pass
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(PORT_TIMEOUT * 10)
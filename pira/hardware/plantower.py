@@ -1,13 +1,15 @@
-import time
 import serial
 import statistics as np     # statistics module used instead of numpy
 
+from ..clock import real_clock
+
 class PLANTOWER(object):
     """PLANTOWER driver."""
 
-    def __init__(self, portId):
+    def __init__(self, portId, clock=None):
 
         self.ser = None
+        self._clock = clock or real_clock
         self.portId = portId
 
         try:
@@ -24,7 +26,7 @@ class PLANTOWER(object):
         :param timeout: Amount of seconds to read data for
         :return: Average distance
         """
-        start = time.time()
+        start = self._clock.time()
         pm1_std = []
         pm25_std = []
         pm10_std = []
@@ -42,7 +44,7 @@ class PLANTOWER(object):
 
         # configure sensor in passive mode
         self.ser.write([66, 77, 225, 0, 0, 1, 112])
-        while time.time() - start < timeout:
+        while self._clock.time() - start < timeout:
             try:
                 self.ser.flushInput()
                 self.ser.write([66, 77, 226, 0, 0, 1, 113])   # ask for data
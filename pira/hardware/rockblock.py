@@ -19,6 +19,10 @@ import time
 
 import serial
 
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 class rockBlockProtocol(object):
 
     def rockBlockConnected(self):pass
@@ -310,7 +314,7 @@ class rockBlock(object):
 
         if( len(msg) > 340):
 
-            print "sendMessageWithBytes bytes should be <= 340 bytes"
+            logger.error("sendMessageWithBytes bytes should be <= 340 bytes")
 
             return False
 
@@ -531,7 +535,7 @@ class rockBlock(object):
 
             if(SIGNAL_ATTEMPTS == 0 or signal < 0):
 
-                print  "NO SIGNAL"
+                logger.warning("NO SIGNAL")
 
                 if(self.callback != None and callable(self.callback.rockBlockSignalFail) ):
                     self.callback.rockBlockSignalFail()
@@ -562,7 +566,7 @@ class rockBlock(object):
 
         if( response == "OK" ):
 
-            print "No message content.. strange!"
+            logger.warning("No message content.. strange!")
 
             if(self.callback != None and callable(self.callback.rockBlockRxReceived) ):
                 self.callback.rockBlockRxReceived(mtMsn, "")
@@ -1,11 +1,12 @@
-import time
+from ..clock import real_clock
 
 
 class MB7092XL(object):
     """MB7092XL driver."""
 
-    def __init__(self, gpio, pin):
+    def __init__(self, gpio, pin, clock=None):
         self._gpio = gpio
+        self._clock = clock or real_clock
         self._pin = pin
 
         # Initialize.
@@ -19,10 +20,10 @@ class MB7092XL(object):
         :param timeout: Amount of seconds to read data for
         :return: Average distance
         """
-        start = time.time()
+        start = self._clock.time()
         values = []
 
-        while time.time() - start < timeout:
+        while self._clock.time() - start < timeout:
             count, data = self._gpio.bb_serial_read(self._pin)
             try:
                 data = data.decode('ascii').split()
@@ -0,0 +1,144 @@
+"""
+iostats.py
+
+I/O accounting. Counts bytes written, fsyncs (and SQLite commits) and files created per
+subsystem, so SD card writes can be attributed to modules. Files opened through
+open_file() are accounted automatically, other writes (e.g. by picamera or SQLite) are
+reported with record().
+
+Totals are kept per process, exported as metrics once bound to the registry, shown in
+the debug module output and stored in the log by boot.
+
+ENV VARS:
+    - IO_LOG_INTERVAL (default 3600), seconds between storing I/O totals in the log
+"""
+import os
+import threading
+
+# Accounted values.
+BYTES = 'bytes'
+FSYNCS = 'fsyncs'
+CREATED = 'created'
+
+# Log events, formatted with subsystem and value name.
+LOG_IO = 'io.{}.{}'
+
+
+class AccountedFile(object):
+    """File wrapper that accounts writes."""
+
+    def __init__(self, stats, subsystem, fp):
+        self._stats = stats
+        self._subsystem = subsystem
+        self._fp = fp
+
+    def write(self, data):
+        self._fp.write(data)
+        self._stats.record(self._subsystem, written=len(data))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def fsync(self):
+        """Flush and fsync file to storage."""
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._stats.record(self._subsystem, fsyncs=1)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+    def __iter__(self):
+        return iter(self._fp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._fp.close()
+
+
+class IOStats(object):
+    """Per-subsystem I/O totals."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._counters = None
+
+    def after_fork(self):
+        """Start from empty totals without metrics in a forked child process.
+
+        Another thread may have held the lock at fork time, totals of the parent are
+        accounted by the parent.
+        """
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._counters = None
+
+    def bind(self, metrics):
+        """Export totals recorded from now on as metrics."""
+        self._counters = {
+            BYTES: metrics.counter('pira_io_written_bytes_total', 'Bytes written to storage, by subsystem.'),
+            FSYNCS: metrics.counter('pira_io_fsyncs_total', 'Fsyncs and database commits, by subsystem.'),
+            CREATED: metrics.counter('pira_io_files_created_total', 'Files created, by subsystem.'),
+        }
+
+    def record(self, subsystem, written=0, fsyncs=0, created=0):
+        """Record I/O of a subsystem."""
+        with self._lock:
+            totals = self._totals.get(subsystem)
+            if totals is None:
+                totals = self._totals[subsystem] = {BYTES: 0, FSYNCS: 0, CREATED: 0}
+
+            totals[BYTES] += written
+            totals[FSYNCS] += fsyncs
+            totals[CREATED] += created
+
+        counters = self._counters
+        if counters is not None:
+            if written:
+                counters[BYTES].inc(written, subsystem=subsystem)
+            if fsyncs:
+                counters[FSYNCS].inc(fsyncs, subsystem=subsystem)
+            if created:
+                counters[CREATED].inc(created, subsystem=subsystem)
+
+    def totals(self):
+        """Snapshot of totals, subsystem -> dict of values."""
+        with self._lock:
+            return dict((subsystem, dict(totals)) for subsystem, totals in self._totals.items())
+
+    def merge(self, totals):
+        """Add totals recorded by another process (e.g. the upload worker)."""
+        for subsystem, values in totals.items():
+            self.record(subsystem, written=values.get(BYTES, 0), fsyncs=values.get(FSYNCS, 0), created=values.get(CREATED, 0))
+
+    def open_file(self, subsystem, path, mode='r'):
+        """Open file with accounted writes, creation of a new file is accounted as well."""
+        created = ('w' in mode or 'a' in mode) and not os.path.exists(path)
+        fp = AccountedFile(self, subsystem, open(path, mode))
+        if created:
+            self.record(subsystem, created=1)
+        return fp
+
+    def log_totals(self, log, timestamp=None):
+        """Store totals in the log."""
+        for subsystem, totals in sorted(self.totals().items()):
+            for name, value in sorted(totals.items()):
+                log.insert(LOG_IO.format(subsystem, name), value, timestamp=timestamp)
+
+
+# Process-wide I/O accounting.
+stats = IOStats()
+
+
+def open_file(subsystem, path, mode='r'):
+    """Open file with accounted writes."""
+    return stats.open_file(subsystem, path, mode)
+
+
+def record(subsystem, written=0, fsyncs=0, created=0):
+    """Record I/O of a subsystem."""
+    stats.record(subsystem, written=written, fsyncs=fsyncs, created=created)
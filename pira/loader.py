@@ -0,0 +1,194 @@
+"""
+loader.py
+
+Module loader. Modules are imported in the configured order and constructed in parallel
+threads, while respecting dependencies declared by the module (module level INIT_DEPENDS,
+a tuple of module names that must be constructed first). Construction time of every
+module is reported.
+
+A module that does not finish construction within its init budget (module level
+INIT_BUDGET or MODULE_INIT_BUDGET) is deferred: its construction continues in the
+background and it joins the main loop once ready. A deferred module whose construction
+fails is retried in the background on later loops.
+
+ENV VARS:
+    - MODULE_INIT_PARALLEL (default 1), set to 0 to construct modules one after another
+    - MODULE_INIT_BUDGET (default 60), seconds a module may take to construct before it is deferred
+    - MODULE_INIT_RETRIES (default 3), number of background retries for deferred modules
+"""
+import collections
+import importlib
+import os
+import threading
+import time
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Interval for checking construction progress, in seconds.
+POLL_INTERVAL = 0.05
+
+
+class ModuleInit(object):
+    """Construction state of a single module."""
+
+    def __init__(self, module, depends, budget):
+        self.name = module.__name__
+        self.module = module
+        self.depends = depends
+        self.budget = budget
+        self.thread = None
+        self.instance = None
+        self.failed = False
+        self.started = None
+        self.duration = None
+        self.attempts = 0
+        self.deferred = False
+
+    @property
+    def done(self):
+        return self.instance is not None or self.failed
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+
+class ModuleLoader(object):
+    """Imports and constructs modules."""
+
+    def __init__(self, boot, environ=os.environ):
+        self._boot = boot
+        self.parallel = environ.get('MODULE_INIT_PARALLEL', '1') == '1'
+        self.budget = float(environ.get('MODULE_INIT_BUDGET', '60'))
+        self.retries = int(environ.get('MODULE_INIT_RETRIES', '3'))
+        # Names of all imported modules, in configured order.
+        self.names = []
+        self._inits = collections.OrderedDict()
+        self._init_time = boot.metrics.gauge('pira_module_init_seconds', 'Duration of module construction.')
+
+    def _import(self, module_names):
+        for module_name in module_names:
+            try:
+                module = importlib.import_module(module_name)
+            except ImportError:
+                logger.exception("ImportError  * {} [IMPORT FAILED]", module_name)
+                continue
+            except ValueError:
+                logger.error("ValueError  * {} [IMPORT FAILED]", module_name)
+                continue
+
+            logger.info("  * {}", module.__name__)
+            self.names.append(module.__name__)
+            self._inits[module.__name__] = ModuleInit(
+                module,
+                getattr(module, 'INIT_DEPENDS', ()),
+                float(getattr(module, 'INIT_BUDGET', self.budget)),
+            )
+
+    def _construct(self, init):
+        """Construct module, runs in its own thread when parallel."""
+        start = time.time()
+        try:
+            init.instance = init.module.Module(self._boot)
+        except:
+            logger.exception("Error while initializing a module.", module=init.name)
+            init.failed = True
+
+        init.duration = time.time() - start
+        self._init_time.set(init.duration, module=init.name)
+        logger.info("Module initialized.", module=init.name, seconds=round(init.duration, 3), ok=not init.failed)
+
+    def _start(self, init):
+        init.attempts += 1
+        init.failed = False
+        init.started = time.time()
+        if not self.parallel:
+            self._construct(init)
+            return
+
+        init.thread = threading.Thread(target=self._construct, args=(init,), name='init-' + init.name)
+        init.thread.daemon = True
+        init.thread.start()
+
+    def _ready(self, init):
+        """Check if all dependencies of a module that has not been started yet are done."""
+        if init.started is not None:
+            return False
+
+        for name in init.depends:
+            dependency = self._inits.get(name)
+            if dependency is not None and not dependency.done:
+                return False
+
+        return True
+
+    def _modules(self):
+        """Constructed modules in configured order."""
+        return collections.OrderedDict(
+            (name, init.instance) for name, init in self._inits.items() if init.instance is not None
+        )
+
+    def load(self, module_names):
+        """Import and construct modules, returns dict of modules constructed within budget."""
+        self._import(module_names)
+
+        while True:
+            started = False
+            for init in self._inits.values():
+                if self._ready(init):
+                    self._start(init)
+                    started = True
+
+            if started:
+                continue
+
+            now = time.time()
+            if not any(init.running and now - init.started < init.budget for init in self._inits.values()):
+                break
+
+            time.sleep(POLL_INTERVAL)
+
+        for init in self._inits.values():
+            if init.done:
+                continue
+
+            init.deferred = True
+            if init.started is None:
+                logger.warning("Module depends on a deferred module, deferring.", module=init.name)
+            else:
+                logger.warning("Module initialization exceeded its budget, deferring.", module=init.name, budget=init.budget)
+
+        return self._modules()
+
+    def update(self, modules):
+        """Called once per loop, adds deferred modules that are ready and retries failed ones.
+
+        :param modules: Dict of running modules, updated in place
+        :return: True if modules were added
+        """
+        added = False
+        for init in self._inits.values():
+            if not init.deferred or init.running:
+                continue
+
+            if init.instance is not None:
+                logger.info("Deferred module is ready.", module=init.name)
+                init.deferred = False
+                added = True
+            elif init.failed and init.attempts <= self.retries:
+                logger.info("Retrying deferred module initialization.", module=init.name, attempt=init.attempts)
+                self._start(init)
+            elif init.failed:
+                logger.error("Deferred module initialization failed, giving up.", module=init.name)
+                init.deferred = False
+            elif self._ready(init):
+                self._start(init)
+
+        if added:
+            ordered = self._modules()
+            modules.clear()
+            modules.update(ordered)
+
+        return added
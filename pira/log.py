@@ -1,9 +1,29 @@
-import datetime
+"""
+log.py
+
+Persistent log store. Keys with a deadband are logged change-only: a sample is stored only
+when it differs from the stored one by more than the tolerance or the maximum interval has
+passed, otherwise the count and the last sample timestamp of the stored row are updated.
+Queries and aggregates repeat stored values by their count, so step-wise statistics are the
+same as with every sample stored. Samples of a row are assumed to be evenly spaced when only
+part of them falls into the queried interval. Counts are stored with every commit and by
+flush() once per loop, so at most one loop of samples is lost on a crash or power cut.
+
+ENV VARS:
+    - LOG_DEADBANDS (default empty), per-key deadband overrides, e.g. "device.voltage=0.02:1800",
+      where the first number is the tolerance and the second the maximum interval in seconds
+"""
+import collections
+import math
 import os
 import hashlib
+import time
 
 import sqlite3
 
+from .clock import real_clock
+from . import iostats
+
 # Log file location.
 LOG_FILE = '/data/pira-zero-log.db'
 
@@ -13,18 +33,63 @@ CREATE TABLE IF NOT EXISTS log (
     id integer primary key,
     timestamp integer,
     key varchar,
-    value varchar
+    value varchar,
+    count integer NOT NULL DEFAULT 1,
+    until integer
 )
 '''
 
+# Columns added to logs created before change-only logging.
+LOG_TABLE_COLUMNS = {
+    'count': 'ALTER TABLE log ADD COLUMN count integer NOT NULL DEFAULT 1',
+    'until': 'ALTER TABLE log ADD COLUMN until integer',
+}
+
 LOG_TABLE_INDEX = '''
 CREATE INDEX IF NOT EXISTS log_timestamp_key_index ON log (timestamp, key)
 '''
 
+# Default maximum interval in seconds between stored samples of a key with a deadband.
+DEADBAND_MAX_INTERVAL = 3600
+
+# Deadband of a key, tolerance is the largest difference from the stored value which is not stored.
+Deadband = collections.namedtuple('Deadband', ['tolerance', 'max_interval'])
+
+
+def parse_deadbands(value):
+    """Parse per-key deadbands in format "key=tolerance[:max_interval],..."."""
+    deadbands = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        key, deadband = item.split('=', 1)
+        tolerance, _, max_interval = deadband.partition(':')
+        try:
+            deadbands[key.strip()] = Deadband(float(tolerance), int(max_interval or DEADBAND_MAX_INTERVAL))
+        except ValueError:
+            continue
+
+    return deadbands
+
+
 class Log(object):
     """Persistent log store."""
 
-    def __init__(self):
+    def __init__(self, metrics=None, clock=None):
+        self._clock = clock or real_clock
+        # Deadbands set by modules and overrides from environment, which take precedence.
+        self._deadbands = {}
+        self._deadband_overrides = parse_deadbands(os.environ.get('LOG_DEADBANDS'))
+        # Key -> [row id, value, timestamp, count, until, stored count] of the latest stored sample
+        # of keys with a deadband.
+        self._runs = {}
+        self._insert_latency = None
+        if metrics is not None:
+            self._insert_latency = metrics.histogram(
+                'pira_log_insert_seconds',
+                'Latency of log database inserts.'
+            )
+
         while True:
             try:
                 self._db = sqlite3.connect(LOG_FILE)
@@ -33,7 +98,12 @@ class Log(object):
                 with self._db:
                     self._db.execute(LOG_TABLE_SCHEMA)
                     self._db.execute(LOG_TABLE_INDEX)
+                    columns = [row[1] for row in self._db.execute('PRAGMA table_info(log)')]
+                    for column, statement in sorted(LOG_TABLE_COLUMNS.items()):
+                        if column not in columns:
+                            self._db.execute(statement)
 
+                self._page_size = self._db.execute('PRAGMA page_size').fetchone()[0]
                 break
             except sqlite3.DatabaseError:
                 # Database may be malformed, rename and re-create.
@@ -51,22 +121,50 @@ class Log(object):
 
         return int(timestamp.strftime('%s'))
 
+    def set_deadband(self, key, tolerance=0, max_interval=DEADBAND_MAX_INTERVAL):
+        """Log key change-only, unless overridden by LOG_DEADBANDS.
+
+        :param key: Measurement key
+        :param tolerance: Largest difference from the stored value which is not stored
+        :param max_interval: Seconds after which a sample is stored even if it did not change
+        """
+        self._deadbands[key] = Deadband(tolerance, max_interval)
+
+    def _rows(self, start_ts, key):
+        """Rows (timestamp, value, count) with samples from start_ts on.
+
+        Counts include samples not yet stored, rows whose samples started before start_ts
+        are reduced to the samples after it.
+        """
+        start = self._convert_timestamp(start_ts)
+        max_interval = max(
+            [DEADBAND_MAX_INTERVAL] +
+            [deadband.max_interval for deadband in list(self._deadbands.values()) + list(self._deadband_overrides.values())]
+        )
+        pending = dict((run[0], (run[3], run[4])) for run in self._runs.values())
+        result = self._db.execute(
+            'SELECT id, timestamp, value, count, until FROM log WHERE timestamp >= ? AND key = ?',
+            (start - max_interval, key)
+        )
+        for row_id, timestamp, value, count, until in result:
+            count, until = pending.get(row_id, (count, until))
+            if timestamp >= start:
+                yield timestamp, value, count
+            elif count > 1 and until is not None and until >= start:
+                step = (until - timestamp) / float(count - 1)
+                skipped = int(math.ceil((start - timestamp) / step))
+                yield int(timestamp + skipped * step), value, count - skipped
+
     def query(self, start_ts, key, include_ts=False, only_numeric=False):
-        """Query log.
+        """Query log, values of change-only keys are repeated for every sample.
 
         :param start_ts: Start datetime
         :param key: Measurement key
         :param include_ts: Include timestamps in results
         :param only_numeric: Skip non-numeric values
         """
-        result = self._db.execute(
-            'SELECT timestamp, value FROM log WHERE timestamp >= ? AND key = ?',
-            (self._convert_timestamp(start_ts), key)
-        )
-
         values = []
-        for row in result:
-            value = row[1]
+        for timestamp, value, count in self._rows(start_ts, key):
             if only_numeric:
                 try:
                     value = float(value)
@@ -74,23 +172,134 @@ class Log(object):
                     continue
 
             if include_ts:
-                values.append((row[0], value))
+                values.extend([(timestamp, value)] * count)
             else:
-                values.append(value)
+                values.extend([value] * count)
 
         return values
 
+    def aggregate(self, start_ts, key):
+        """Statistics of numeric values without expanding change-only rows.
+
+        :param start_ts: Start datetime
+        :param key: Measurement key
+        :return: Tuple (count, average, min, max), None if there are no values
+        """
+        count = 0
+        total = 0.0
+        min_value = max_value = None
+        for _, value, samples in self._rows(start_ts, key):
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+
+            count += samples
+            total += value * samples
+            if min_value is None or value < min_value:
+                min_value = value
+            if max_value is None or value > max_value:
+                max_value = value
+
+        if not count:
+            return None
+
+        return count, total / count, min_value, max_value
+
+    def _store_run(self, run):
+        """Store the count of samples of a change-only key, if it changed since it was last stored."""
+        if run[3] != run[5]:
+            self._db.execute('UPDATE log SET count = ?, until = ? WHERE id = ?', (run[3], run[4], run[0]))
+            run[5] = run[3]
+
+    def _store_runs(self, runs):
+        for run in runs:
+            self._store_run(run)
+
+    def flush(self):
+        """Store counts of change-only keys not stored yet, called by boot once per loop."""
+        if all(run[3] == run[5] for run in self._runs.values()):
+            return
+
+        with self._db:
+            self._store_runs(self._runs.values())
+
+        iostats.record('log', written=2 * self._page_size, fsyncs=2)
+
     def insert(self, key, value, timestamp=None):
         """Insert new log entry."""
         if timestamp is None:
-            timestamp = datetime.datetime.now()
+            timestamp = self._clock.now()
+        timestamp = self._convert_timestamp(timestamp)
+
+        deadband = self._deadband_overrides.get(key) or self._deadbands.get(key)
+        number = None
+        if deadband is not None:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                pass
 
+        run = self._runs.pop(key, None)
+        if (run is not None and number is not None and abs(number - run[1]) <= deadband.tolerance and
+                0 <= timestamp - run[2] < deadband.max_interval):
+            # Sample within deadband, counted with the stored one.
+            run[3] += 1
+            run[4] = timestamp
+            self._runs[key] = run
+            return
+
+        start = time.time()
         with self._db:
-            self._db.execute(
+            if run is not None:
+                self._store_run(run)
+            # Counts of other keys are stored with the same commit.
+            self._store_runs(self._runs.values())
+            cursor = self._db.execute(
                 'INSERT INTO log (timestamp, key, value) VALUES(?, ?, ?)',
-                (self._convert_timestamp(timestamp), key, str(value))
+                (timestamp, key, str(value))
             )
 
+        if number is not None:
+            self._runs[key] = [cursor.lastrowid, number, timestamp, 1, timestamp, 1]
+
+        if self._insert_latency is not None:
+            self._insert_latency.observe(time.time() - start)
+
+        # Every commit (in the default rollback journal mode) creates a journal with a copy
+        # of the modified page, writes the page to the database and syncs both.
+        iostats.record('log', written=2 * self._page_size, fsyncs=2, created=1)
+
+    def insert_many(self, entries):
+        """Insert multiple log entries in a single transaction.
+
+        :param entries: Iterable of (key, value, timestamp), timestamp may be None
+        """
+        rows = [
+            (self._convert_timestamp(timestamp or self._clock.now()), key, str(value))
+            for key, value, timestamp in entries
+        ]
+        if not rows:
+            return
+
+        # Entries are stored as they are, which ends runs of change-only keys.
+        runs = [self._runs.pop(key) for _, key, _ in rows if key in self._runs]
+
+        start = time.time()
+        with self._db:
+            self._store_runs(runs)
+            self._store_runs(self._runs.values())
+            self._db.executemany('INSERT INTO log (timestamp, key, value) VALUES(?, ?, ?)', rows)
+
+        if self._insert_latency is not None:
+            self._insert_latency.observe(time.time() - start)
+
+        # Rows share pages, so a batch costs about as much as a single insert.
+        iostats.record('log', written=2 * self._page_size, fsyncs=2, created=1)
+
     def close(self):
         """Close log."""
+        with self._db:
+            self._store_runs(self._runs.values())
+        self._runs = {}
         self._db.close()
@@ -0,0 +1,268 @@
+"""
+logger.py
+
+Structured, level-filtered console logging with per-message rate limiting. Records at or
+above the ring level (regardless of the console level) are kept in an in-memory ring buffer,
+which can be dumped on demand (SIGUSR1, webserver /log) or when the process crashes.
+
+ENV VARS:
+    - LOG_LEVEL (default warning), console level for all loggers
+    - LOG_LEVELS (default empty), per-module overrides, e.g. "pira.modules.can=debug,pira.boot=info"
+    - LOG_RING_SIZE (default 1000), number of records kept in memory
+    - LOG_RING_LEVEL (default info), lowest level of records kept in memory, so per-loop debug
+      records do not push out warnings and errors
+    - LOG_RATE_BURST (default 3), number of identical warnings printed per interval
+    - LOG_RATE_INTERVAL (default 3600), rate limiting interval in seconds
+"""
+from __future__ import print_function
+
+import collections
+import datetime
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+# Log levels.
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {
+    DEBUG: 'DEBUG',
+    INFO: 'INFO',
+    WARNING: 'WARNING',
+    ERROR: 'ERROR',
+}
+
+LEVELS = dict((name.lower(), level) for level, name in LEVEL_NAMES.items())
+
+# Crash dump location.
+CRASH_LOG_FILE = '/data/pira-crash.log'
+
+# Single log record. Message is formatted lazily, only when it is printed or dumped.
+Record = collections.namedtuple('Record', ['timestamp', 'level', 'name', 'message', 'args', 'fields'])
+
+
+def _parse_level(value, default):
+    """Parse level name."""
+    return LEVELS.get(str(value).strip().lower(), default)
+
+
+def _parse_int(value, default):
+    """Parse positive integer."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+
+    return value if value > 0 else default
+
+
+def format_record(record):
+    """Format record as a single line."""
+    message = record.message
+    if record.args:
+        try:
+            message = message.format(*record.args)
+        except (IndexError, KeyError, ValueError):
+            message = ' '.join([message] + [str(arg) for arg in record.args])
+
+    line = '{} {} {}: {}'.format(
+        datetime.datetime.fromtimestamp(record.timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+        LEVEL_NAMES.get(record.level, record.level),
+        record.name,
+        message,
+    )
+
+    if record.fields:
+        line += ' ' + ' '.join('{}={}'.format(key, value) for key, value in sorted(record.fields.items()))
+
+    return line
+
+
+class Logger(object):
+    """Logger for a single module."""
+
+    def __init__(self, name, manager):
+        self.name = name
+        self._manager = manager
+
+    def log(self, level, message, *args, **fields):
+        """Record a message, args are used for str.format and fields are appended as key=value."""
+        self._manager.emit(Record(time.time(), level, self.name, message, args, fields))
+
+    def debug(self, message, *args, **fields):
+        self.log(DEBUG, message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log(INFO, message, *args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self.log(WARNING, message, *args, **fields)
+
+    def error(self, message, *args, **fields):
+        self.log(ERROR, message, *args, **fields)
+
+    def exception(self, message, *args, **fields):
+        """Record an error together with the traceback of the exception being handled."""
+        fields['traceback'] = '\n' + traceback.format_exc().rstrip()
+        self.log(ERROR, message, *args, **fields)
+
+    def is_enabled_for(self, level):
+        """Check if records of the given level would be printed to console."""
+        return level >= self._manager.level_for(self.name)
+
+
+class LogManager(object):
+    """Keeps loggers, the ring buffer and the rate limiter state."""
+
+    def __init__(self, environ=os.environ, stream=None):
+        self._lock = threading.Lock()
+        self._stream = stream
+        self._loggers = {}
+        self._level_cache = {}
+
+        self.default_level = _parse_level(environ.get('LOG_LEVEL', 'warning'), WARNING)
+        self.levels = {}
+        for item in environ.get('LOG_LEVELS', '').split(','):
+            if '=' not in item:
+                continue
+            name, level = item.split('=', 1)
+            self.levels[name.strip()] = _parse_level(level, self.default_level)
+
+        self.ring = collections.deque(maxlen=_parse_int(environ.get('LOG_RING_SIZE'), 1000))
+        self.ring_level = _parse_level(environ.get('LOG_RING_LEVEL', 'info'), INFO)
+        self._rate_burst = _parse_int(environ.get('LOG_RATE_BURST'), 3)
+        self._rate_interval = _parse_int(environ.get('LOG_RATE_INTERVAL'), 3600)
+        # Rate limiter state: (name, message) -> [window start, printed, suppressed].
+        self._rate = {}
+
+    def after_fork(self):
+        """Replace the lock in a forked child process, another thread may have held it at fork time."""
+        self._lock = threading.Lock()
+
+    def get_logger(self, name):
+        """Get logger for the given module name."""
+        with self._lock:
+            logger = self._loggers.get(name)
+            if logger is None:
+                logger = self._loggers[name] = Logger(name, self)
+
+        return logger
+
+    def level_for(self, name):
+        """Console level for the given logger, the most specific configured prefix wins."""
+        level = self._level_cache.get(name)
+        if level is not None:
+            return level
+
+        level = self.default_level
+        prefix = None
+        for configured, configured_level in self.levels.items():
+            if name == configured or name.startswith(configured + '.'):
+                if prefix is None or len(configured) > len(prefix):
+                    prefix = configured
+                    level = configured_level
+
+        self._level_cache[name] = level
+        return level
+
+    def emit(self, record):
+        """Store record in the ring buffer and print it if allowed."""
+        if record.level >= self.ring_level:
+            with self._lock:
+                self.ring.append(record)
+
+        if record.level < self.level_for(record.name):
+            return
+
+        # Only warnings and errors are rate limited, lower levels must be enabled explicitly.
+        suppressed = 0
+        if record.level >= WARNING:
+            suppressed = self._rate_limit(record)
+            if suppressed is None:
+                return
+
+        line = format_record(record)
+        if suppressed:
+            line += ' (suppressed {} similar messages)'.format(suppressed)
+
+        stream = self._stream or sys.stdout
+        try:
+            stream.write(line + '\n')
+            stream.flush()
+        except (IOError, ValueError):
+            pass
+
+    def _rate_limit(self, record):
+        """Return None when record should be suppressed, else number of previously suppressed records."""
+        key = (record.name, record.message)
+        with self._lock:
+            state = self._rate.get(key)
+            if state is None or record.timestamp - state[0] >= self._rate_interval:
+                suppressed = state[2] if state is not None else 0
+                self._rate[key] = [record.timestamp, 1, 0]
+                return suppressed
+
+            if state[1] >= self._rate_burst:
+                state[2] += 1
+                return None
+
+            state[1] += 1
+            return 0
+
+    def records(self):
+        """Snapshot of records in the ring buffer."""
+        with self._lock:
+            return list(self.ring)
+
+    def dump(self, stream=None):
+        """Write all records from the ring buffer to stream."""
+        stream = stream or sys.stdout
+        for record in self.records():
+            stream.write(format_record(record) + '\n')
+        stream.flush()
+
+    def dump_to_file(self, path=CRASH_LOG_FILE):
+        """Write all records from the ring buffer to the given file."""
+        try:
+            with open(path, 'w') as dump_file:
+                self.dump(dump_file)
+        except (IOError, OSError):
+            pass
+
+    def install_handlers(self):
+        """Dump the ring buffer on SIGUSR1 and on crash."""
+        def on_signal(signum, frame):
+            self.dump()
+
+        try:
+            signal.signal(signal.SIGUSR1, on_signal)
+        except (AttributeError, ValueError):
+            # Not supported on this platform or not called from the main thread.
+            pass
+
+        previous_hook = sys.excepthook
+
+        def on_crash(exc_type, exc_value, exc_traceback):
+            self.get_logger(__name__).error(
+                'Unhandled exception: {}',
+                ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback)).rstrip()
+            )
+            self.dump_to_file()
+            previous_hook(exc_type, exc_value, exc_traceback)
+
+        sys.excepthook = on_crash
+
+
+# Process-wide manager.
+manager = LogManager()
+
+
+def get_logger(name):
+    """Get logger for the given module name."""
+    return manager.get_logger(name)
@@ -0,0 +1,172 @@
+"""
+memory.py
+
+Memory watermark tracking. Process RSS (and optionally tracemalloc traced memory) is
+sampled before and after every module run, the difference is the memory retained by
+the module in that loop. High-water marks are kept per module and a warning is logged
+when a module keeps retaining memory over several consecutive loops. Where current RSS
+is not available (no /proc), only the peak RSS of the process is exported, as growth
+computed from a peak would never be negative and stay at its maximum.
+
+ENV VARS:
+    - MEMORY_TRACKING (default 1), set to 0 to disable sampling
+    - MEMORY_TRACEMALLOC (default 0), set to 1 to also trace Python allocations (Python 3 only)
+    - MEMORY_GROWTH_LOOPS (default 10), number of consecutive growing loops before a warning
+"""
+import collections
+import os
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Optional tracemalloc support (not available on Python 2).
+try:
+    import tracemalloc
+    HAVE_TRACEMALLOC = True
+except ImportError:
+    HAVE_TRACEMALLOC = False
+
+try:
+    import resource
+    HAVE_RESOURCE = True
+except ImportError:
+    HAVE_RESOURCE = False
+
+# Page size used by /proc/self/statm.
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+# Number of allocation sites reported when a module keeps growing.
+TOP_ALLOCATIONS = 3
+
+
+def get_rss():
+    """Resident set size of this process in bytes or None when it cannot be determined."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def get_peak_rss():
+    """Peak resident set size of this process in bytes or None when it cannot be determined."""
+    if HAVE_RESOURCE:
+        # Kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return None
+
+
+class ModuleMemory(object):
+    """Memory statistics of a single module."""
+
+    def __init__(self, growth_loops):
+        # Highest RSS observed after the module has run.
+        self.high_water = 0
+        # Largest growth during a single run.
+        self.max_growth = 0
+        # Growth during the most recent runs.
+        self.growth = collections.deque(maxlen=growth_loops)
+        self.traced_growth = None
+        self.snapshot = None
+
+
+class MemoryTracker(object):
+    """Samples memory around module runs."""
+
+    def __init__(self, metrics=None, environ=os.environ):
+        self.enabled = environ.get('MEMORY_TRACKING', '1') == '1'
+        self.growth_loops = max(2, int(environ.get('MEMORY_GROWTH_LOOPS', '10')))
+        self.tracemalloc = HAVE_TRACEMALLOC and environ.get('MEMORY_TRACEMALLOC', '0') == '1'
+        self.modules = {}
+        self._before = None
+        self._traced_before = None
+
+        if self.tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        self._rss = None
+        self._peak_rss = None
+        self._high_water = None
+        self._growth = None
+        if metrics is not None:
+            self._rss = metrics.gauge('pira_process_rss_bytes', 'Resident set size of the process.')
+            self._peak_rss = metrics.gauge('pira_process_peak_rss_bytes', 'Peak resident set size of the process.')
+            self._high_water = metrics.gauge(
+                'pira_module_memory_high_water_bytes',
+                'Highest process RSS observed after module processing.'
+            )
+            self._growth = metrics.gauge(
+                'pira_module_memory_growth_bytes',
+                'Process RSS growth during the last module processing.'
+            )
+
+    def before(self, name):
+        """Sample memory before module processing."""
+        if not self.enabled:
+            return
+
+        self._before = get_rss()
+        if self.tracemalloc:
+            self._traced_before = tracemalloc.get_traced_memory()[0]
+
+    def after(self, name):
+        """Sample memory after module processing and update statistics."""
+        if not self.enabled:
+            return
+
+        rss = get_rss()
+        if rss is None or self._before is None:
+            peak = get_peak_rss()
+            if peak is not None and self._peak_rss is not None:
+                self._peak_rss.set(peak)
+            return
+
+        stats = self.modules.get(name)
+        if stats is None:
+            stats = self.modules[name] = ModuleMemory(self.growth_loops)
+
+        growth = rss - self._before
+        stats.growth.append(growth)
+        stats.high_water = max(stats.high_water, rss)
+        stats.max_growth = max(stats.max_growth, growth)
+
+        fields = {'rss': rss, 'growth': growth, 'high_water': stats.high_water}
+        if self.tracemalloc:
+            stats.traced_growth = tracemalloc.get_traced_memory()[0] - self._traced_before
+            fields['traced_growth'] = stats.traced_growth
+            if stats.snapshot is None:
+                stats.snapshot = tracemalloc.take_snapshot()
+
+        logger.debug("Module memory", module=name, **fields)
+
+        if self._rss is not None:
+            self._rss.set(rss)
+            self._high_water.set(stats.high_water, module=name)
+            self._growth.set(growth, module=name)
+
+        if len(stats.growth) == stats.growth.maxlen and all(value > 0 for value in stats.growth):
+            self._report_growth(name, stats)
+
+    def _report_growth(self, name, stats):
+        """Warn about module that has been growing in every tracked loop."""
+        fields = {'total': sum(stats.growth), 'high_water': stats.high_water}
+
+        if stats.snapshot is not None:
+            snapshot = tracemalloc.take_snapshot()
+            top = snapshot.compare_to(stats.snapshot, 'lineno')[:TOP_ALLOCATIONS]
+            fields['allocations'] = '; '.join(str(stat) for stat in top)
+            stats.snapshot = snapshot
+
+        logger.warning(
+            "Module '{}' retained memory in each of the last {} loops.",
+            name,
+            len(stats.growth),
+            **fields
+        )
+        # Start counting again, so the warning is repeated only if growth continues.
+        stats.growth.clear()
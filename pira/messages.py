@@ -26,15 +26,15 @@ def create_measurements_message(boot, timestamp, measurements):
     have_measurements = False
     message = io.BytesIO()
     for config in measurements:
-        values = boot.log.query(timestamp, config.log_type, only_numeric=True)
+        statistics = boot.log.aggregate(timestamp, config.log_type)
         converter = config.conversion or int
 
         # Compute statistics.
-        if values:
-            count = len(values)
-            average = converter(sum(values) / count)
-            min_value = converter(min(values))
-            max_value = converter(max(values))
+        if statistics:
+            count, average, min_value, max_value = statistics
+            average = converter(average)
+            min_value = converter(min_value)
+            max_value = converter(max_value)
             have_measurements = True
         else:
             count = 0
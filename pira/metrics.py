@@ -0,0 +1,184 @@
+"""
+metrics.py
+
+In-memory metrics registry (counters, gauges and histograms) that can be rendered
+in the Prometheus text exposition format. Values live only in memory, so scraping
+never touches the log database.
+"""
+import threading
+
+# Default histogram buckets (in seconds).
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value):
+    """Format sample value."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    """Format label set, labels is a sorted tuple of (name, value) pairs."""
+    if not labels:
+        return ''
+
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    ) + '}'
+
+
+class Metric(object):
+    """Base class for all metric types."""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if not labels:
+            return ()
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        """Render metric in text exposition format."""
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} {}'.format(self.name, self.type_name),
+        ]
+        with self._lock:
+            values = list(self._values.items())
+
+        for labels, value in sorted(values):
+            lines.append('{}{} {}'.format(self.name, _format_labels(labels), _format_value(value)))
+
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        if value is None:
+            return
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, description)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts (not cumulative), sum and count.
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [
+            '# HELP {} {}'.format(self.name, self.description),
+            '# TYPE {} {}'.format(self.name, self.type_name),
+        ]
+        with self._lock:
+            values = [(labels, (list(entry[0]), entry[1], entry[2])) for labels, entry in self._values.items()]
+
+        for labels, (counts, total, count) in sorted(values):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (('le', _format_value(bound)),)
+                lines.append('{}_bucket{} {}'.format(self.name, _format_labels(bucket_labels), cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, _format_labels(labels), _format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, _format_labels(labels), count))
+
+        return lines
+
+
+class Metrics(object):
+    """Registry of all metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, description, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, description, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric '{}' already registered with a different type.".format(name))
+
+        return metric
+
+    def counter(self, name, description=''):
+        """Get or create a counter."""
+        return self._register(Counter, name, description)
+
+    def gauge(self, name, description=''):
+        """Get or create a gauge."""
+        return self._register(Gauge, name, description)
+
+    def histogram(self, name, description='', buckets=DEFAULT_BUCKETS):
+        """Get or create a histogram."""
+        return self._register(Histogram, name, description, buckets=buckets)
+
+    def counter_values(self):
+        """Snapshot of all counters as a list of (name, description, labels, value) tuples."""
+        with self._lock:
+            counters = [metric for metric in self._metrics.values() if isinstance(metric, Counter)]
+
+        values = []
+        for counter in counters:
+            with counter._lock:
+                for labels, value in counter._values.items():
+                    values.append((counter.name, counter.description, labels, value))
+
+        return values
+
+    def render(self):
+        """Render all metrics in Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+
+        lines = []
+        for _, metric in metrics:
+            lines.extend(metric.render())
+
+        return '\n'.join(lines) + '\n'
@@ -29,6 +29,11 @@ from os.path import isfile, join
 
 from azure.storage.blob import BlockBlobService, PublicAccess
 
+from ..const import METRIC_UPLOADED_BYTES
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 # a dummy file to upload
 full_path_to_file = "/usr/src/app/docs/logo-irnas.png"
 images_path = "/data/camera/"
@@ -41,6 +46,7 @@ class Module(object):
         """
         self._boot = boot
         self._enabled = False
+        self._uploaded_bytes = boot.metrics.counter(METRIC_UPLOADED_BYTES, 'Number of bytes uploaded.')
 
         enable_logging = os.environ.get('AZURE_LOGGING', 'off')  # enable request logging 
         if enable_logging == 'on':
@@ -58,7 +64,7 @@ class Module(object):
 
         # Check if azure push is correctly configured
         if self.ACCOUNT_NAME is None or self.ACCOUNT_KEY is None:
-            print("Azure integration not configured, skipping")
+            logger.warning("Azure integration not configured, skipping")
             self._enabled = False
             return
 
@@ -76,13 +82,13 @@ class Module(object):
 
             # Set the permission so the blobs are public.
             if self.block_blob_service.set_container_acl(self.container_name, public_access=PublicAccess.Container) is None:
-                print("Something went from when setting the container")
+                logger.error("Something went wrong when setting the container")
                 return
 
             # it is set to True -> all okay
             self._enabled = True
         except Exception as e:
-            print("AZURE ERROR: {}".format(e))
+            logger.error("AZURE ERROR: {}", e)
             self._enabled = False
 
         if self._local_delete is "on":
@@ -92,7 +98,7 @@ class Module(object):
                     if os.path.isfile(file_path):
                         os.unlink(file_path)
                 except Exception as e:
-                    print(e)
+                    logger.error("Deleting local file failed: {}", e)
 
     def create_container(self):
         """
@@ -101,7 +107,7 @@ class Module(object):
         try:
             self.block_blob_service.create_container(self.container_name)
         except Exception as e:
-            print("Something went wrong when creating container, error: {}".format(e))
+            logger.error("Something went wrong when creating container, error: {}", e)
             return
 
     def upload_via_path(self,_path):
@@ -118,18 +124,21 @@ class Module(object):
             file.close()
 
             # debug
-            print("Uploading to storage file: {} {}".format(_path, filename))
+            logger.debug("Uploading to storage file: {} {}", _path, filename)
 
             # uploading it
             if self.block_blob_service.create_blob_from_path(self.container_name, filename, _path) is None:
-                print("Something went wrong on upload!")
+                logger.error("Something went wrong on upload!")
                 return
 
+            self._uploaded_bytes.inc(os.path.getsize(_path), module=__name__)
+            self._boot.storage.mark_uploaded(_path)
+
             # debug
-            print("Uploaded: {}".format(filename))
+            logger.debug("Uploaded: {}", filename)
 
         except Exception as e:
-            print("AZURE ERROR: {}".format(e))
+            logger.error("AZURE ERROR: {}", e)
 
     def delete_via_container(self, _container_name):
         """
@@ -137,19 +146,19 @@ class Module(object):
         """
         try:
             if self.block_blob_service.delete_container(_container_name) is False:
-                print("Something went wrong on delete!")
+                logger.error("Something went wrong on delete!")
                 return
-            print("Deleted: {}".format(_container_name))
+            logger.info("Deleted: {}", _container_name)
 
         except Exception as e:
-            print("AZURE ERROR: {}".format(e))
+            logger.error("AZURE ERROR: {}", e)
 
     def process(self, modules):
         """
         Process for the azure module
         """
         if self._enabled is False:
-            print("WARNING: Skipping Azure images module...")
+            logger.debug("Skipping Azure images module...")
             return
 
         try:     # Get file names from server
@@ -159,19 +168,20 @@ class Module(object):
             # Check for local files and upload ones not on server
             self._new_files = [f for f in listdir(images_path) if isfile(join(images_path, f))]
             difference = list(set(self._new_files) - set(self._old_files))
+            for item in set(self._new_files) & set(self._old_files):
+                self._boot.storage.mark_uploaded(join(images_path, item))
             if difference:
-                print("Azure: New files to upload: ")
-                print(difference)
+                logger.info("Azure: New files to upload: {}", difference)
             for item in difference:
                 full_path_item = join(images_path, item)
                 self.upload_via_path(full_path_item)
 
             # self-disable upon successful completion if so defined
-            if os.environ.get('AZURE_RUN', 'cont')=='once':
+            if self._boot.config.azure_run == 'once':
                 self._enabled = False
           
         except Exception as e:
-            print("AZURE ERROR: {}".format(e))
+            logger.error("AZURE ERROR: {}", e)
 
     def shutdown(self, modules):
         """
@@ -31,6 +31,12 @@ from os.path import isfile, join
 from azure.storage.blob import BlockBlobService, PublicAccess
 from azure.common import AzureException
 
+from ..const import METRIC_UPLOADED_BYTES
+from ..files import TEMP_SUFFIX
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 # sync folder path on device
 sync_folder_path = "/data/"
 # subfolders in sync folder - upload to azure only
@@ -46,14 +52,13 @@ class Module(object):
         """
         self._boot = boot
         self._enabled = False
+        self._uploaded_bytes = boot.metrics.counter(METRIC_UPLOADED_BYTES, 'Number of bytes uploaded.')
 
         self.enable_logging = os.environ.get('AZURE_LOGGING', 'off') # enable request logging 
         if self.enable_logging == 'on':
             logging.basicConfig(format='%(asctime)s %(name)-20s %(levelname)-5s %(message)s', level=logging.INFO)
         azure_protocol = os.environ.get('AZURE_PROTOCOL', 'https')  # protocol to use for requests
 
-        self.module_runs = os.environ.get('AZURE_RUN', 'cont')  # how to run processing loop
-
         self.ACCOUNT_NAME = os.environ.get('AZURE_ACCOUNT_NAME', None)                  # get azure account name from env var
         self.ACCOUNT_KEY = os.environ.get('AZURE_ACCOUNT_KEY', None)                    # get azure account key from env var
         # Azure Blob Storage container's name cannot exceed 63 characters and must be lowercase
@@ -63,7 +68,7 @@ class Module(object):
 
         # Check if azure push is correctly configured
         if self.ACCOUNT_NAME is None or self.ACCOUNT_KEY is None:
-            print("Azure integration is not configured, skipping...")
+            logger.warning("Azure integration is not configured, skipping...")
             self._enabled = False
             return
 
@@ -83,7 +88,7 @@ class Module(object):
 
             # Set the permission so the blobs are public.
             if self.block_blob_service.set_container_acl(self.container_name, public_access=PublicAccess.Container) is None:
-                print("Something went from when setting the container")
+                logger.error("Something went wrong when setting the container")
                 return
 
             # it is set to True -> all okay
@@ -109,15 +114,19 @@ class Module(object):
                 self.down_update_via_path(item, sync_folder_path)
             # download files that are not on device
             if difference:
-                print("Azure: New sync files to download: ")
-                print(difference)   
+                logger.info("Azure: New sync files to download: {}", difference)
             for item in difference:
                 self.download_via_path(item, sync_folder_path)
 
         except Exception as e:
-            print("AZURE ERROR: {}".format(e))
+            logger.error("AZURE ERROR: {}", e)
             self._enabled = False
         
+    @property
+    def module_runs(self):
+        """How to run processing loop (AZURE_RUN)."""
+        return self._boot.config.azure_run
+
     def create_container(self):
         """
         Inits the container under self.container_name name
@@ -126,7 +135,7 @@ class Module(object):
             self.block_blob_service.create_container(self.container_name)
             return True
         except Exception as e:
-            print("Something went wrong when creating container, error: {}".format(e))
+            logger.error("Something went wrong when creating container, error: {}", e)
             return False
 
     def upload_via_path(self, _path, _subfolder):
@@ -149,15 +158,18 @@ class Module(object):
                 _subfolder = ""
             # uploading it
             if self.block_blob_service.create_blob_from_path(self.container_name, _subfolder + filename, _path) is None:
-                print("Something went wrong on upload!")
+                logger.error("Something went wrong on upload!")
                 return False
 
+            self._uploaded_bytes.inc(os.path.getsize(_path), module=__name__)
+            self._boot.storage.mark_uploaded(_path)
+
             # debug
-            print("Uploaded: {}".format(filename))
+            logger.debug("Uploaded: {}", filename)
             return True
 
         except Exception as e:
-            print("AZURE upload failed: {}".format(e))
+            logger.error("AZURE upload failed: {}", e)
             return False
     
     def download_via_path(self, _filename, _path):
@@ -168,7 +180,7 @@ class Module(object):
             full_path = os.path.join(_path, _filename)
             self.block_blob_service.get_blob_to_path(self.container_name, _filename, full_path)
         except Exception as e:
-            print("AZURE download new file failed: {}".format(e))
+            logger.error("AZURE download new file failed: {}", e)
 
     def down_update_via_path(self, _filename, _path):
         """
@@ -184,11 +196,11 @@ class Module(object):
             server_last_modified = blob.properties.last_modified.replace(tzinfo=None)
             # we download the file if on server is newer 
             if server_last_modified > local_last_modified:
-                print("Updating local file: {}".format(_filename))
+                logger.info("Updating local file: {}", _filename)
                 self.block_blob_service.get_blob_to_path(self.container_name, _filename, full_path)
             
         except Exception as e:
-            print("AZURE download sync file failed: {}".format(e))
+            logger.error("AZURE download sync file failed: {}", e)
     
     def up_update_via_path(self, _filename, _path):
         """
@@ -204,11 +216,12 @@ class Module(object):
             server_last_modified = blob.properties.last_modified.replace(tzinfo=None)
             # we upload the file to azure if on device is newer
             if server_last_modified < local_last_modified:
-                print("Updating file on Azure: {}".format(_filename))
+                logger.debug("Updating file on Azure: {}", _filename)
                 self.block_blob_service.create_blob_from_path(self.container_name, _filename, full_path)
+                self._uploaded_bytes.inc(stat.st_size, module=__name__)
             
         except Exception as e:
-            print("AZURE upload sync file failed: {}".format(e))
+            logger.error("AZURE upload sync file failed: {}", e)
 
     def delete_via_container(self, _container_name):
         """
@@ -216,12 +229,12 @@ class Module(object):
         """
         try:
             if self.block_blob_service.delete_container(_container_name) is False:
-                print("Something went wrong on delete!")
+                logger.error("Something went wrong on delete!")
                 return
-            print("Deleted: {}".format(_container_name))
+            logger.info("Deleted: {}", _container_name)
 
         except Exception as e:
-            print("AZURE deleting container failed: {}".format(e))
+            logger.error("AZURE deleting container failed: {}", e)
 
     def upload_only_folder(self, _path):
         """
@@ -234,8 +247,10 @@ class Module(object):
             # Check for local files and upload ones not on server
             new_files = []
             full_path_folder = sync_folder_path + _path
-            new_files = [f for f in listdir(full_path_folder) if isfile(join(full_path_folder, f))]
+            new_files = [f for f in listdir(full_path_folder) if isfile(join(full_path_folder, f)) and not f.endswith(TEMP_SUFFIX)]
             difference = list(set(new_files) - set(old_files))
+            for item in set(new_files) & set(old_files):
+                self._boot.storage.mark_uploaded(join(full_path_folder, item))
             if difference:
                 #print("Azure: Found new files to upload in folder {}".format(_path))
                 #print(difference)
@@ -247,13 +262,13 @@ class Module(object):
 
         except (AzureException, Timeout) as e:
             if self.enable_logging == 'on':
-                print("AZURE ERROR: {}".format(e))
+                logger.error("AZURE ERROR: {}", e)
             else:
-                print("Network link too bad, skipping...")
+                logger.warning("Network link too bad, skipping...")
             return False
           
         except Exception as e:
-            print("AZURE ERROR: {}".format(e))
+            logger.error("AZURE ERROR: {}", e)
             return False
     
     def process(self, modules):
@@ -262,7 +277,7 @@ class Module(object):
         We sync csv files and upload new raw and camera files.
         """
         if self._enabled is False:
-            print("WARNING: Skipping Azure module...")
+            logger.debug("Skipping Azure module...")
             return
 
         # current process loop flag for upload status
@@ -283,13 +298,13 @@ class Module(object):
                 if server_last_modified > newest_timestamp:
                     newest_timestamp = server_last_modified
             # if right now is new day, upload stuff, otherwise disable the module
-            time_now = datetime.now()
+            time_now = self._boot.clock.now()
             if newest_timestamp.day == time_now.day:
-                print("Daily upload already made, disabling Azure module...")
+                logger.info("Daily upload already made, disabling Azure module...")
                 self._enabled = False
                 return
             else:
-                print("Daily upload to Azure in progress...")
+                logger.info("Daily upload to Azure in progress...")
         
         # upload csv files from calculated directory
         local_files = []
@@ -312,12 +327,12 @@ class Module(object):
         # upload new files from subdirectories
         result = self.upload_only_folder(raw_data_folder_path)
         if result is False:
-            print("Error when uploading raw data to Azure.")
+            logger.warning("Error when uploading raw data to Azure.")
             status_ok = False
         if 'pira.modules.camera' in modules:
             result = self.upload_only_folder(camera_folder_path)
             if result is False:
-                print("Error when uploading camera data to Azure.")
+                logger.warning("Error when uploading camera data to Azure.")
                 status_ok = False
         if 'pira.modules.light_calculator' in modules:
             # upload light_raw_values.json file on server
@@ -343,7 +358,7 @@ class Module(object):
         try:
             # local folder sync with Azure -> upload files to server
             local_files = []
-            local_files = [f for f in listdir(sync_folder_path) if isfile(join(sync_folder_path, f))]
+            local_files = [f for f in listdir(sync_folder_path) if isfile(join(sync_folder_path, f)) and not f.endswith(TEMP_SUFFIX)]
             # get list of server files - max 100 files, only in root dir
             server_files = []
             generator = self.block_blob_service.list_blobs(self.container_name, num_results=100, timeout=3, delimiter="/")
@@ -365,8 +380,7 @@ class Module(object):
                 # we don't upload config.json at all
                 if 'config.json' in difference:
                     files_on_both.remove('config.json')
-                print("Azure: New sync files to upload: ")
-                print(difference)
+                logger.info("Azure: New sync files to upload: {}", difference)
             for item in difference:
                 full_path_item = join(sync_folder_path, item)
                 self.upload_via_path(full_path_item, None)
@@ -376,7 +390,7 @@ class Module(object):
                 self.delete_via_container(self.container_name)
         
         except Exception as e:
-            print("AZURE ERROR: {}".format(e))
+            logger.error("AZURE ERROR: {}", e)
 
          # delete local files
         if self._local_delete is "on":
@@ -386,5 +400,5 @@ class Module(object):
                     if os.path.isfile(file_path):
                         os.unlink(file_path)
                 except Exception as e:
-                    print(e)
+                    logger.error("Deleting local file failed: {}", e)
         pass
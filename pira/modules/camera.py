@@ -22,14 +22,23 @@ from os import listdir
 from os.path import isfile, join
 
 from ..hardware.brightpilib import *
+from ..logger import get_logger
+from ..storage import CATEGORY_CAMERA, MIB
+from .. import iostats
 import numpy as np
 import array
 import picamera
 import picamera.array
 
+logger = get_logger(__name__)
+
 # Image storage location.
 CAMERA_STORAGE_PATH = '/data/camera'
 
+# Storage requested before taking a snapshot and before and during video recording.
+SNAPSHOT_SIZE = 8 * MIB
+VIDEO_SIZE = 1024 * MIB
+
 
 class Module(object):
     def __init__(self, boot):
@@ -38,6 +47,8 @@ class Module(object):
         self._recording_start = None
         self._last_snapshot = None
         self._brightPi = None
+        self._video_path = None
+        self._video_written = 0
 
         self.resolution = os.environ.get('CAMERA_RESOLUTION', '1280x720')
         self.camera_shutdown = os.environ.get('CAMERA_FAIL_SHUTDOWN', '0')
@@ -83,16 +94,14 @@ class Module(object):
         except OSError:
             pass
 
-        now = datetime.datetime.now()
+        now = self._boot.clock.now()
 
         # Check how much space is left
-        info = os.statvfs(CAMERA_STORAGE_PATH)
-        free_space = (info.f_frsize * info.f_bavail / (1024.0 * 1024.0 * 1024.0))
-        print("Storage free space:", free_space, "GiB")
+        logger.info("Storage free space: {} GiB", self._boot.storage.free_space() / (1024.0 * MIB))
 
         # Do not record or take snapshots when charging if so configured
         if self._boot.is_charging and not self.should_sleep_when_charging:
-            print("We are charging, not recording.")
+            logger.info("We are charging, not recording.")
             return
 
         # Create the camera object
@@ -100,27 +109,27 @@ class Module(object):
             self._camera = picamera.PiCamera()
             self._camera.resolution = self.resolution
         except picamera.PiCameraError:
-            print("ERROR: Failed to initialize camera.")
+            logger.error("Failed to initialize camera.")
             # ask the system to shut-down
             if self.camera_fail_shutdown:
                 self._boot.shutdown()
-                print("Requesting shutdown because of camera initialization fail.")
+                logger.warning("Requesting shutdown because of camera initialization fail.")
             return
 
         # Create the flash object
         try:
             self._brightPi = BrightPi()
         except:
-            print("WARNING: Failed to initialize flash.")
+            logger.warning("Failed to initialize flash.")
             self._brightPi = None
 
         # Check for free space
-        if free_space < 1:
-            print("Not enough free space (less than 1 GiB), do not save snapshots or record")
+        if not self._boot.storage.request_write(CATEGORY_CAMERA, SNAPSHOT_SIZE):
+            logger.warning("Not enough free space, do not save snapshots or record")
             return
         # check if interval is set to daily -> pass because snapshot will be taken in process loop
         elif self.snapshot_interval != 'daily' and self.snapshot_interval != 'off':
-            print("INFO: Snapshot interval set to " + str(self.snapshot_interval) + " minutes.")
+            logger.info("Snapshot interval set to {} minutes.", self.snapshot_interval)
             # Store single snapshot only if above threshold, else do not record
             if not self._snapshot():
                 # turn off video recording
@@ -129,54 +138,52 @@ class Module(object):
                 # ask the system to shut-down
                 if self.camera_fail_shutdown:
                     self._boot.shutdown()
-                    print("Requesting shutdown because of low-light conditions.")
+                    logger.warning("Requesting shutdown because of low-light conditions.")
                 return
 
         # Record a video of configured duration or until sleep.
         if self.video_duration == 'off':
-            print("Not recording video as it is disabled.")
+            logger.info("Not recording video as it is disabled.")
             return
 
         # Check if there is enough space to start recording
-        print("Storage free space:", free_space, "GiB")
-        if free_space < 2:
-            print("Not enough free space (less than 2 GiB), skipping video recording")
+        if not self._boot.storage.request_write(CATEGORY_CAMERA, VIDEO_SIZE):
+            logger.warning("Not enough free space, skipping video recording")
             self._camera = None
             return
 
-        print("Starting video recording (duration {}).".format(self.video_duration))
-        self._camera.start_recording(
-            os.path.join(
-                CAMERA_STORAGE_PATH,
-                'video-{year}-{month:02d}-{day:02d}-{hour:02d}-{minute:02d}-{second:02d}.h264'.format(
-                    year=now.year,
-                    month=now.month,
-                    day=now.day,
-                    hour=now.hour,
-                    minute=now.minute,
-                    second=now.second,
-                )
-            ),
-            format='h264'
+        logger.info("Starting video recording (duration {}).", self.video_duration)
+        self._video_path = os.path.join(
+            CAMERA_STORAGE_PATH,
+            'video-{year}-{month:02d}-{day:02d}-{hour:02d}-{minute:02d}-{second:02d}.h264'.format(
+                year=now.year,
+                month=now.month,
+                day=now.day,
+                hour=now.hour,
+                minute=now.minute,
+                second=now.second,
+            )
         )
+        self._camera.start_recording(self._video_path, format='h264')
+        iostats.record(__name__, created=1)
         self._recording_start = now
 
     def process(self, modules):
         # This runs if camera is initialized
         if self._camera:
-            now = datetime.datetime.now()
+            now = self._boot.clock.now()
 
-            info = os.statvfs(CAMERA_STORAGE_PATH)
-            free_space = (info.f_frsize * info.f_bavail / (1024.0 * 1024.0 * 1024.0))
             stop_recording=False
 
             # Stop recording if we happen to start charging
             if self._boot.is_charging and not self.should_sleep_when_charging:
-                print("We are charging, stop recording.")
-                stop_recording=True
-            if free_space < 2:
-                print("Not enough free space (less than 2 GiB), stop video recording")
+                logger.info("We are charging, stop recording.")
                 stop_recording=True
+            if self._video_path is not None:
+                self._account_video()
+                if not self._boot.storage.request_write(CATEGORY_CAMERA, VIDEO_SIZE):
+                    logger.warning("Not enough free space, stop video recording")
+                    stop_recording=True
             # Check if duration of video is achieved.
             if self.video_duration_min is not None and now - self._recording_start >= self.video_duration_min:
                 stop_recording=True
@@ -184,9 +191,12 @@ class Module(object):
             if stop_recording:
                 try:
                     self._camera.stop_recording()
-                    print("Video recording has stopped after: ",now - self._recording_start)
+                    logger.info("Video recording has stopped after: {}", now - self._recording_start)
                 except:
                     pass
+                if self._video_path is not None:
+                    self._account_video()
+                    self._video_path = None
 
             # if we need daily snapshot
             if self.snapshot_interval == 'daily':
@@ -201,10 +211,10 @@ class Module(object):
                         this_timestamp = datetime.datetime.strptime(s_timestamp[:-time_index], "%Y-%m-%d--%H-%M-%S")
                         if this_timestamp > newest_timestamp:
                             newest_timestamp = this_timestamp
-                time_now = datetime.datetime.now()
+                time_now = self._boot.clock.now()
                 # if we are in a new day and specified hour to take snapshot is now or in the past -> take snapshot
                 if newest_timestamp.day != time_now.day and self.snapshot_hour <= time_now.hour:
-                    print("Taking daily snapshot...")
+                    logger.info("Taking daily snapshot...")
                     self._snapshot()
 
             # make snapshots if so defined and not recording
@@ -213,6 +223,17 @@ class Module(object):
             
         return
 
+    def _account_video(self):
+        """Update storage index and I/O accounting with the current size of the video."""
+        self._boot.storage.add(CATEGORY_CAMERA, self._video_path)
+        try:
+            size = os.path.getsize(self._video_path)
+        except OSError:
+            return
+
+        iostats.record(__name__, written=size - self._video_written)
+        self._video_written = size
+
     def _check_light_conditions(self):
         """Check current light conditions."""
         image = None
@@ -227,7 +248,7 @@ class Module(object):
             #light_level = np.mean(light_level)
             light_level = np.average(light_level) # numpy
         except:
-            print("ERROR: calculating light level...")
+            logger.exception("Calculating light level failed.")
 
         self.light_level = light_level
 
@@ -235,9 +256,13 @@ class Module(object):
 
     def _snapshot(self):
         """Make a snapshot if there is enough light"""
+        if not self._boot.storage.request_write(CATEGORY_CAMERA, SNAPSHOT_SIZE):
+            logger.warning("Not enough free space, not taking snapshot")
+            return False
+
         # Store single snapshot only if above threshold
         if self._check_light_conditions():
-            now = datetime.datetime.now()
+            now = self._boot.clock.now()
             self._last_snapshot = now
 
             self._new_path = os.path.join(
@@ -276,7 +301,9 @@ class Module(object):
                 self._brightPi.set_led_on_off(LED_WHITE, OFF)
                 self._brightPi.set_led_on_off(LED_IR, OFF)
 
-            print("Snapshot taken at light level:", self.light_level)
+            self._boot.storage.add(CATEGORY_CAMERA, self._new_path)
+            iostats.record(__name__, written=os.path.getsize(self._new_path), created=1)
+            logger.info("Snapshot taken at light level: {}", self.light_level)
 
             return True
 
@@ -296,8 +323,8 @@ class Module(object):
 
     @property
     def should_sleep_when_charging(self):
-        return os.environ.get('SLEEP_WHEN_CHARGING', '0') == '1'
+        return self._boot.config.sleep_when_charging
 
     @property
     def camera_fail_shutdown(self):
-        return os.environ.get('CAMERA_FAIL_SHUTDOWN', '0') == '1'
+        return self._boot.config.camera_fail_shutdown
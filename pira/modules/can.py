@@ -8,22 +8,45 @@ ENV VARS:
     - CAN_NUM_DEV
     - CAN_NUM_SEN
     - CAN_RUN
+    - CAN_POLL_WINDOW (default 8, at most 8), number of sensors polled at the same time
+    - CAN_RESCAN_INTERVAL (default 86400), seconds between full scans when sensors are cached
+    - CAN_SILENT_POLLS (default 3), consecutive polls a sensor does not respond to before the bus is rescanned
 """
 from __future__ import print_function
 
 from ..messages import MeasurementConfig
 from ..hardware import mcp2515
+from .can_poller import SensorPoller, POLL_WINDOW
+from ..logger import get_logger
+from ..bus import Sample
+from ..const import TOPIC_CAN_SAMPLES
+from ..storage import CATEGORY_RAW
+from .. import files
+from .. import rawdata
 
 import os
-import time
 import json
-import datetime
-import struct
+import collections
 import pickle
+import hashlib
+
+logger = get_logger(__name__)
 
 # Raw data files storage location.
 RAW_DATA_STORAGE_PATH = '/data/raw'
 
+# Metrics.
+METRIC_CAN_FRAMES = 'pira_can_frames_total'
+
+# Sensors found by the latest full scan.
+STATE_TOPOLOGY = 'can.topology'
+
+# Default seconds between full scans.
+RESCAN_INTERVAL = 86400
+
+# Default number of consecutive polls without a reply after which a sensor is considered gone.
+SILENT_POLLS = 3
+
 class Module(object):
     def __init__(self, boot):
         """ Inits the module and mcp2515 """
@@ -35,14 +58,19 @@ class Module(object):
         except OSError:
             pass
 
-        self.devices_json = {}
+        # Latest sample of every series (device_sensor_variable) of found sensors.
+        self.latest = {}
         self.sensors_list = []
+        self._frames = boot.metrics.counter(METRIC_CAN_FRAMES, 'Number of CAN frames sent and received.')
+        self._reported_rx = 0
+        self._reported_tx = 0
+        boot.bus.declare(TOPIC_CAN_SAMPLES, Sample)
 
         try:
             # init driver
             self._driver = mcp2515.MCP2515()
         except:
-            print("WARNING: CAN connection failed.")
+            logger.warning("CAN connection failed.")
             self._enabled = False
             return
 
@@ -57,220 +85,215 @@ class Module(object):
             self._num_sen_addrs = int(num_sen_addrs)
         except:
             self._num_sen_addrs = 10
+        try:
+            poll_window = int(os.environ.get('CAN_POLL_WINDOW', POLL_WINDOW))
+        except ValueError:
+            poll_window = POLL_WINDOW
+        self._poller = SensorPoller(self._driver, boot.clock, window=poll_window)
+
+        try:
+            self._rescan_interval = float(os.environ.get('CAN_RESCAN_INTERVAL', RESCAN_INTERVAL))
+        except ValueError:
+            self._rescan_interval = RESCAN_INTERVAL
+        self._rescan = False
+        try:
+            self._silent_polls = max(1, int(os.environ.get('CAN_SILENT_POLLS', SILENT_POLLS)))
+        except ValueError:
+            self._silent_polls = SILENT_POLLS
+        # Sensor -> number of consecutive polls it did not respond to.
+        self._silent = {}
 
-        # Scan for CAN devices and their sensors
+        # Only frames from scanned addresses are received, unknown sensors in that range must
+        # still be seen to trigger a rescan
+        self._driver.set_filters(self._candidates())
+
+        # Reuse sensors found by an earlier scan, if all of them still respond
+        if not self._load_topology():
+            self.scan()
+
+        self._record_frames()
+        self._enabled = True
+
+    def _fingerprint(self, sensors):
+        """ Fingerprint of scanned address range, bus speed and found sensors """
+        topology = [self._num_dev_addrs, self._num_sen_addrs, os.environ.get('CAN_SPEED', '')] + sorted(sensors)
+        return hashlib.md5(json.dumps(topology).encode('utf-8')).hexdigest()
+
+    def _load_topology(self):
+        """ Use cached sensors if they are recent and all of them respond, returns True on success """
+        topology = self._boot.state[STATE_TOPOLOGY]
+        if not topology or not topology.get('sensors'):
+            return False
+        if topology.get('fingerprint') != self._fingerprint(topology['sensors']):
+            return False
+        if self._boot.clock.time() - topology['scanned'] >= self._rescan_interval:
+            logger.info("CAN: cached sensors expired, rescanning.")
+            return False
+
+        sensors = topology['sensors']
+        responses = self._poller.discover(sensors)
+        if not all(responses.get(address) for address in sensors):
+            logger.info("CAN: cached sensors do not respond, rescanning.")
+            return False
+
+        self.sensors_list = list(sensors)
+        self._scanned = topology['scanned']
+        logger.info("CAN: Using cached sensors on addresses: {}", [hex(x) for x in self.sensors_list])
+        return True
+
+    def _candidates(self):
+        """ Addresses of all devices and their sensors probed by a scan """
         device_addr = "0x100"   # address of first can device to scan
         hex_addr = int(device_addr, 16)
+        return [
+            hex_addr + i*256 + j
+            for i in range(0, self._num_dev_addrs)
+            # check from 0, which is device to the max number of sensors
+            for j in range(0, self._num_sen_addrs+1)
+        ]
+
+    def scan(self):
+        """ Scan for CAN devices and their sensors, addresses are probed concurrently """
+        device_addr = "0x100"   # address of first can device to scan
+        hex_addr = int(device_addr, 16)
+        responses = self._poller.discover(self._candidates())
+        sensors_list = []
         for i in range (0, self._num_dev_addrs):
             dev_addr = hex_addr + i*256
-            # check from 0, which is device to the max number of sensors
             for j in range(0, self._num_sen_addrs+1):
                 sen_addr = dev_addr + j
-                can_return = self.scan_for_sensors(sen_addr)
-                #if sensor present add it to the list
-                if can_return>0:
-                    self.sensors_list.append(sen_addr)
-                #if received the response but not present continue through the loop
-                elif can_return==0:
-                    continue #go to the next loop iteration
                 #if no response device is not present and skip to next device
-                elif can_return<0:
+                if sen_addr not in responses:
                     break # break out of this loop
                     #note if one sensor does not respond, it will not continue this way
-
+                #if sensor present add it to the list
+                if responses[sen_addr]:
+                    sensors_list.append(sen_addr)
+
+        self.sensors_list = sensors_list
+        # Forget latest values of sensors which are gone
+        found = set("{}_{}_".format(int(address/0x100), address % 256) for address in self.sensors_list)
+        for series in list(self.latest):
+            if series[:series.rindex('_') + 1] not in found:
+                del self.latest[series]
         if self.sensors_list:
-            print("CAN: Found sensors on addresses:")
-            print([hex(x) for x in self.sensors_list])    #Print sensor ids
+            logger.info("CAN: Found sensors on addresses: {}", [hex(x) for x in self.sensors_list])
         else:
-            print("CAN: Didn't find any sensors returning proper data.")
-
-        self._enabled = True
-
-    def scan_for_sensors(self, address):
-        """ Scan at address, return 1 if sensor returns expected data, 0 if responding but not present and -1 if timeout """
-        # Clear rx buffer
-        data_read = self._driver.get_raw_data()
-        #print("CAN: on " + str(hex(address)) + " clearing rx: " + str(data_read))
-
-        # send a "wakeup" to the sensor, send 0x02 indicating scan
-        self._driver.send_data(address, [0x02], False)
-        time.sleep(0.1)
-
-        # Sensor returns two zeros for data if not available
-        result = self._driver.get_data()
-        if result is None:
-            #print("ERROR: Failed receiving message from CAN.")
-            self._driver.flush_buffer()
-            # this means the device is not present, can skip to next device, TODO
-            return -1
-        if (result.dlc == 0 or (len(result.data) < 4)):
-            #print("Nothing to read.")
-            return 0
-
-        # We read the data from sensors only to clear the buffer
-        num_data = result.data[0]   # nr of columns
-        num_var = result.data[1]    # nr of variables
-        for var in range(0, num_var):
-            for dat in range(0, num_data):
-                data_read = self._driver.get_raw_data() # data
-                data_read = self._driver.get_raw_data() # time
-
-
-        return 1
-
+            logger.warning("CAN: Didn't find any sensors returning proper data.")
+
+        self._scanned = self._boot.clock.time()
+        self._rescan = False
+        self._silent = {}
+        self._boot.state[STATE_TOPOLOGY] = {
+            'fingerprint': self._fingerprint(self.sensors_list),
+            'sensors': list(self.sensors_list),
+            'scanned': self._scanned,
+        }
+
+    def _check_topology(self):
+        """ Request a rescan if a sensor stopped responding or an unknown sensor appeared """
+        # A single missed reply is not worth a rescan, which discards the data of all sensors.
+        self._silent = dict((sensor, self._silent.get(sensor, 0) + 1) for sensor in self._poller.silent)
+        gone = sorted(sensor for sensor, polls in self._silent.items() if polls >= self._silent_polls)
+        if gone:
+            logger.info("CAN: sensors {} stopped responding, rescanning.", [hex(x) for x in gone])
+            self._rescan = True
+        if self._poller.unknown:
+            logger.info("CAN: unknown sensors {} on the bus, rescanning.", [hex(x) for x in sorted(self._poller.unknown)])
+            self._rescan = True
+
+    def _record_frames(self):
+        """ Report frames transferred by the driver since the last call """
+        self._frames.inc(self._driver.rx_frames - self._reported_rx, direction='rx')
+        self._frames.inc(self._driver.tx_frames - self._reported_tx, direction='tx')
+        self._reported_rx = self._driver.rx_frames
+        self._reported_tx = self._driver.tx_frames
 
     def get_data_json(self, sensor_ID):
         """ Read data from sensor """
-        # Clear rx buffer
-        data_read = self._driver.get_raw_data()
-        #print("CAN: on " + str(hex(sensor_ID)) + " clearing rx: " + str(data_read))
-
-        # send a "wakeup" to the sensor 1
-        self._driver.send_data(sensor_ID, [0x01], False)
-        send_time = datetime.datetime.now()  # we save current rpi time
-
-        # receive message and read how many data points are we expecting
-        number = self._driver.get_data()
-        if (number is None):
-            #print("ERROR: Failed receiving message from CAN.")
-            self._driver.flush_buffer()
-            return
-        # if sensor sends back two zeros there is nothing to read
-        if (number.dlc == 0 or (len(number.data) < 4)):
-            #print("Nothing to read.")
-            return
+        return self._poller.poll([sensor_ID]).get(sensor_ID)
 
-        # get how many coloumns there are (coloumn x 8bit)
-        num_of_data = number.data[0]
-        # get how many variables there are
-        num_of_var = number.data[1]
-        # get delta time between last measurement and can send
-        time_low = number.data[2]
-        time_high = number.data[3]
-        delta_time = datetime.timedelta(seconds=(float(time_high << 8 | time_low)/10))
-        read_time = send_time - delta_time
-
-        variables = {}
-
-        # go through the variables
-        for var in range(0, num_of_var):
-
-            # log the varaible number
-            #print("VAR {}".format(col))
-
-            values = {}
-            calculated_delta = 0
-            data_list = []
-            delta_list = []
-
-            # go through the amount of data in a var
-            for dat in range(0, num_of_data):
-
-                # read message DATA
-                self._message = self._driver.get_raw_data()
-
-                # print out our message received with dlc
-                #print("Message DLC: {}".format(self._message.dlc))
-                #print(*self._message.data, sep=", ")
-
-                # dlc represents how many data points are in the received message
-                for i in range(0, self._message.dlc, 2):
-                    # try except because of out of index error
-                    try:
-                        calc = float(self._message.data[i+1] << 8 | self._message.data[i])
-                        # conversion to negative numbers
-                        if calc > 32767:
-                            calc -= 65536
-                        data_list.append(calc)
-                    except:
-                        break
-
-                # read message TIME
-                self._message = self._driver.get_raw_data()
-
-                # print out our message received with dlc
-                #print("Time Message DLC: {}".format(self._message.dlc))
-                #print(*self._message.data, sep=", ")
-
-                # dlc represents how many data points are in the received message
-                if self._message:
-                    for i in range(0, self._message.dlc, 2):
-                        # try except because of out of index error
-                        try:
-                            calc = float(self._message.data[i+1] << 8 | self._message.data[i])
-                            delta_list.append(calc/10)
-                        except:
-                            break
-
-            # insert read data into json
-            for i in range(len(data_list)-1, -1, -1):
-                data = {}
-                data['data'] = data_list[i]
-                if i != len(data_list)-1:
-                    calculated_delta += delta_list[-1]
-                    delta_list.pop()
-                calculated_time = read_time - datetime.timedelta(seconds=calculated_delta)
-                data['time'] = str(calculated_time)
-                values[i] = data
-
-            variables[var] = values
-
-        #sensors_json[str(sensor_ID % 256)] = variables
-        return variables
+    def raw_series(self, samples):
+        """ Series (name, values, timestamps) of samples, in the raw data format """
+        series = collections.OrderedDict()
+        for sample in samples:
+            values, timestamps = series.setdefault(sample.series, ([], []))
+            values.append(sample.value)
+            timestamps.append(sample.timestamp)
+        return [(name, values, timestamps) for name, (values, timestamps) in series.items()]
 
     def return_json_data(self):
-        """ Create JSON object from devices sensor data """
-        dump = json.dumps(self.devices_json)
+        """ Create JSON object from latest sensor data """
+        dump = json.dumps(
+            dict((series, {'time': sample.timestamp, 'data': sample.value}) for series, sample in self.latest.items()),
+            default=str
+        )
         return dump
 
     def process(self, modules):
         """ Function to process sensors, sends out the data and receives """
         if not self._enabled:
-            print("WARNING: Skipping CAN module...")
+            logger.debug("Skipping CAN module...")
             return
         try:
-            # Call sensors and get data
+            if self._rescan or self._boot.clock.time() - self._scanned >= self._rescan_interval:
+                self.scan()
+
+            samples = []
+            # Call all sensors at once, replies are collected concurrently
+            readings = self._poller.poll(self.sensors_list)
+            self._check_topology()
             for j in self.sensors_list:
                 # list of measurements per sensor
-                sensor_data = self.get_data_json(j)
+                sensor_data = readings.get(j)
                 if sensor_data:     # if sensor returns some data
-                    sensor_json = {}
-                    #check if there is an entry for this device yet
                     device = int(j/0x100)
-                    if self.devices_json.has_key(str(device)):
-                        # load existing values and add
-                        sensor_json =self.devices_json[str(device)]
-                    # store sensor readings
-                    sensor_json[str(j % 256)] = sensor_data
-                    # write the data back to main json
-                    self.devices_json[str(device)] = sensor_json
-
-                time.sleep(0.1)
-
-            # DEBUG
-            #dumper = self.return_json_data()
-            #print(dumper) # incorrect values, repeated from last device
-
-            #save json file to /data folder on device
-            if self.devices_json:
-                timestr = datetime.datetime.now().strftime("%m%d%Y-%H%M%S")
-                json_file_name = "raw_values-" + timestr + ".json"
-                full_file_path = os.path.join(RAW_DATA_STORAGE_PATH, json_file_name)
-                print("Saved raw file: " + full_file_path)
-
-                with open(full_file_path, "w") as fp:
-                    json.dump(self.devices_json, fp)
+                    for var, columns in sorted(sensor_data.items()):
+                        series = "{}_{}_{}".format(device, j % 256, var)
+                        for timestamp, value in zip(columns.timestamps, columns.values):
+                            samples.append(Sample(series, rawdata.from_millis(int(timestamp)), float(value)))
+                        if len(columns.values):
+                            self.latest[series] = samples[-1]
+
+            #save samples of this poll to a raw file in /data folder on device
+            if samples:
+                timestr = self._boot.clock.now().strftime("%m%d%Y-%H%M%S")
+                raw_file_name = rawdata.RAW_PREFIX + timestr + rawdata.RAW_EXTENSION
+                full_file_path = os.path.join(RAW_DATA_STORAGE_PATH, raw_file_name)
+                exists = os.path.exists(full_file_path)
+                if exists:
+                    # poll within the same second, its samples are appended to the file
+                    raw_data = rawdata.encode_append(full_file_path, self.raw_series(samples))
+                else:
+                    raw_data = rawdata.encode(self.raw_series(samples))
+
+                if self._boot.storage.request_write(CATEGORY_RAW, len(raw_data)):
+                    if exists:
+                        files.append(__name__, full_file_path, raw_data)
+                    else:
+                        # replaced atomically, so processing never reads a partially written file
+                        files.replace(__name__, full_file_path, raw_data)
+                    self._boot.storage.add(CATEGORY_RAW, full_file_path)
+                    logger.debug("Saved raw file: {}", full_file_path)
+                else:
+                    logger.warning("CAN: no storage space for raw file, not saved.")
             else:
-                print("CAN: no new values have been read.")
+                logger.debug("CAN: no new values have been read.")
+
+            # share readings from this poll with other modules
+            if samples:
+                self._boot.bus.publish(TOPIC_CAN_SAMPLES, samples, timestamp=self._boot.clock.now())
+
+            self._record_frames()
 
             # self-disable upon successful completion if so defined
-            if os.environ.get('CAN_RUN', 'cont')=='once':
+            if self._boot.config.can_run == 'once':
                 self._driver.shutdown()
                 self._enabled = False
 
 
         except Exception as e:
-            print("Can module error: when processing - {}".format(e))
+            logger.exception("Can module error: when processing - {}", e)
 
     def shutdown(self, modules):
         """ Shutdown """
@@ -0,0 +1,264 @@
+"""
+can_poller.py
+
+Pipelined polling of CAN sensors. Data requests (0x01) are sent to up to `window` sensors back
+to back and replies are demultiplexed by arbitration id into per-sensor reassembly buffers, so
+sensor timeouts overlap and a poll of the whole bus takes about as long as the slowest sensor.
+Discovery works the same way, scan requests (0x02) are sent to all candidate addresses through
+the same window. The window is capped below the default socketcan transmit queue length (10
+frames), a full queue makes sending fail.
+
+Reply of a sensor to a data or scan request:
+    - header: number of data frames per variable, number of variables, time since the last
+      measurement in tenths of a second (uint16, little endian)
+    - for every variable and data frame: data frame (int16 values, little endian) followed by
+      time frame (uint16 deltas between measurements in tenths of a second, little endian)
+A header shorter than 4 bytes means the sensor has nothing to report.
+
+Replies are decoded into columns per variable, values and timestamps (milliseconds since
+epoch, as in raw data files) decoded from all frames of a variable at once.
+"""
+from __future__ import absolute_import
+
+import collections
+import struct
+import time
+
+import can
+
+# Optional numpy, columns are decoded into arrays when it is available.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ..logger import get_logger
+from .. import rawdata
+
+logger = get_logger(__name__)
+
+# Data and scan request commands.
+COMMAND_DATA = 0x01
+COMMAND_SCAN = 0x02
+
+# Seconds to wait for the next frame of a sensor before giving up on it.
+POLL_TIMEOUT = 1.0
+
+# Default and largest number of sensors polled at the same time, below the transmit queue length.
+POLL_WINDOW = 8
+MAX_POLL_WINDOW = 8
+
+# Seconds to wait for scan replies, and for the next frame of a replying address.
+DISCOVERY_TIMEOUT = 0.5
+
+# Decoded variable of a sensor reply, values and timestamps in milliseconds since epoch.
+Columns = collections.namedtuple('Columns', ['values', 'timestamps'])
+
+
+def _payload(message):
+    """Frame data without a trailing odd byte."""
+    return bytes(message.data[:message.dlc - message.dlc % 2])
+
+
+def _columns(data, deltas, read_time):
+    """Decode concatenated data and time frames of a variable into Columns.
+
+    The newest value was measured at read_time, each delta is the time between two
+    consecutive values, so timestamps are read_time minus the cumulative sum of deltas
+    taken from the newest value backwards.
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(data, dtype='<i2')
+        offsets = numpy.cumsum(numpy.frombuffer(deltas, dtype='<u2')[::-1].astype(numpy.int64) * 100)
+        count = len(values)
+        offsets = numpy.concatenate((numpy.zeros(1, dtype=numpy.int64), offsets))
+        # values older than the available deltas keep the oldest offset
+        positions = numpy.minimum(numpy.arange(count - 1, -1, -1), len(offsets) - 1)
+        return Columns(values, read_time - offsets[positions])
+
+    values = struct.unpack('<{}h'.format(len(data) // 2), data)
+    offsets = [0]
+    for delta in reversed(struct.unpack('<{}H'.format(len(deltas) // 2), deltas)):
+        offsets.append(offsets[-1] + delta * 100)
+    count = len(values)
+    return Columns(values, [read_time - offsets[min(count - 1 - index, len(offsets) - 1)] for index in range(count)])
+
+
+def decode_sensor_data(header, frames, send_time):
+    """Decode sensor reply into {variable: Columns}.
+
+    :param header: Header frame
+    :param frames: Data and time frames received after the header, may be incomplete
+    :param send_time: Time the data request was sent
+    """
+    # number of data frames per variable and number of variables
+    num_of_data = header.data[0]
+    num_of_var = header.data[1]
+    # time between last measurement and the request, in tenths of a second
+    read_time = rawdata.to_millis(send_time) - (header.data[3] << 8 | header.data[2]) * 100
+
+    variables = {}
+    for var in range(0, num_of_var):
+        pairs = frames[2 * var * num_of_data:2 * (var + 1) * num_of_data]
+        data = b''.join(_payload(message) for message in pairs[0::2])
+        deltas = b''.join(_payload(message) for message in pairs[1::2])
+        variables[var] = _columns(data, deltas, read_time)
+
+    return variables
+
+
+class Reassembly(object):
+    """Frames of a single sensor reply."""
+
+    def __init__(self, sensor_id, send_time, deadline):
+        self.sensor_id = sensor_id
+        self.send_time = send_time
+        self.deadline = deadline
+        self.header = None
+        self.frames = []
+        self.expected = None
+
+    @property
+    def responded(self):
+        return self.header is not None
+
+    @property
+    def has_data(self):
+        return bool(self.expected)
+
+    @property
+    def complete(self):
+        return self.expected is not None and len(self.frames) >= self.expected
+
+    def feed(self, message):
+        """Add a received frame."""
+        if self.header is None:
+            self.header = message
+            if message.dlc == 0 or len(message.data) < 4:
+                # Sensor sends back zeros if there is nothing to read.
+                self.expected = 0
+            else:
+                self.expected = 2 * message.data[0] * message.data[1]
+        else:
+            self.frames.append(message)
+
+    def decode(self):
+        """Decoded sensor data, None if there is nothing to report."""
+        if not self.expected:
+            return None
+        return decode_sensor_data(self.header, self.frames, self.send_time)
+
+
+class SensorPoller(object):
+    """Polls CAN sensors concurrently."""
+
+    def __init__(self, driver, clock, timeout=POLL_TIMEOUT, window=POLL_WINDOW):
+        self._driver = driver
+        self._clock = clock
+        self._timeout = timeout
+        self._window = max(1, min(window, MAX_POLL_WINDOW))
+        # Number of frames from unexpected arbitration ids.
+        self.unexpected = 0
+        # Arbitration ids seen during the last exchange which were not requested.
+        self.unknown = set()
+        # Sensors which did not respond to the last poll.
+        self.silent = []
+
+    def _drain(self, sensor_ids):
+        """Discard stale frames left in the receive queue."""
+        while True:
+            message = self._driver.receive(0)
+            if message is None:
+                break
+            if message.arbitration_id not in sensor_ids:
+                self.unknown.add(message.arbitration_id)
+
+    def _request(self, sensor_id, command, timeout):
+        try:
+            self._driver.send_data(sensor_id, [command], False)
+        except can.CanError as e:
+            # Sensor is left unanswered, other sensors are still polled.
+            logger.warning("CAN: request to sensor {} failed: {}", hex(sensor_id), e)
+            return Reassembly(sensor_id, self._clock.now(), time.time())
+        return Reassembly(sensor_id, self._clock.now(), time.time() + timeout)
+
+    def poll(self, sensor_ids):
+        """Request data from sensors and collect their replies.
+
+        :param sensor_ids: Sensor addresses
+        :return: Dict sensor id -> decoded data, sensors without data are omitted
+        """
+        results = {}
+        self.silent = []
+        for buffer in self._exchange(sensor_ids, COMMAND_DATA, self._timeout, self._window):
+            if not buffer.responded:
+                logger.debug("CAN: sensor {} did not respond.", hex(buffer.sensor_id))
+                self.silent.append(buffer.sensor_id)
+            elif not buffer.complete:
+                logger.warning("CAN: incomplete reply from sensor {}.", hex(buffer.sensor_id))
+            data = buffer.decode()
+            if data:
+                results[buffer.sensor_id] = data
+
+        return results
+
+    def discover(self, addresses, timeout=DISCOVERY_TIMEOUT):
+        """Send scan requests to all addresses, window at the same time, and collect replies.
+
+        :param addresses: Candidate sensor addresses
+        :param timeout: Seconds to wait for replies
+        :return: Dict address -> True if a sensor with data is present or False if the address
+            responded with nothing to read, addresses which did not respond are omitted
+        """
+        return dict(
+            (buffer.sensor_id, buffer.has_data)
+            for buffer in self._exchange(addresses, COMMAND_SCAN, timeout, self._window)
+            if buffer.responded
+        )
+
+    def _exchange(self, sensor_ids, command, timeout, window):
+        """Send command to sensors, at most window at the same time, and collect replies.
+
+        :return: List of reassembly buffers of all sensors
+        """
+        requested = set(sensor_ids)
+        self.unknown = set()
+        self._drain(requested)
+
+        waiting = list(reversed(sensor_ids))
+        active = {}
+        results = []
+
+        def finish(buffer):
+            del active[buffer.sensor_id]
+            results.append(buffer)
+
+        while waiting or active:
+            # Requests are sent back to back while the window allows.
+            while waiting and len(active) < window:
+                sensor_id = waiting.pop()
+                active[sensor_id] = self._request(sensor_id, command, timeout)
+
+            now = time.time()
+            for buffer in [buffer for buffer in active.values() if buffer.deadline <= now]:
+                finish(buffer)
+            if not active:
+                continue
+
+            message = self._driver.receive(max(0, min(buffer.deadline for buffer in active.values()) - now))
+            if message is None:
+                continue
+
+            buffer = active.get(message.arbitration_id)
+            if buffer is None:
+                self.unexpected += 1
+                if message.arbitration_id not in requested:
+                    self.unknown.add(message.arbitration_id)
+                continue
+
+            buffer.feed(message)
+            buffer.deadline = time.time() + timeout
+            if buffer.complete:
+                finish(buffer)
+
+        return results
@@ -1,39 +1,53 @@
 """
 debug.py
 
-It is a module that prints various debug information from Pira, RPi and other modules
+It is a module that reports various debug information from Pira, RPi and other modules.
+Information is recorded as a single structured log record per loop, to see it on the
+console enable info level for this module (LOG_LEVELS=pira.modules.debug=info).
 
 """
 
 from __future__ import print_function
 
+from ..logger import get_logger
+from ..const import TOPIC_ULTRASONIC_DISTANCE
+from .. import iostats
+
+logger = get_logger(__name__)
+
+
 class Module(object):
     def __init__(self, boot):
         self._boot = boot
 
     def process(self, modules):
-        print('=========================DEBUG=========================')
+        fields = {}
         if self._boot.pira_ok:     # Report Pira BLE values
-            print('Pira     : t - rtc time           : {}'.format(self._boot.get_time()))
-            print('Pira     : o - overview value     : {} s'.format(self._boot.get_pira_on_timer_set()))
-            print('Pira     : b - battery level      : ' + str(self._boot.get_voltage()) + ' V')
-            print('Pira     : p - safety on period   : {} s'.format(self._boot.get_pira_on_timer()))
-            print('Pira     : s - safety off period  : {} s'.format(self._boot.get_pira_sleep_timer()))
-            print('Pira     : r - reboot period      : {} s'.format(self._boot.get_pira_reboot_timer()))
-            print('Pira     : w - next wakeup        : {} s'.format(self._boot.get_pira_wakeup_timer()))
+            fields['rtc_time'] = self._boot.get_time()                  # t
+            fields['overview'] = self._boot.get_pira_on_timer_set()     # o
+            fields['battery'] = self._boot.get_voltage()                # b
+            fields['safety_on'] = self._boot.get_pira_on_timer()        # p
+            fields['safety_off'] = self._boot.get_pira_sleep_timer()    # s
+            fields['reboot'] = self._boot.get_pira_reboot_timer()       # r
+            fields['next_wakeup'] = self._boot.get_pira_wakeup_timer()  # w
+            fields['telemetry_age'] = self._boot.get_pira_telemetry_age()
         else:
-            print('Pira     : Not connected')
-        
+            fields['pira'] = 'not connected'
+
         #Report Pi values
-        print('Charging : {}'.format(self._boot.is_charging))
-        print('Debug    : {}'.format(self._boot.is_debug_enabled))
-        #print('Temp.    : {}'.format(self._boot.rtc.temperature))
+        fields['charging'] = self._boot.is_charging
+        fields['debug'] = self._boot.is_debug_enabled
+
+        # Report last distance measured by ultrasonic module if enabled.
+        distance = self._boot.bus.latest(TOPIC_ULTRASONIC_DISTANCE)
+        if distance is not None:
+            fields['distance'] = distance.samples[-1].value
 
-        # Report distance measured by ultrasonic module if enabled.
-        if 'pira.modules.ultrasonic' in modules:
-            print('Distance : {}'.format(modules['pira.modules.ultrasonic'].distance))
+        # Report bytes written (and fsyncs) per subsystem since boot.
+        for subsystem, totals in iostats.stats.totals().items():
+            fields['io.' + subsystem] = '{}B/{}fsync'.format(totals[iostats.BYTES], totals[iostats.FSYNCS])
 
-        print('=======================================================')
+        logger.info('Debug report', **fields)
 
     def shutdown(self, modules):
         """Shutdown module"""
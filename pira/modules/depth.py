@@ -2,8 +2,11 @@ from __future__ import print_function
 import time
 from ..messages import MeasurementConfig
 from ..hardware import devices, ms5837
+from ..logger import get_logger
 import os
 
+logger = get_logger(__name__)
+
 # Log events.
 LOG_DEPTH_DEPTH = 'depth.depth'
 LOG_DEPTH_ALTITUDE = 'depth.altitude'
@@ -20,6 +23,8 @@ MEASUREMENT_DEPTH_TEMPERATURE = MeasurementConfig(LOG_DEPTH_TEMPERATURE, int)
 class Module(object):
     def __init__(self, boot):
         self._boot = boot
+        for key in (LOG_DEPTH_DEPTH, LOG_DEPTH_PRESSURE, LOG_DEPTH_TEMPERATURE):
+            boot.log.set_deadband(key)
         self._driver = ms5837.MS5837(model=1, bus=1)
         self._driver.init()
         #if not self._driver.init():
@@ -29,7 +34,7 @@ class Module(object):
     def process(self, modules):
         # We have to read values from sensor to update pressure and temperature
         if not self._driver.read():
-            print("Depth sensor read failed!")
+            logger.error("Depth sensor read failed!")
 
         pressure = self._driver.pressure(ms5837.UNITS_mbar)
         temperature = self._driver.temperature(ms5837.UNITS_Centigrade)
@@ -37,7 +42,7 @@ class Module(object):
         depth = self._driver.depth()
         altitude = self._driver.altitude() # relative to Mean Sea Level pressure in air
 
-        print("Pressure:", pressure, " mbar  depth:", depth, " m  altitude:", altitude, "m temperature", temperature, " C")
+        logger.debug("Depth sensor reading", pressure_mbar=pressure, depth_m=depth, altitude_m=altitude, temperature_c=temperature)
 
         # Record measurement in log.
         self._boot.log.insert(LOG_DEPTH_DEPTH, int(depth))
@@ -10,17 +10,21 @@ Input AS: 1 sensor AS7341, 11 channels on 6 adc outputs - raw voltage
     Read 1: f5-f8, clear and nir
 
 Output: new line in light_raw_values.json file with timestamp and calculated channel values
-    file located in folder LIGHT_RAW_PATH
+    file located in folder LIGHT_RAW_PATH, lines are only ever appended to the file
 
 All MAX lists follow the same order: [ch1-dn, ch2-dn, ch3-dn, ch4-dn, ch1-up, ch2-up, ch3-up, ch4-up]
 '''
 
 import os
 import json
-import datetime
 
 from ..hardware import max11615
 from ..hardware import as7341
+from ..logger import get_logger
+from ..storage import CATEGORY_LIGHT
+from .. import files
+
+logger = get_logger(__name__)
 
 # MAX lists - values from sensor calibration certificates for NDVI / PIR
 bandwidth_list = [12.2, 9.3, 38.4, 43.3, 12.0, 9.4, 38.1, 43.0]
@@ -46,8 +50,7 @@ def calculate_ndvi(raws):
         except ZeroDivisionError:
             return 0
         except Exception as e:
-            #print("ERROR calculatind NDVI - {}".format(e))
-            print("ERROR calculatind NDVI.")
+            logger.error("Calculating NDVI failed - {}", e)
             return 0
 
 def calculate_pir(raws):
@@ -61,8 +64,7 @@ def calculate_pir(raws):
     except ZeroDivisionError:
         return 0
     except Exception as e:
-        #print("ERROR calculatind PIR - {}".format(e))
-        print("ERROR calculatind PIR.")
+        logger.error("Calculating PIR failed - {}", e)
         return 0
 
 class Module(object):
@@ -82,14 +84,14 @@ class Module(object):
             max_status = self._max.init()
 
         except:
-            print("WARNING: ADC connection failed.")
+            logger.warning("ADC connection failed.")
             self._max = None
 
         try:
             self._as = as7341.AS7341()
             as_status = self._as.init()
         except:
-            print("WARNING: light sensor connection failed.")
+            logger.warning("Light sensor connection failed.")
             self._as = None
 
         if (self._max is None and self._as is None) or (max_status == False and as_status == False):
@@ -97,7 +99,22 @@ class Module(object):
             self._enabled = False
         else:
             self._enabled = True
-        
+
+        self.remove_closing_line()
+
+    def remove_closing_line(self):
+        ''' Files written before lines were appended end with a closing } line, remove it once '''
+        full_file_path = os.path.join(LIGHT_RAW_PATH, JSON_FILENAME)
+        try:
+            with open(full_file_path, "rb+") as fp:
+                fp.seek(-2, os.SEEK_END)
+                if fp.read(2) == "\n}":
+                    fp.seek(-1, os.SEEK_END)
+                    fp.truncate()
+        except IOError:
+            # file does not exist or is too short
+            pass
+
     def read_voltages(self):
         ''' Read all 8 channels from ADC, convert to mV, perform zero offset and return values in a list '''
         voltages = []
@@ -127,21 +144,21 @@ class Module(object):
         and appends everything to .json file 
         '''
         if not self._enabled:
-            print("WARNING: Skipping light calculator module...")
+            logger.debug("Skipping light calculator module...")
             return
 
         max_raws = []
         ams_raws = []
         try:
             if self._max is None:
-                print("WARNING: Skipping Skye channels calculator...")
+                logger.debug("Skipping Skye channels calculator...")
             else:
                 voltages = self.read_voltages()
                 max_raws = self.calculate_raws(voltages)
                 #print(max_raws)
 
             if self._as is None:
-                print("WARNING: Skipping AMS sensor...")
+                logger.debug("Skipping AMS sensor...")
             else:
                 read0 = self._as.get_data(0)
                 read1 = self._as.get_data(1)
@@ -152,7 +169,7 @@ class Module(object):
 
         except Exception as e:
                 #print("ERROR light_calculator when reading data - {}".format(e))
-                print("ERROR - light_calculator when reading data.")
+                logger.exception("light_calculator when reading data.")
         
         if max_raws or ams_raws:
             try:
@@ -162,7 +179,7 @@ class Module(object):
                 new_data["skye"] = max_raws
 
                 # prepare new dictionary
-                timestr = datetime.datetime.now().strftime("%m%d%Y-%H%M%S")
+                timestr = self._boot.clock.now().strftime("%m%d%Y-%H%M%S")
                 new_dict = {}
                 new_dict[timestr] = new_data
 
@@ -171,44 +188,24 @@ class Module(object):
 
                 # check if json file exists and is not empty
                 full_file_path = os.path.join(LIGHT_RAW_PATH, JSON_FILENAME)
-                if os.path.isfile(full_file_path) and os.path.getsize(full_file_path):
-                    # read only last two lines of the file
-                    with open(full_file_path, "r+") as fp:
-                        # move pointer to end of the file
-                        fp.seek(0, os.SEEK_END)
-                        pos = fp.tell() - 1
-
-                        # read back until new line char is found
-                        while pos > 0 and fp.read(1) != "\n":
-                            pos -= 1
-                            fp.seek(pos, os.SEEK_SET)
-                        
-                        # read one char after new line
-                        last_char = fp.read(1) 
-                        if pos > 0 and last_char == '}':
-                            # if } char is found, delete this line
-                            fp.seek(pos, os.SEEK_SET)
-                            fp.truncate()
-                        else:
-                            # if not, write new line char
-                            fp.seek(0, os.SEEK_END)
-                            #fp.write("\n")
-                        
-                        # write new data in new line and add } in another new line
-                        fp.write("\n" + str_dict[1:-1] + ",\n}")
-                else:
-                    # create new file and add new data
-                    with open(full_file_path, "w") as fp:
-                        fp.write("{\n" + str_dict[1:-1] + ",\n}")
-
-                print("Light calculator: done")
+                if not self._boot.storage.request_write(CATEGORY_LIGHT, len(str_dict)):
+                    logger.warning("Light calculator: no storage space, new data not saved.")
+                    return
+                # append new data in a new line, new file starts with {
+                new_line = str_dict[1:-1] + ",\n"
+                if not (os.path.isfile(full_file_path) and os.path.getsize(full_file_path)):
+                    new_line = "{\n" + new_line
+                files.append(__name__, full_file_path, new_line)
+                self._boot.storage.add(CATEGORY_LIGHT, full_file_path)
+
+                logger.debug("Light calculator: done")
 
             except Exception as e:
                 #print("ERROR light_calculator when processing data - {}".format(e))
-                print("ERROR - light_calculator when processing.")
+                logger.exception("light_calculator when processing.")
             
         else:
-            print("Light calculator: no new data is available...")
+            logger.debug("Light calculator: no new data is available...")
 
     def shutdown(self, modules):
         ''' Shutdown the module'''
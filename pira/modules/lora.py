@@ -10,6 +10,9 @@ import RPi.GPIO as gpio
 from ..hardware import devices, lora
 from ..const import MEASUREMENT_DEVICE_VOLTAGE, MEASUREMENT_DEVICE_TEMPERATURE
 from ..messages import create_measurements_message
+from ..logger import get_logger
+
+logger = get_logger(__name__)
 
 # Persistent state.
 STATE_FRAME_COUNTER = 'lora.frame_counter'
@@ -25,7 +28,7 @@ class Module(object):
     def __init__(self, boot):
         self._boot = boot
         self._lora = None
-        self._last_update = datetime.datetime.now()
+        self._last_update = self._boot.clock.now()
         self._frame_counter = boot.state[STATE_FRAME_COUNTER] or 1
 
         # Parse configuration.
@@ -53,7 +56,7 @@ class Module(object):
 
         try:
             #first reset
-            print("LoRa hardware reset.")
+            logger.debug("LoRa hardware reset.")
             gpio.setup(devices.GPIO_LORA_RESET_PIN, gpio.OUT, initial=gpio.HIGH)
             time.sleep(0.01)
             gpio.write(devices.GPIO_LORA_RESET_PIN, gpio.LOW)
@@ -83,12 +86,12 @@ class Module(object):
 
         except AssertionError:
             self._lora = None
-            print("WARNING: LoRa is not correctly initialized, skipping.")
+            logger.warning("LoRa is not correctly initialized, skipping.")
             return False
 
     def process(self, modules):
         if not self._enabled:
-            print("WARNING: LoRa is not correctly configured, skipping.")
+            logger.warning("LoRa is not correctly configured, skipping.")
             return
 
         #Initialize lora modue if needed
@@ -111,10 +114,10 @@ class Module(object):
 
         message = create_measurements_message(self._boot, self._last_update, measurements)
         if not message:
-            print("WARNING: LoRa message empty, not transmitting.")
+            logger.info("LoRa message empty, not transmitting.")
             return
 
-        print("Transmitting message ({} bytes) via LoRa...".format(len(message)))
+        logger.info("Transmitting message ({} bytes) via LoRa...", len(message))
 
         payload = lora.LoRaWANPayload(self._nws_key, self._apps_key)
         payload.create(
@@ -137,12 +140,12 @@ class Module(object):
 
             time.sleep(0.1)
         else:
-            print("WARNING: Timeout while transmitting LoRa message.")
+            logger.warning("Timeout while transmitting LoRa message.")
 
         self._lora.set_mode(lora.MODE.STDBY)
         self._lora.clear_irq_flags(TxDone=1)
 
-        self._last_update = datetime.datetime.now()
+        self._last_update = self._boot.clock.now()
         self._frame_counter += 1
         self._boot.state[STATE_FRAME_COUNTER] = self._frame_counter % 2**16
 
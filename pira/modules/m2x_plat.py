@@ -15,19 +15,30 @@ from __future__ import print_function
 import os
 import time
 import sys
-import json
-import datetime
 import pickle
 
 from m2x.client import M2XClient
 
+from ..logger import get_logger
+from ..const import TOPIC_CAN_SAMPLES
+from .. import files
+
+logger = get_logger(__name__)
+
+# Data that failed to upload, kept for the next attempt.
+FAILED_DATA_FILE = '/data/m2x_upload_failed_data.pkl'
+# Previous location, in the working directory.
+LEGACY_FAILED_DATA_FILE = 'upload_failed_data.txt'
+
 class Module(object):
     def __init__(self, boot):
         self._boot = boot
         self._last_time = 0
         self._enabled = False
-        self._first_run = True
+        self._streams = set()
         self._old_data = []
+        # read CAN samples published by the can module, including ones published before we were loaded
+        self._can_cursor = boot.bus.cursor(TOPIC_CAN_SAMPLES, from_start=True)
 
         # get these values under API Keys
         self.M2X_KEY = os.environ.get('M2X_KEY', "") # get m2x device key
@@ -36,7 +47,7 @@ class Module(object):
 
         # Check if m2x push is correctly configured
         if len(self.M2X_KEY) != 32 or len(self.M2X_DEVICE_ID) != 32:
-            print("M2X integration not configured, skipping")
+            logger.warning("M2X integration not configured, skipping")
             self._enabled = False
             return
 
@@ -46,17 +57,19 @@ class Module(object):
             # create device object
             self._device = self._client.device(self.M2X_DEVICE_ID)
         except:
-            print("M2X connection failed with the following error:")
-            print(str(self._client.last_response.raw))
+            logger.error("M2X connection failed with the following error: {}", self._client.last_response.raw)
             self._enabled = False
             return
 
         # try to load old data from disk
-        try:
-            with open("upload_failed_data.txt", "rb") as fp:
-                self._old_data = pickle.load(fp)
-        except:
-            self._old_data = []
+        self._old_data = []
+        for path in (FAILED_DATA_FILE, LEGACY_FAILED_DATA_FILE):
+            try:
+                with open(path, "rb") as fp:
+                    self._old_data = pickle.load(fp)
+                break
+            except:
+                pass
 
         # DEBUG
         #print(self._device.data)
@@ -68,7 +81,7 @@ class Module(object):
         """
         Returns the timestamp for the timestamp parameter
         """
-        return datetime.datetime.now()
+        return self._boot.clock.now()
 
     def upload_data(self, value_name, time, value_data):
         """
@@ -95,58 +108,38 @@ class Module(object):
             try:
                 stream = self._device.create_stream(stream_name)
             except:
-                print("Creating stream " + str(stream_name) + " failed.")
+                logger.error("Creating stream {} failed.", stream_name)
                 return
-        self._first_run = False
+            self._streams.add(stream_name)
 
-    def process_json(self, can_data):
+    def process_samples(self, samples):
         """
-        Process json and prepare data for upload to m2x
+        Upload CAN samples (series name is device_sensor_variable) to m2x
         """
-        for i in can_data:  # device
-            for j in can_data[i]:   # sensor
-                for k in can_data[i][j]:    # variable
-                    value_name = str(i) + "_" + str(j) + "_" + str(k)
-                    print("Value name: "+  str(value_name))
-                    for l in can_data[i][j][k]:
-                        data = can_data[i][j][k][l]['data']
-                        time = can_data[i][j][k][l]['time']
-                        #print("Data: " + str(data) + " Time: " + str(time))
-                        formated_time = datetime.datetime.strptime(time, "%Y-%m-%d %H:%M:%S.%f")
-                        self.upload_data(value_name, formated_time, data)
+        for sample in samples:
+            self.upload_data(sample.series, sample.timestamp, sample.value)
 
 
     def process(self, modules):
         """ Main process, uploading data """
         if not self._enabled:
-            print("WARNING: Skipping M2X module...")
+            logger.debug("Skipping M2X module...")
             return
-        print("M2X Process | Inited: {}".format(self._enabled))
-
-        if not self._first_run:
-            # read data from can module and push it to m2x server
-            if 'pira.modules.can' in modules:
-                print("Reading new data from can module...")
-                json_data = modules['pira.modules.can'].return_json_data()
-                can_data = json.loads(json_data)
-                self.process_json(can_data)
-
-        # if first run, read can module and generate needed streams
-        if self._first_run and 'pira.modules.can' in modules:
-            stream_list = []
-            json_data = modules['pira.modules.can'].return_json_data()
-            can_data = json.loads(json_data)
-            for i in can_data:  # device
-                for j in can_data[i]:   # sensor
-                    for k in can_data[i][j]:    # variable
-                        value_name = str(i) + "_" + str(j) + "_" + str(k)
-                        stream_list.append(value_name)
-            self.generate_streams(stream_list)
-            self.process_json(can_data)
+        logger.debug("M2X Process | Inited: {}", self._enabled)
+
+        # read new data from can module and push it to m2x server
+        if 'pira.modules.can' in modules:
+            logger.debug("Reading new data from can module...")
+            samples = self._can_cursor.samples()
+            # generate streams that do not exist yet
+            new_streams = set(sample.series for sample in samples) - self._streams
+            if new_streams:
+                self.generate_streams(sorted(new_streams))
+            self.process_samples(samples)
 
         # check if we have old data to upload
         if self._old_data:
-            print("Uploading old data...")
+            logger.info("Uploading old data...")
             old_data_size = len(self._old_data)
             for i in range(old_data_size-1, -1, -1):
                 cur_el = self._old_data[i]
@@ -155,12 +148,16 @@ class Module(object):
 
         # if there is still some old data, display a message to user and save it to disk
         if self._old_data:
-            print("Some data has failed to upload...")
-            with open("upload_failed_data.txt", "wb") as fp:
-                pickle.dump(self._old_data, fp)
+            logger.warning("Some data has failed to upload...")
+            files.replace(__name__, FAILED_DATA_FILE, pickle.dumps(self._old_data))
         else:
+            # everything is uploaded, old data must not be uploaded again after restart
+            for path in (FAILED_DATA_FILE, LEGACY_FAILED_DATA_FILE):
+                if os.path.exists(path):
+                    os.remove(path)
+
             # self-disable upon successful completion if so defined
-            if os.environ.get('M2X_RUN', 'cont')=='once':
+            if self._boot.config.m2x_run == 'once':
                 self._enabled = False
 
 
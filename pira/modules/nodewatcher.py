@@ -10,14 +10,18 @@ import os
 import requests
 import yaml
 
-from ..const import MEASUREMENT_DEVICE_VOLTAGE, MEASUREMENT_DEVICE_TEMPERATURE
+from ..const import MEASUREMENT_DEVICE_VOLTAGE, MEASUREMENT_DEVICE_TEMPERATURE, METRIC_UPLOADED_BYTES
 from ..messages import create_measurements_message
 from ..hardware import bq2429x
+from ..logger import get_logger
+
+logger = get_logger(__name__)
 
 
 class Module(object):
     def __init__(self, boot):
         self._boot = boot
+        self._uploaded_bytes = boot.metrics.counter(METRIC_UPLOADED_BYTES, 'Number of bytes uploaded.')
 
     def process(self, modules):
 
@@ -27,13 +31,13 @@ class Module(object):
                 'device_temperature': {
                     'name': 'Temperature',
                     'unit': 'C',
-                    'value': str(self._boot.get_temperature),
+                    'value': str(self._boot.get_temperature()),
                     'group': 'temperature'
                 },
                 'device_voltage': {
                     'name': 'Voltage',
                     'unit': 'V',
-                    'value': str(self._boot.sensor_mcp.get_voltage()),
+                    'value': str(self._boot.get_voltage()),
                     'group': 'voltage'
                 }
             }
@@ -54,7 +58,7 @@ class Module(object):
 
         # Check if nodewatcher push is correctly configured
         if uuid is None or host is None or key is None:
-            print("Nodewatcher push not configured")
+            logger.warning("Nodewatcher push not configured")
             return
 
         nodewatcher_uri = 'http://{host}/push/http/{uuid}'.format(
@@ -73,10 +77,11 @@ class Module(object):
                     'X-Nodewatcher-Signature': signature,
                 }
             )
-            print("Nodewatcher data pushed successfully")
+            self._uploaded_bytes.inc(len(body), module=__name__)
+            logger.debug("Nodewatcher data pushed successfully")
             #print("Nodewatcher data pushed successfully: {} {} {}".format(nodewatcher_uri,body,signature))
         except:
-            print("WARNING: Nodewatcher data push failed")
+            logger.warning("Nodewatcher data push failed")
 
     def shutdown(self, modules):
-        print("Shutting down nodewatcher module.")
+        logger.info("Shutting down nodewatcher module.")
@@ -1,8 +1,11 @@
 from __future__ import print_function
 from ..messages import MeasurementConfig
 from ..hardware import devices, plantower
+from ..logger import get_logger
 import os
 
+logger = get_logger(__name__)
+
 # Log events.
 LOG_PLANTOWER_PM1 = 'plantower.pm1'
 LOG_PLANTOWER_PM25 = 'plantower.pm25'
@@ -18,16 +21,17 @@ class Module(object):
 
     def __init__(self, boot):
         self._boot = boot
-        self._driver = plantower.PLANTOWER(devices.PLANTOWER_UART)
+        self._driver = plantower.PLANTOWER(devices.PLANTOWER_UART, clock=boot.clock)
+        for key in (LOG_PLANTOWER_PM1, LOG_PLANTOWER_PM25, LOG_PLANTOWER_PM10):
+            boot.log.set_deadband(key)
 
     def process(self, modules):
         """Measure air."""
         pm1, pm25, pm10 = self._driver.read(float(os.environ.get('PLANTOWER_CYCLE_DURATION', '10')))
         if pm1 is None:
-            print("ERROR: Plantower device not connected.")
+            logger.error("Plantower device not connected.")
             return
-        print("Air quality:")
-        print("PM1:", pm1, "ug/m^3  PM2.5:", pm25, "ug/m^3  PM10:", pm10, "ug/m^3")
+        logger.debug("Air quality (ug/m^3)", pm1=pm1, pm25=pm25, pm10=pm10)
 
         # Record measurement in log.
         self._boot.log.insert(LOG_PLANTOWER_PM1, int(pm1))
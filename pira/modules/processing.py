@@ -26,6 +26,12 @@ from datetime import datetime
 from datetime import timedelta
 
 import light_calculator
+from ..logger import get_logger
+from ..storage import CATEGORY_CALCULATED, CATEGORY_RAW
+from .. import files
+from .. import rawdata
+
+logger = get_logger(__name__)
 
 # sync folder path on device
 sync_folder_path = "/data/"
@@ -37,13 +43,16 @@ CSV_DATA_STORAGE_PATH = '/data/calculated'
 # timestamp format - how header looks like
 timestamp_text_format = 'Timestamp (mmddyyyy-hhmm)'
 
+# azure_sync downloads config.json during its initialization
+INIT_DEPENDS = ('pira.modules.azure_sync',)
+
 class Module(object):
     def __init__(self, boot):
         """ Inits the module"""
         self._boot = boot
 
         # Read environs
-        filename = os.environ.get('PROCESS_CSV_FILENAME', 'processed')
+        self._filename = os.environ.get('PROCESS_CSV_FILENAME', 'processed')
         self._gdd_sensor = os.environ.get('PROCESS_GDD_SENSOR_NAME', 'Temperature middle 1 (F)')
         base_temp = os.environ.get('PROCESS_GDD_BASE_TEMP', 50)
         try:
@@ -57,33 +66,43 @@ class Module(object):
         except OSError:
             pass
 
-        # read config file
-        config_full_path = sync_folder_path + "config.json"
-        if not os.path.isfile(config_full_path):
-            print("WARNING processing: config.json file not found in data directory! Exiting...")
-            self._enabled = False
-            return
+        # prepare dictionaries of raw and calculated data
+        self._raw_data = {}
+        self._calculated_data = {}
 
-        # check if config file is empty -> delete it, Azure module will download it in next iteration
-        if os.path.getsize(config_full_path) > 0:
-            with open(config_full_path, "rb") as fp:
-                self._config_file = json.load(fp)
-        else:
-            print("WARNING processing: config.json file is empty, deleting it and exiting...")
-            os.remove(config_full_path)
+        # prepare temp lists, dicts and vars for combined calculations
+        self._temp_lux = {}
+        #self._header_row = []  # not needed
+        self._file_timestamps = {}
+        self._gdd_dict = {}
+        self._old_gdd = 0
+        self._file_gdd = 0
+        self._data_ready = False
+        self._write_header = False
+
+        # calculate max value for lux - when sensor is saturated
+        self.max_lux = 0
+        self.max_lux = self.calculate_lux(-1.0, 0.0)
+
+        # lookup table is read from config.json, reloaded whenever the file changes
+        self._enabled = False
+        self.apply_config(boot.config, ['sensors'])
+        boot.config.subscribe(self.apply_config, 'sensors')
+
+    def apply_config(self, config, changed):
+        """ Applies lookup table from config.json, module is enabled only when it is available """
+        self._config_file = config.sensors
+        if self._config_file is None:
+            logger.warning("processing: config.json file not found in data directory! Exiting...")
             self._enabled = False
             return
-        
+
         #print(self._config_file)
         try:
             config_file_version = str(self._config_file['version'])
         except:
             config_file_version = "1"
-        self._csv_filename = CSV_DATA_STORAGE_PATH  + '/' + filename + "-v" + config_file_version + ".csv"
-
-        # prepare dictionaries of raw and calculated data
-        self._raw_data = {}
-        self._calculated_data = {}
+        self._csv_filename = CSV_DATA_STORAGE_PATH  + '/' + self._filename + "-v" + config_file_version + ".csv"
 
         # prepare list of all csv columns (all possible sensors)
         self._csv_columns = []
@@ -102,20 +121,6 @@ class Module(object):
         self._csv_columns.append('Total accumulation (GDD)')
         #print(self._csv_columns)
 
-        # prepare temp lists, dicts and vars for combined calculations
-        self._temp_lux = {}
-        #self._header_row = []  # not needed
-        self._file_timestamps = {}
-        self._gdd_dict = {}
-        self._old_gdd = 0
-        self._file_gdd = 0
-        self._data_ready = False
-        self._write_header = False
-
-        # calculate max value for lux - when sensor is saturated
-        self.max_lux = 0
-        self.max_lux = self.calculate_lux(-1.0, 0.0)
-
         # everything is ok, enable this module
         self._enabled = True
 
@@ -162,7 +167,7 @@ class Module(object):
                 
         except Exception as e:
             #print("ERROR processing: all new data - {}".format(e))
-            print("ERROR processing: all new data")
+            logger.exception("processing: all new data")
 
 
     def process_hourly_data(self, value_name, data, timestamp):
@@ -792,7 +797,7 @@ class Module(object):
         
         except Exception as e:
             #print("ERROR processing - hourly new data - {}".format(e))
-            print("ERROR processing - hourly new data")
+            logger.exception("processing - hourly new data")
 
     def read_csv_file(self):
         """
@@ -848,7 +853,7 @@ class Module(object):
                         self._file_timestamps[str_tstamp] = 9000
 
             # check if data in file is from different year than now -> reset total gdd
-            if old_timestamp.year != datetime.now().year:
+            if old_timestamp.year != self._boot.clock.now().year:
                 self._old_gdd = 0
             else:
                 self._old_gdd = self._file_gdd
@@ -860,7 +865,7 @@ class Module(object):
         
         except Exception as e:
             #print("ERROR processing - read csv file - {}".format(e))
-            print("ERROR processing - read csv file failed")
+            logger.exception("processing - read csv file failed")
             return -3
         
     def get_all_gdd(self):
@@ -877,7 +882,7 @@ class Module(object):
                     timestamp = datetime.strptime(tstamp, "%m%d%Y-%H%M")
                     timestamps.append(timestamp)
             if not timestamps:
-                print("WARNING processing GDD: No data found in timestamps")
+                logger.debug("processing GDD: No data found in timestamps")
                 return
             
             #print("All timestamps:")
@@ -916,7 +921,7 @@ class Module(object):
         
         except Exception as e:
             #print("ERROR processing - function get_all_gdd - {}".format(e))
-            print("ERROR processing - calculating file GDD")
+            logger.exception("processing - calculating file GDD")
 
     def get_new_gdd(self):
         """
@@ -933,7 +938,7 @@ class Module(object):
                     #if timestamp.replace(hour=0, minute=0, second=0, microsecond=0) != datetime.now().replace(hour=0, minute=0, second=0, microsecond=0):
                     timestamps.append(timestamp)
             if not timestamps:
-                print("WARNING processing GDD: No data found in new timestamps")
+                logger.debug("processing GDD: No data found in new timestamps")
                 return
             
             #print("New timestamps:")
@@ -979,7 +984,7 @@ class Module(object):
         
         except Exception as e:
             #print("ERROR processing - calculating new GDD - {}".format(e))
-            print("ERROR processing - calculating new GDD")
+            logger.exception("processing - calculating new GDD")
         
     def calculate_gdd(self, day_list, day_timestamp):
         """
@@ -1010,7 +1015,7 @@ class Module(object):
         
         except Exception as e:
             #print("ERROR processing - calculating GDD - {}".format(e))
-            print("ERROR processing - calculating GDD")
+            logger.exception("processing - calculating GDD")
 
     def calculate_lux(self, ch0, ch1):
         """
@@ -1046,7 +1051,7 @@ class Module(object):
         Calculates NDVI and PIR
         Output: appends raw and calculated values to dict self._calculated_data - key: value_name, value: dict (hour_timestamp, value)
         '''
-        print("Processing: reading file: {}".format(light_calculator.JSON_FILENAME))
+        logger.debug("Processing: reading file: {}", light_calculator.JSON_FILENAME)
         raw_light_dict = {}
         #print(newest_csv_timestamp)
 
@@ -1056,13 +1061,14 @@ class Module(object):
                 # move pointer to end of the file
                 fp.seek(0, os.SEEK_END)
                 pos = fp.tell() - 1
+                fp.seek(pos, os.SEEK_SET)
 
-                # read back one line
+                # read back one line, if the file ends with a closing } line
                 while pos > 0 and fp.read(1) != "\n":
                     pos -= 1
                     fp.seek(pos, os.SEEK_SET)
 
-                cur_timestamp = datetime.now()
+                cur_timestamp = self._boot.clock.now()
                 # read lines until line current timestamp is older than csv timestamp
                 while cur_timestamp > newest_csv_timestamp:
                     # read back until new line char is found
@@ -1121,95 +1127,122 @@ class Module(object):
 
         except Exception as e:
             #print("ERROR processing - process_light - {}".format(e))
-            print("ERROR processing - process_light has failed")
+            logger.exception("processing - process_light has failed")
                      
     def append_to_csv_file(self, newest_csv_timestamp):
         """
         Function to add new row(s) to .csv file
         First row in day has GDD added (for this day)
         """
+        if not self._boot.storage.request_write(CATEGORY_CALCULATED):
+            logger.warning("processing - no storage space, not appending to csv")
+            return
+
         try:
-            with open(self._csv_filename, 'a') as fp:
-                if not self._data_ready:
-                    # if we don't have new data -> exit without editing csv
-                    return
-                
-                writer = csv.DictWriter(fp, fieldnames=self._csv_columns)
-                # write header if file is empty
-                if self._write_header:
-                    writer.writeheader()
-                    self._write_header = False
-                #print("calculated data is: {}".format(self._calculated_data))
-                calculated_timestamps = []
-                # we sort new calculated data from oldest to newest timestamp
-                for tstamp in self._calculated_data:
-                    # we check if timestamp is older than current hour (since current hour isn't over yet)
-                    if datetime.strptime(tstamp, "%m%d%Y-%H%M") < datetime.now().replace(minute=0, second=0, microsecond=0):
-                        calculated_timestamps.append(tstamp)
-                calculated_timestamps.sort()
-
-                ''' # DEBUG
-                print("Calculated timestamps:") 
-                print(calculated_timestamps)
-                print("Newest csv timestamp:")
-                print(newest_csv_timestamp)
-                print("GDD dict:")
-                print(self._gdd_dict)
-                print("File gdd: " + str(self._file_gdd))
-                print("Old gdd: " +  str(self._old_gdd))
-                '''
-                # we check first three data timestamps if any is in new day
-                new_day = False
-                first_data = datetime.strptime(calculated_timestamps[0], "%m%d%Y-%H%M")
-                if newest_csv_timestamp.day != first_data.day and first_data > newest_csv_timestamp:
+            if not self._data_ready:
+                # if we don't have new data -> exit without editing csv
+                return
+
+            # rows are collected in memory and appended to the file with a single write
+            fp = io.BytesIO()
+
+            writer = csv.DictWriter(fp, fieldnames=self._csv_columns)
+            # write header if file is empty
+            if self._write_header:
+                writer.writeheader()
+                self._write_header = False
+            #print("calculated data is: {}".format(self._calculated_data))
+            calculated_timestamps = []
+            # we sort new calculated data from oldest to newest timestamp
+            for tstamp in self._calculated_data:
+                # we check if timestamp is older than current hour (since current hour isn't over yet)
+                if datetime.strptime(tstamp, "%m%d%Y-%H%M") < self._boot.clock.now().replace(minute=0, second=0, microsecond=0):
+                    calculated_timestamps.append(tstamp)
+            calculated_timestamps.sort()
+
+            ''' # DEBUG
+            print("Calculated timestamps:") 
+            print(calculated_timestamps)
+            print("Newest csv timestamp:")
+            print(newest_csv_timestamp)
+            print("GDD dict:")
+            print(self._gdd_dict)
+            print("File gdd: " + str(self._file_gdd))
+            print("Old gdd: " +  str(self._old_gdd))
+            '''
+            # we check first three data timestamps if any is in new day
+            new_day = False
+            first_data = datetime.strptime(calculated_timestamps[0], "%m%d%Y-%H%M")
+            if newest_csv_timestamp.day != first_data.day and first_data > newest_csv_timestamp:
+                new_day = True
+            second_data = 0
+            third_data = 0
+            if len(calculated_timestamps) > 1 and not new_day:
+                second_data = datetime.strptime(calculated_timestamps[1], "%m%d%Y-%H%M")
+                if newest_csv_timestamp.day != second_data.day and second_data > newest_csv_timestamp:  # TODO after > change to first_data
                     new_day = True
-                second_data = 0
-                third_data = 0
-                if len(calculated_timestamps) > 1 and not new_day:
-                    second_data = datetime.strptime(calculated_timestamps[1], "%m%d%Y-%H%M")
-                    if newest_csv_timestamp.day != second_data.day and second_data > newest_csv_timestamp:  # TODO after > change to first_data
-                        new_day = True
-                if len(calculated_timestamps) > 2 and not new_day:
-                    third_data = datetime.strptime(calculated_timestamps[2], "%m%d%Y-%H%M")
-                    if newest_csv_timestamp.day != third_data.day and third_data > newest_csv_timestamp:    # TODO after > change to second_data
-                        new_day = True
-                # if new day is confirmed and read part of csv doesn't have gdd or has lower gdd-> write line with only timestamp and gdd
-                if new_day and newest_csv_timestamp.replace(hour=0) in self._gdd_dict and (self._file_gdd == 0 or self._file_gdd < self._gdd_dict[newest_csv_timestamp.replace(hour=0)]):
-                    dict_to_write = {}
-                    dict_to_write['Timestamp (mmddyyyy-hhmm)'] = datetime.strftime(newest_csv_timestamp + timedelta(minutes=1), "%m%d%Y-%H%M")
-                    dict_to_write['Total accumulation (GDD)'] = self._gdd_dict[newest_csv_timestamp.replace(hour=0)]
+            if len(calculated_timestamps) > 2 and not new_day:
+                third_data = datetime.strptime(calculated_timestamps[2], "%m%d%Y-%H%M")
+                if newest_csv_timestamp.day != third_data.day and third_data > newest_csv_timestamp:    # TODO after > change to second_data
+                    new_day = True
+            # if new day is confirmed and read part of csv doesn't have gdd or has lower gdd-> write line with only timestamp and gdd
+            if new_day and newest_csv_timestamp.replace(hour=0) in self._gdd_dict and (self._file_gdd == 0 or self._file_gdd < self._gdd_dict[newest_csv_timestamp.replace(hour=0)]):
+                dict_to_write = {}
+                dict_to_write['Timestamp (mmddyyyy-hhmm)'] = datetime.strftime(newest_csv_timestamp + timedelta(minutes=1), "%m%d%Y-%H%M")
+                dict_to_write['Total accumulation (GDD)'] = self._gdd_dict[newest_csv_timestamp.replace(hour=0)]
+                writer.writerow(dict_to_write)
+            for tstamp in calculated_timestamps:
+                dict_to_write = self._calculated_data[tstamp]
+                #print ("dict_to_write: {}".format(dict_to_write))
+                dict_to_write['Timestamp (mmddyyyy-hhmm)'] = tstamp
+                cur_timestamp = datetime.strptime(tstamp, "%m%d%Y-%H%M")
+                # remove time from timestamp
+                cur_day_timestamp = cur_timestamp.replace(hour=0, minute=0)
+                # check if next tstamp is in next day then add GDD
+                next_tstamp_index = calculated_timestamps.index(tstamp) + 1
+                if next_tstamp_index < len(calculated_timestamps):
+                    next_tstamp = datetime.strptime(calculated_timestamps[next_tstamp_index], "%m%d%Y-%H%M")
+                    if cur_day_timestamp.day != next_tstamp.day:
+                        # check if gdd data exists for current day and add it to dict_to_write
+                        if cur_day_timestamp in self._gdd_dict:
+                            dict_to_write['Total accumulation (GDD)'] = self._gdd_dict[cur_day_timestamp]
+                #print("self._file_timestamps: {}".format(self._file_timestamps))
+                #print("dict_to_write: {}".format(dict_to_write))
+                # check if data timestamp is in the file
+                if self._file_timestamps and tstamp in self._file_timestamps.keys():
+                    #print("data timestamp is in the file.")
+                    pass
+                else:
                     writer.writerow(dict_to_write)
-                for tstamp in calculated_timestamps:
-                    dict_to_write = self._calculated_data[tstamp]
-                    #print ("dict_to_write: {}".format(dict_to_write))
-                    dict_to_write['Timestamp (mmddyyyy-hhmm)'] = tstamp
-                    cur_timestamp = datetime.strptime(tstamp, "%m%d%Y-%H%M")
-                    # remove time from timestamp
-                    cur_day_timestamp = cur_timestamp.replace(hour=0, minute=0)
-                    # check if next tstamp is in next day then add GDD
-                    next_tstamp_index = calculated_timestamps.index(tstamp) + 1
-                    if next_tstamp_index < len(calculated_timestamps):
-                        next_tstamp = datetime.strptime(calculated_timestamps[next_tstamp_index], "%m%d%Y-%H%M")
-                        if cur_day_timestamp.day != next_tstamp.day:
-                            # check if gdd data exists for current day and add it to dict_to_write
-                            if cur_day_timestamp in self._gdd_dict:
-                                dict_to_write['Total accumulation (GDD)'] = self._gdd_dict[cur_day_timestamp]
-                    #print("self._file_timestamps: {}".format(self._file_timestamps))
-                    #print("dict_to_write: {}".format(dict_to_write))
-                    # check if data timestamp is in the file
-                    if self._file_timestamps and tstamp in self._file_timestamps.keys():
-                        #print("data timestamp is in the file.")
-                        pass
-                    else:
-                        writer.writerow(dict_to_write)
+            if fp.tell():
+                files.append(__name__, self._csv_filename, fp.getvalue())
+            self._boot.storage.add(CATEGORY_CALCULATED, self._csv_filename)
         except Exception as e:
             #print("ERROR processing - append to csv - {}".format(e))
-            print("ERROR processing - append data to csv failed")
+            logger.exception("processing - append data to csv failed")
+
+    def retain_unprocessed(self, newest_csv_timestamp):
+        """ Raw files of hours after the newest processed one are not read yet, storage must not evict them """
+        first_unprocessed = newest_csv_timestamp.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        self._boot.storage.retain_after(CATEGORY_RAW, time.mktime(first_unprocessed.timetuple()))
+
+    def read_raw_file(self, path):
+        """ Reads binary raw file into self._raw_data, columns are mapped from the file """
+        current_hour = self._boot.clock.now().replace(minute=0, second=0, microsecond=0)
+        with rawdata.RawFile(path) as raw_file:
+            for value_name in raw_file.series():
+                value_name = str(value_name)
+                if value_name not in self._raw_data:
+                    self._raw_data[value_name] = {}
+                for formated_time, data in raw_file.samples(value_name):
+                    # we only process data older than current hour
+                    if formated_time < current_hour:
+                        self._raw_data[value_name][formated_time] = data
 
     def process(self, modules):
-        """ Function to process raw data file (.json) on device with config.json file to .csv file"""
+        """ Function to process raw data file (.bin or .json) on device with config.json file to .csv file"""
         if not self._enabled:
-            print("WARNING: Skipping processing module...")
+            logger.debug("Skipping processing module...")
             return
 
         if 'pira.modules.can' in modules:
@@ -1220,37 +1253,46 @@ class Module(object):
                 newest_csv_timestamp = datetime.strptime("01012019-0100", "%m%d%Y-%H%M")
             elif newest_csv_timestamp == -2:
                 # csv file is empty, but previous versions exist - process raw files for current day
-                print("csv file is empty, but previous versions exist")
-                newest_csv_timestamp = datetime.now().replace(hour=0, second=0, microsecond=0)
+                logger.info("csv file is empty, but previous versions exist")
+                newest_csv_timestamp = self._boot.clock.now().replace(hour=0, second=0, microsecond=0)
             elif newest_csv_timestamp == -3:
                 # csv file was not read due to some error
-                print("csv file read error, renaming it and generating new one...")
+                logger.warning("csv file read error, renaming it and generating new one...")
                 # rename current file, new one with the same name will be generated
                 new_filename = self._csv_filename.replace('.csv', '') + "-old.csv"
                 os.rename(self._csv_filename, new_filename)
                 # process raw files for current day
-                newest_csv_timestamp = datetime.now().replace(hour=0, second=0, microsecond=0)
+                newest_csv_timestamp = self._boot.clock.now().replace(hour=0, second=0, microsecond=0)
+
+            self.retain_unprocessed(newest_csv_timestamp)
 
-            # get all raw filenames
-            self._local_files = [f for f in listdir(RAW_DATA_STORAGE_PATH) if isfile(join(RAW_DATA_STORAGE_PATH, f))]
+            # get all raw filenames (binary or older json), skipping temporary files of raw files being written
+            self._local_files = [
+                f for f in listdir(RAW_DATA_STORAGE_PATH)
+                if isfile(join(RAW_DATA_STORAGE_PATH, f)) and f.endswith((rawdata.RAW_EXTENSION, rawdata.JSON_EXTENSION))
+            ]
             # find the newest - local files names are made like this: "raw_values-" + dt.strftime("%m%d%Y-%H%M%S")
             timestamps = []
             for file_name in self._local_files:
-                s_timestamp = file_name.replace("raw_values-", "")
-                this_timestamp = datetime.strptime(s_timestamp.replace(".json", ""), "%m%d%Y-%H%M%S")
+                s_timestamp, extension = os.path.splitext(file_name.replace(rawdata.RAW_PREFIX, ""))
+                this_timestamp = datetime.strptime(s_timestamp, "%m%d%Y-%H%M%S")
                 # save timestamps that are newer than last entry in the file
                 if this_timestamp.replace(minute=0, second=0, microsecond=0) > newest_csv_timestamp:
-                    timestamps.append(this_timestamp)
+                    timestamps.append((this_timestamp, extension))
 
             # new raw files have been found
             if timestamps:
                 timestamps.sort()
-                for timestamp in timestamps:
-                    new_file_name = "raw_values-" + timestamp.strftime("%m%d%Y-%H%M%S") + ".json"
-                    print("Processing: reading file: {}".format(new_file_name))
+                for timestamp, extension in timestamps:
+                    new_file_name = rawdata.RAW_PREFIX + timestamp.strftime("%m%d%Y-%H%M%S") + extension
+                    logger.debug("Processing: reading file: {}", new_file_name)
 
                     # read raw data file
                     try:
+                        if extension == rawdata.RAW_EXTENSION:
+                            self.read_raw_file(RAW_DATA_STORAGE_PATH + '/' + new_file_name)
+                            continue
+
                         with open(RAW_DATA_STORAGE_PATH + '/' + new_file_name, "r") as fp:
                             new_file = json.load(fp)
 
@@ -1266,15 +1308,15 @@ class Module(object):
                                         time = new_file[i][j][k][l]['time']
                                         formated_time = datetime.strptime(time, "%Y-%m-%d %H:%M:%S.%f")
                                         # we only process data older than current hour
-                                        if formated_time < datetime.now().replace(minute=0, second=0, microsecond=0):
+                                        if formated_time < self._boot.clock.now().replace(minute=0, second=0, microsecond=0):
                                             self._raw_data[value_name][formated_time] = data
 
                     except Exception as e:
                         #print("ERROR processing - new raw file - {}".format(e))
-                        print("ERROR processing - raw file failed")
+                        logger.exception("processing - raw file failed")
 
             else:
-                print("No new raw files found...")
+                logger.debug("No new raw files found...")
 
             if self._raw_data:
                 # calculate new data from raw
@@ -1293,14 +1335,14 @@ class Module(object):
             # save to csv file if some new data is available
             if self._calculated_data:
                 self.append_to_csv_file(newest_csv_timestamp)
-                print("Processing module: done")
+                logger.debug("Processing module: done")
 
             # self-disable upon successful completion if so defined
-            if os.environ.get('PROCESSING_RUN', 'cont')=='once':
+            if self._boot.config.processing_run == 'once':
                 self._enabled = False
 
         else:
-            print ("ERROR processing - can module is not enabled.")
+            logger.warning("processing - can module is not enabled.")
 
     def shutdown(self, modules):
         """ Shutdown """
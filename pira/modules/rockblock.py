@@ -13,6 +13,9 @@ import RPi.GPIO as gpio
 from ..hardware import devices, rockblock
 from ..const import MEASUREMENT_DEVICE_VOLTAGE, MEASUREMENT_DEVICE_TEMPERATURE
 from ..messages import create_measurements_message
+from ..logger import get_logger
+
+logger = get_logger(__name__)
 
 # Persistent state.
 STATE_POWERED_ON_TIME = 'rockblock.powered_on_time'
@@ -27,7 +30,7 @@ class Module(object):
         try:
             self._interval = int(os.environ.get('ROCKBLOCK_REPORT_INTERVAL', '24'))
         except ValueError:
-            print("ERROR: Malformed Rockblock reporting interval.")
+            logger.error("Malformed Rockblock reporting interval.")
             self._interval = 24
 
         # Maximum number of retries.
@@ -40,10 +43,10 @@ class Module(object):
 
     def process(self, modules):
         # Check if we have powered on the modem today.
-        current_time = datetime.datetime.now()
+        current_time = self._boot.clock.now()
         powered_on_time = self._boot.state[STATE_POWERED_ON_TIME]
         if powered_on_time is not None and current_time - powered_on_time < datetime.timedelta(hours=self._interval):
-            print("Already transmitted measurements today, not powering up Rockblock.")
+            logger.debug("Already transmitted measurements today, not powering up Rockblock.")
             return
 
         # Power up modem. We leave it powered on until a message is successfully delivered or
@@ -55,15 +58,13 @@ class Module(object):
         try:
             modem = rockblock.rockBlock(devices.ROCKBLOCK_UART, rockblock.rockBlockProtocol())
         except rockblock.rockBlockException:
-            print("ERROR: Failed to initialize Rockblock modem.")
+            logger.error("Failed to initialize Rockblock modem.")
             return
 
         serial_id = modem.getSerialIdentifier()
         signal = modem.requestSignalStrength()
         net_time = modem.networkTime()
-        print("Rockblock serial id:", serial_id)
-        print("Rockblock signal strength:", signal)
-        print("Rockblock network time:", net_time)
+        logger.info("Rockblock modem ready.", serial_id=serial_id, signal=signal, network_time=net_time)
 
         # Transmit message.
         measurements = [
@@ -79,10 +80,10 @@ class Module(object):
         if not message:
             return
 
-        print("Transmitting message ({} bytes) via Rockblock...".format(len(message)))
+        logger.info("Transmitting message ({} bytes) via Rockblock...", len(message))
 
         if not modem.sendMessage(message):
-            print("ERROR: Failed to send message.")
+            logger.error("Failed to send message.")
             return
 
         # Power off modem and reset interval.
@@ -94,7 +95,7 @@ class Module(object):
         if self._power:
             return
 
-        print("Powering on Rockblock modem.")
+        logger.info("Powering on Rockblock modem.")
 
         gpio.output(devices.GPIO_ROCKBLOCK_POWER_PIN, gpio.HIGH)
         self._power = True
@@ -102,13 +103,13 @@ class Module(object):
 
     def power_off_modem(self):
         """Power off modem."""
-        print("Powering off Rockblock modem.")
+        logger.info("Powering off Rockblock modem.")
         gpio.output(devices.GPIO_ROCKBLOCK_POWER_PIN, gpio.LOW)
         self._power = False
 
     def reset_interval(self):
         """Mark transmission as done in the current interval."""
-        self._boot.state[STATE_POWERED_ON_TIME] = datetime.datetime.now()
+        self._boot.state[STATE_POWERED_ON_TIME] = self._boot.clock.now()
         self._boot.state[STATE_RETRIES] = 0
 
     def shutdown(self, modules):
@@ -121,5 +122,5 @@ class Module(object):
             retries += 1
             self._boot.state[STATE_RETRIES] = retries
             if retries >= self._max_retries:
-                print("Maximum number of Rockblock retries reached.")
+                logger.warning("Maximum number of Rockblock retries reached.")
                 self.reset_interval()
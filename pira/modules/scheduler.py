@@ -23,6 +23,10 @@ from __future__ import print_function
 import datetime
 import os
 
+from ..logger import get_logger
+
+logger = get_logger(__name__)
+
 try:
     import astral
     HAVE_ASTRAL = True
@@ -38,7 +42,7 @@ class Module(object):
         # Initialize schedule.
         if os.environ.get('SCHEDULE_MONTHLY', '0') == '1':
             # Month-dependent schedule.
-            month = datetime.date.today().month
+            month = self._boot.clock.today().month
             schedule_start = self._parse_time(os.environ.get('SCHEDULE_MONTH{}_START'.format(month), '08:00'))
             schedule_end = self._parse_time(os.environ.get('SCHEDULE_MONTH{}_END'.format(month), '18:00'))
             schedule_t_off = self._parse_duration(os.environ.get('SCHEDULE_MONTH{}_T_OFF'.format(month), '35'))
@@ -51,13 +55,13 @@ class Module(object):
             schedule_t_on = self._parse_duration(os.environ.get('SCHEDULE_T_ON', '1'))  # Time in minutes.
 
         if not schedule_start or not schedule_end or schedule_t_off is None or schedule_t_on is None:
-            print("WARNING: Ignoring malformed schedule specification, using safe values.")
+            logger.warning("Ignoring malformed schedule specification, using safe values.")
             schedule_start = self._parse_time('00:01')
             schedule_end = self._parse_time('23:59')
             schedule_t_off = self._parse_duration('59')  # Time in minutes.
             schedule_t_on = self._parse_duration('1')  # Time in minutes.
 
-        self._started = datetime.datetime.now()
+        self._started = self._boot.clock.now()
         self._schedule_start = schedule_start
         self._schedule_end = schedule_end
         self._on_duration = schedule_t_on
@@ -65,11 +69,11 @@ class Module(object):
         self._ready = True
         
         if not self._boot.pira_ok:     # exit module if pira is not connected
-            print("Scheduler: ERROR - Pira is not connected. Exiting...")
+            logger.error("Scheduler: Pira is not connected. Exiting...")
             return
         
         if schedule_t_on.seconds > self._boot.get_pira_on_timer_set():
-            print("WARNING: p (safety on period) will shutdown Pi before scheduler on duration expires.")
+            logger.warning("p (safety on period) will shutdown Pi before scheduler on duration expires.")
 
     def _parse_time(self, time):
         """Parse time string (HH:MM)."""
@@ -85,10 +89,10 @@ class Module(object):
                 ))
 
                 if time == 'sunrise':
-                    print("Sunrise at {}.".format(self._parse_time("sunrise")))
+                    logger.info("Sunrise at {}.", location.sunrise().time())
                     return location.sunrise().time()
                 elif time == 'sunset':
-                    print("Sunset at {}".format(self._parse_time("sunset")))
+                    logger.info("Sunset at {}", location.sunset().time())
                     return location.sunset().time()
             except (KeyError, ValueError):
                 pass
@@ -112,7 +116,7 @@ class Module(object):
             return
 
         if not self._boot.pira_ok:     # exit module if pira is not connected
-            print("Scheduler: ERROR - Pira is not connected. Exiting...")
+            logger.error("Scheduler: Pira is not connected. Exiting...")
             return
 
         """Shutdown is triggered in two ways:
@@ -120,17 +124,17 @@ class Module(object):
         2) Pi completes the operation and goes to sleep
         """
 
-        remaining_time_on = datetime.datetime.now() - self._started
-        print('Scheduler: remaining on time  : {} s'.format(datetime.timedelta.total_seconds(self._on_duration-remaining_time_on)))
+        remaining_time_on = self._boot.clock.now() - self._started
+        logger.debug('Scheduler: remaining on time  : {} s', datetime.timedelta.total_seconds(self._on_duration-remaining_time_on))
 
         # Check if we have been online too long and shutdown.
         if remaining_time_on >= self._on_duration:
-            print("Scheduler: Time to sleep.")
+            logger.info("Scheduler: Time to sleep.")
             self._boot.shutdown = True
 
         # Check pira on timer is about to expire - o variable
         if self._boot.get_pira_on_timer_set() < 30 and not self._boot.get_pira_on_timer_set() == None :
-            print("Scheduler: WARNING - Pira safety on timer about to expire.")
+            logger.warning("Scheduler: Pira safety on timer about to expire.")
             self._boot.shutdown = True
             #here we could reset it as well
 
@@ -140,23 +144,23 @@ class Module(object):
             return
 
         if not self._boot.pira_ok:     # exit module if pira is not connected
-            print("Scheduler: ERROR - Pira is not connected. Exiting...")
+            logger.error("Scheduler: Pira is not connected. Exiting...")
             return
 
         # Checking voltage to configure boot interval
         if self._boot.get_voltage() < float(os.environ.get('POWER_THRESHOLD_QUART', '0')):
             # Lower voltage then quarter threshold, quadrupling the sleep length
             off_duration = self._off_duration * 4
-            print("Low voltage warning, quadrupling sleep duration")
+            logger.warning("Low voltage warning, quadrupling sleep duration")
         elif self._boot.get_voltage() < float(os.environ.get('POWER_THRESHOLD_HALF', '0')):
             # Less voltage then half threshold, doubling the sleep length
             off_duration = self._off_duration * 2
-            print("Low voltage warning, doubling sleep duration")
+            logger.warning("Low voltage warning, doubling sleep duration")
         else:
             # Sufficient power, continue as planned
             off_duration = self._off_duration
 
-        current_time = datetime.datetime.now()
+        current_time = self._boot.clock.now()
         wakeup_time = None
 
         #print("Schedule start {} end {} current {}.".format(self._schedule_start,self._schedule_end,current_time))
@@ -178,8 +182,8 @@ class Module(object):
         display_next_wakeup = wakeup_time + reboot_time
 
         if wakeup_in_seconds > self._boot.get_pira_sleep_timer():
-            print("Warning: Safety off period will expire and wake up Pi before next scheduled wakeup.")
+            logger.warning("Safety off period will expire and wake up Pi before next scheduled wakeup.")
 
         #Displayed value is: wakeup_time + reboot_time
-        print("Scheduling next wakeup at {} / in {} seconds.".format((str(display_next_wakeup)[:-7]), wakeup_in_seconds + self._boot.get_pira_reboot_timer()))
+        logger.info("Scheduling next wakeup at {} / in {} seconds.", str(display_next_wakeup)[:-7], wakeup_in_seconds + self._boot.get_pira_reboot_timer())
         self._boot.pirasmart.set_wakeup_time(wakeup_in_seconds)
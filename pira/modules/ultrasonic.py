@@ -2,6 +2,11 @@ from __future__ import print_function
 
 from ..messages import MeasurementConfig
 from ..hardware import devices, ultrasonic
+from ..logger import get_logger
+from ..bus import Sample
+from ..const import TOPIC_ULTRASONIC_DISTANCE
+
+logger = get_logger(__name__)
 
 # Log events.
 LOG_ULTRASONIC_DISTANCE = 'ultrasonic.distance'
@@ -16,17 +21,21 @@ class Module(object):
 
     def __init__(self, boot):
         self._boot = boot
-        self._driver = ultrasonic.MB7092XL(None, devices.GPIO_ULTRASONIC_RX_PIN)
+        self._driver = ultrasonic.MB7092XL(None, devices.GPIO_ULTRASONIC_RX_PIN, clock=boot.clock)
+        boot.bus.declare(TOPIC_ULTRASONIC_DISTANCE, Sample)
+        boot.log.set_deadband(LOG_ULTRASONIC_DISTANCE)
 
     def process(self, modules):
         """Measure distance."""
         self.distance = self._driver.read()
         if self.distance is None:
-            print("ERROR: Ultrasonic device not connected.")
+            logger.error("Ultrasonic device not connected.")
             return
 
         # Record measurement in log.
-        self._boot.log.insert(LOG_ULTRASONIC_DISTANCE, self.distance)
+        now = self._boot.clock.now()
+        self._boot.log.insert(LOG_ULTRASONIC_DISTANCE, self.distance, timestamp=now)
+        self._boot.bus.publish(TOPIC_ULTRASONIC_DISTANCE, [Sample('distance', now, self.distance)], timestamp=now)
 
     def shutdown(self, modules):
         """Shutdown module."""
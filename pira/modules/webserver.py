@@ -3,6 +3,9 @@ webserver.py
 
 It is a module that enables python's minimalist webserver to serve files stored in /data directory on port 80.
 To use it on Balena.io, turn on public url and click on the link besides the button.
+
+Metrics collected by all modules are served in Prometheus text format on /metrics and
+recent log records kept in memory are served on /log.
 """
 from __future__ import print_function
 
@@ -11,8 +14,40 @@ import SimpleHTTPServer
 import SocketServer
 import threading
 
+from ..logger import get_logger, manager as log_manager, format_record
+
+logger = get_logger(__name__)
+
 WEBSERVER_PORT = 80
 WEBSERVER_DIRECTORY = '/data'
+METRICS_PATH = '/metrics'
+LOG_PATH = '/log'
+
+
+class RequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """Request handler serving files and in-memory metrics."""
+
+    # Metrics registry, set by the module before the server is started.
+    metrics = None
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == METRICS_PATH:
+            self._send_text(self.metrics.render(), 'text/plain; version=0.0.4')
+        elif path == LOG_PATH:
+            self._send_text(''.join(format_record(record) + '\n' for record in log_manager.records()), 'text/plain')
+        else:
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+    def _send_text(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args, client=self.client_address[0])
 
 
 class Module(object):
@@ -20,7 +55,7 @@ class Module(object):
         self._boot = boot
 
         #if boot.is_wifi_enabled:   # it doesn't work on balena if wifi is enabled 
-        print("Starting web server on port {}.".format(WEBSERVER_PORT))
+        logger.info("Starting web server on port {}.", WEBSERVER_PORT)
         thread = threading.Thread(target=self._server)
         thread.daemon = True
         thread.start()
@@ -29,13 +64,14 @@ class Module(object):
         """Server thread entry point."""
         try:
             os.chdir(WEBSERVER_DIRECTORY)
+            RequestHandler.metrics = self._boot.metrics
             httpd = SocketServer.TCPServer(
                 ("", WEBSERVER_PORT),
-                SimpleHTTPServer.SimpleHTTPRequestHandler
+                RequestHandler
             )
             httpd.serve_forever()
         except Exception as e:
-            print("Webserver error: {}".format(e))
+            logger.exception("Webserver error: {}", e)
 
     def process(self, modules):
         pass
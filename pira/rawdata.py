@@ -0,0 +1,324 @@
+"""
+rawdata.py
+
+Binary raw data format of CAN captures. Every series (device_sensor_variable) is stored in
+columnar blocks of int16 values and int64 timestamps (milliseconds since epoch of the naive
+local timestamps), so files are compact and readers can map columns straight from the file.
+
+File layout, all integers little endian:
+    - header: magic (4 bytes 'PRAW'), version (uint16), reserved (uint16)
+    - segments, each one consisting of
+        - blocks: values (count x int16) followed by timestamps (count x int64), padded to 8 bytes
+        - index of all blocks in the file, per block: name length (uint16), name (utf-8),
+          count (uint32), values offset (uint64), timestamps offset (uint64)
+        - trailer: index offset (uint64), index length (uint32), magic (4 bytes 'PRIX')
+
+A file is only ever appended to. Every segment repeats the index of all earlier blocks, so
+readers only need the last valid trailer, a segment only partially written (e.g. on power
+loss) is skipped and later segments are appended after it.
+
+Existing JSON raw files can be converted with:
+
+    python -m pira.rawdata /data/raw
+"""
+from __future__ import print_function
+
+import collections
+import datetime
+import json
+import mmap
+import numbers
+import os
+import struct
+import sys
+
+from . import files
+
+# Optional numpy, columns are returned as arrays mapped from the file when it is available.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'PRAW'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+
+TRAILER_MAGIC = b'PRIX'
+TRAILER = struct.Struct('<QI4s')
+
+INDEX_ENTRY = struct.Struct('<IQQ')
+NAME_LENGTH = struct.Struct('<H')
+
+# Raw file names and extensions.
+RAW_PREFIX = 'raw_values-'
+RAW_EXTENSION = '.bin'
+JSON_EXTENSION = '.json'
+
+# Timestamp format of JSON raw files, microseconds are omitted by str(datetime) when zero.
+JSON_TIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Block of a series, offsets are from the start of the file.
+Block = collections.namedtuple('Block', ['count', 'values_offset', 'timestamps_offset'])
+
+
+class RawDataError(Exception):
+    pass
+
+
+def to_millis(timestamp):
+    """Milliseconds since epoch of a naive datetime."""
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def from_millis(millis):
+    """Naive datetime from milliseconds since epoch."""
+    return EPOCH + datetime.timedelta(milliseconds=millis)
+
+
+def _pad(length):
+    return -length % 8
+
+
+def _segment(series, offset, blocks):
+    """Encode a segment of blocks starting at the given file offset.
+
+    :param series: Iterable of (name, values, timestamps), timestamps as datetimes or milliseconds
+    :param offset: File offset of the segment
+    :param blocks: List of (name, Block) of earlier segments, new blocks are appended to it
+    """
+    data = bytearray()
+    for name, values, timestamps in series:
+        count = len(values)
+        if len(timestamps) != count:
+            raise RawDataError("Series '{}' has {} values and {} timestamps.".format(name, count, len(timestamps)))
+        if not count:
+            continue
+
+        integers = [int(value) for value in values]
+        if integers != list(values):
+            raise RawDataError("Series '{}' has values which are not integers.".format(name))
+        millis = [timestamp if isinstance(timestamp, numbers.Integral) else to_millis(timestamp) for timestamp in timestamps]
+        data += b'\0' * _pad(offset + len(data))
+        values_offset = offset + len(data)
+        try:
+            data += struct.pack('<{}h'.format(count), *integers)
+        except struct.error:
+            raise RawDataError("Series '{}' has values out of int16 range.".format(name))
+        data += b'\0' * _pad(offset + len(data))
+        timestamps_offset = offset + len(data)
+        data += struct.pack('<{}q'.format(count), *millis)
+        blocks.append((name, Block(count, values_offset, timestamps_offset)))
+
+    index_offset = offset + len(data)
+    index = bytearray()
+    for name, block in blocks:
+        encoded = name.encode('utf-8')
+        index += NAME_LENGTH.pack(len(encoded)) + encoded + INDEX_ENTRY.pack(*block)
+    data += index
+    data += TRAILER.pack(index_offset, len(index), TRAILER_MAGIC)
+    return bytes(data)
+
+
+def encode(series):
+    """Encode a new raw file.
+
+    :param series: Iterable of (name, values, timestamps), timestamps as datetimes or milliseconds
+    :return: File contents
+    """
+    return HEADER.pack(MAGIC, VERSION, 0) + _segment(series, HEADER.size, [])
+
+
+def encode_append(path, series):
+    """Encode a segment to be appended to an existing raw file.
+
+    :return: Bytes to append, the whole file if it does not exist yet
+    """
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return encode(series)
+
+    raw = RawFile(path)
+    try:
+        return _segment(series, raw.size, raw.blocks())
+    finally:
+        raw.close()
+
+
+class RawFile(object):
+    """Memory-mapped reader of a binary raw file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fp = open(path, 'rb')
+        try:
+            self.size = os.fstat(self._fp.fileno()).st_size
+            if self.size < HEADER.size + TRAILER.size:
+                raise RawDataError("File '{}' is too short.".format(path))
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            self._fp.close()
+            raise
+
+        magic, version, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise RawDataError("File '{}' is not a raw data file.".format(path))
+
+        index_offset, index_length = self._find_trailer()
+
+        self._index = collections.OrderedDict()
+        self._blocks = []
+        position = index_offset
+        while position < index_offset + index_length:
+            length, = NAME_LENGTH.unpack_from(self._map, position)
+            position += NAME_LENGTH.size
+            name = self._map[position:position + length].decode('utf-8')
+            position += length
+            block = Block(*INDEX_ENTRY.unpack_from(self._map, position))
+            position += INDEX_ENTRY.size
+            self._index.setdefault(name, []).append(block)
+            self._blocks.append((name, block))
+
+    def _find_trailer(self):
+        """Offset and length of the index of the last completely written segment."""
+        end = self.size
+        while True:
+            position = self._map.rfind(TRAILER_MAGIC, HEADER.size, end)
+            if position < 0:
+                self.close()
+                raise RawDataError("File '{}' has no valid index.".format(self.path))
+
+            start = position + len(TRAILER_MAGIC) - TRAILER.size
+            if start >= HEADER.size:
+                index_offset, index_length, _ = TRAILER.unpack_from(self._map, start)
+                if HEADER.size <= index_offset and index_offset + index_length == start:
+                    return index_offset, index_length
+            end = position + len(TRAILER_MAGIC) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Unmap and close the file, arrays returned by the reader must not be used afterwards."""
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._fp.close()
+
+    def blocks(self):
+        """List of (series name, Block) in file order."""
+        return list(self._blocks)
+
+    def series(self):
+        """Names of all series."""
+        return list(self._index)
+
+    def _column(self, name, code, offset_field):
+        blocks = self._index.get(name, [])
+        if numpy is not None:
+            columns = [
+                numpy.frombuffer(self._map, dtype='<i{}'.format(struct.calcsize(code)), count=block.count, offset=getattr(block, offset_field))
+                for block in blocks
+            ]
+            if len(columns) == 1:
+                return columns[0]
+            return numpy.concatenate(columns) if columns else numpy.zeros(0, dtype='<i{}'.format(struct.calcsize(code)))
+
+        column = []
+        for block in blocks:
+            column.extend(struct.unpack_from('<{}{}'.format(block.count, code), self._map, getattr(block, offset_field)))
+        return column
+
+    def values(self, name):
+        """Values of a series, numpy array mapped from the file or list when numpy is not available."""
+        return self._column(name, 'h', 'values_offset')
+
+    def timestamps(self, name):
+        """Timestamps of a series in milliseconds since epoch."""
+        return self._column(name, 'q', 'timestamps_offset')
+
+    def samples(self, name):
+        """Iterate over (datetime, value) of a series, values are floats as in JSON raw files."""
+        for millis, value in zip(self.timestamps(name), self.values(name)):
+            yield from_millis(int(millis)), float(value)
+
+
+def read_json(path):
+    """Read a JSON raw file written by the CAN module.
+
+    :return: List of (name, values, timestamps) ordered by sample index
+    """
+    with open(path, 'r') as fp:
+        devices = json.load(fp)
+
+    series = []
+    for device in sorted(devices):
+        for sensor in sorted(devices[device]):
+            for variable in sorted(devices[device][sensor]):
+                samples = devices[device][sensor][variable]
+                values = []
+                timestamps = []
+                for index in sorted(samples, key=int):
+                    values.append(samples[index]['data'])
+                    timestamps.append(_parse_json_time(samples[index]['time']))
+                series.append(("{}_{}_{}".format(device, sensor, variable), values, timestamps))
+
+    return series
+
+
+def _parse_json_time(value):
+    for time_format in JSON_TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, time_format)
+        except ValueError:
+            pass
+    raise RawDataError("Invalid raw timestamp '{}'.".format(value))
+
+
+def convert_json(path, remove=False):
+    """Convert a JSON raw file to the binary format next to it.
+
+    :param path: JSON raw file
+    :param remove: Remove the JSON file after conversion
+    :return: Path of the binary file
+    """
+    target = os.path.splitext(path)[0] + RAW_EXTENSION
+    files.replace('rawdata', target, encode(read_json(path)))
+    files.sync()
+    if remove:
+        os.remove(path)
+    return target
+
+
+def main(argv):
+    """Convert JSON raw files, arguments are files or directories."""
+    remove = '--remove' in argv
+    paths = [arg for arg in argv if arg != '--remove']
+    if not paths:
+        print("Usage: python -m pira.rawdata [--remove] <file or directory>...", file=sys.stderr)
+        return 2
+
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(name for name in os.listdir(path) if name.startswith(RAW_PREFIX) and name.endswith(JSON_EXTENSION))
+            sources = [os.path.join(path, name) for name in names]
+        else:
+            sources = [path]
+
+        for source in sources:
+            try:
+                print("{} -> {}".format(source, convert_json(source, remove=remove)))
+            except (ValueError, KeyError, RawDataError) as error:
+                print("{}: conversion failed: {}".format(source, error), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
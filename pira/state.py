@@ -1,5 +1,7 @@
 import pickle
 
+from . import files
+
 # State file location.
 STATE_FILE = '/data/pira-zero-state.pkl'
 
@@ -24,8 +26,7 @@ class State(object):
 
     def save(self):
         """Save state."""
-        with open(STATE_FILE, 'w+') as state_file:
-            pickle.dump(self._state, state_file)
+        files.replace('state', STATE_FILE, pickle.dumps(self._state))
 
     def __getitem__(self, name):
         try:
@@ -0,0 +1,274 @@
+"""
+storage.py
+
+Storage quota manager for /data. Files are grouped in categories with their own budgets,
+usage is kept in an in-memory index (built by a directory walk at boot and refreshed
+periodically), so modules do not need to walk directories or call statvfs themselves.
+
+Modules ask for permission before writing (request_write) and report written files
+(add). When a category is over its budget or the filesystem is running out of space,
+files are evicted from evictable categories, lowest priority category first, files
+already uploaded before others and oldest files first. Files a module still has to read
+(e.g. raw files not processed yet) are retained, see retain_after.
+
+Budgets of categories whose files are never evicted (light, calculated, log) are soft
+limits: writes are allowed as long as there is free space, the overrun is logged and
+exported as a metric.
+
+ENV VARS:
+    - STORAGE_BUDGETS (default empty), per-category budget overrides in MiB, e.g. "camera=2048,raw=512"
+    - STORAGE_RESERVE (default 1024), free space in MiB that is always kept on /data
+    - STORAGE_RESCAN_INTERVAL (default 3600), seconds between full rescans of the index
+"""
+import collections
+import os
+import time
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+# Storage root.
+STORAGE_PATH = '/data'
+
+# Categories.
+CATEGORY_CAMERA = 'camera'
+CATEGORY_RAW = 'raw'
+CATEGORY_CALCULATED = 'calculated'
+CATEGORY_LIGHT = 'light'
+CATEGORY_LOG = 'log'
+CATEGORY_PROFILES = 'profiles'
+
+MIB = 1024 * 1024
+
+# Storage category, paths are directories or single files. Categories with lower priority
+# are evicted first, files are only evicted from evictable categories.
+Category = collections.namedtuple('Category', ['name', 'paths', 'budget', 'priority', 'evictable'])
+
+CATEGORIES = (
+    Category(CATEGORY_PROFILES, ('/data/profiles',), 128 * MIB, 0, True),
+    Category(CATEGORY_CAMERA, ('/data/camera',), 4096 * MIB, 1, True),
+    Category(CATEGORY_RAW, ('/data/raw',), 1024 * MIB, 2, True),
+    Category(CATEGORY_LIGHT, ('/data/light',), 256 * MIB, 3, False),
+    Category(CATEGORY_CALCULATED, ('/data/calculated',), 512 * MIB, 4, False),
+    Category(CATEGORY_LOG, ('/data/pira-zero-log.db', '/data/pira-crash.log'), 512 * MIB, 5, False),
+)
+
+# Files modified more recently than this (in seconds) are never evicted, they may still be written.
+MIN_EVICT_AGE = 600
+
+# State key of the set of uploaded files.
+STATE_STORAGE_UPLOADED = 'storage.uploaded'
+
+# State key of per-category times (seconds since epoch) from which on files are retained.
+STATE_STORAGE_RETAIN = 'storage.retain'
+
+# Index entry of a single file.
+Entry = collections.namedtuple('Entry', ['size', 'mtime'])
+
+
+def _parse_budgets(value):
+    """Parse budget overrides (in MiB), returns dict of category -> bytes."""
+    budgets = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+
+        name, budget = item.split('=', 1)
+        try:
+            budgets[name.strip()] = int(float(budget) * MIB)
+        except ValueError:
+            logger.warning("Ignoring invalid storage budget.", budget=item)
+
+    return budgets
+
+
+class Storage(object):
+    """Storage quota manager."""
+
+    def __init__(self, boot, environ=os.environ, categories=CATEGORIES, root=STORAGE_PATH):
+        self._boot = boot
+        self._root = root
+        self.reserve = int(float(environ.get('STORAGE_RESERVE', '1024')) * MIB)
+        self._rescan_interval = float(environ.get('STORAGE_RESCAN_INTERVAL', '3600'))
+        self._rescanned = None
+
+        budgets = _parse_budgets(environ.get('STORAGE_BUDGETS', ''))
+        self.categories = collections.OrderedDict(
+            (category.name, category._replace(budget=budgets.get(category.name, category.budget)))
+            for category in sorted(categories, key=lambda category: category.priority)
+        )
+        # Category -> path -> Entry.
+        self._index = dict((name, {}) for name in self.categories)
+
+        self._used = boot.metrics.gauge('pira_storage_used_bytes', 'Storage used, by category.')
+        self._evicted = boot.metrics.counter('pira_storage_evicted_bytes_total', 'Bytes evicted from storage, by category.')
+        self._over_budget = boot.metrics.gauge(
+            'pira_storage_over_budget_bytes',
+            'Bytes over the soft budget of categories whose files are never evicted.'
+        )
+
+        self.rescan()
+
+    @property
+    def _uploaded(self):
+        uploaded = self._boot.state[STATE_STORAGE_UPLOADED]
+        if uploaded is None:
+            uploaded = self._boot.state[STATE_STORAGE_UPLOADED] = set()
+        return uploaded
+
+    def _category_of(self, path):
+        for category in self.categories.values():
+            for category_path in category.paths:
+                if path == category_path or path.startswith(category_path + os.sep):
+                    return category.name
+        return None
+
+    def _stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return Entry(stat.st_size, stat.st_mtime)
+
+    def rescan(self):
+        """Rebuild the usage index by walking all category paths."""
+        for name, category in self.categories.items():
+            index = {}
+            for category_path in category.paths:
+                if os.path.isfile(category_path):
+                    entry = self._stat(category_path)
+                    if entry is not None:
+                        index[category_path] = entry
+                    continue
+
+                for directory, _, files in os.walk(category_path):
+                    for file_name in files:
+                        path = os.path.join(directory, file_name)
+                        entry = self._stat(path)
+                        if entry is not None:
+                            index[path] = entry
+
+            self._index[name] = index
+
+        # Forget uploaded files that no longer exist.
+        uploaded = self._uploaded
+        uploaded.intersection_update(path for index in self._index.values() for path in index)
+
+        self._rescanned = time.time()
+        self._update_metrics()
+
+    def _update_metrics(self):
+        for name in self.categories:
+            self._used.set(self.used(name), category=name)
+
+    def _maybe_rescan(self):
+        if time.time() - self._rescanned >= self._rescan_interval:
+            self.rescan()
+
+    def used(self, category):
+        """Bytes used by the given category."""
+        return sum(entry.size for entry in self._index[category].values())
+
+    def usage(self):
+        """Dict of category -> bytes used."""
+        return dict((name, self.used(name)) for name in self.categories)
+
+    def free_space(self):
+        """Free bytes on the storage filesystem."""
+        info = os.statvfs(self._root)
+        return info.f_frsize * info.f_bavail
+
+    def add(self, category, path):
+        """Record written (or grown) file in the index."""
+        entry = self._stat(path)
+        if entry is None:
+            self._index[category].pop(path, None)
+        else:
+            self._index[category][path] = entry
+        self._used.set(self.used(category), category=category)
+
+    def mark_uploaded(self, path):
+        """Mark file as uploaded, such files are evicted first."""
+        if self._category_of(path) is not None:
+            self._uploaded.add(path)
+
+    def retain_after(self, category, timestamp):
+        """Never evict files of the category modified at or after timestamp (seconds since epoch)."""
+        retain = self._boot.state[STATE_STORAGE_RETAIN] or {}
+        retain[category] = timestamp
+        self._boot.state[STATE_STORAGE_RETAIN] = retain
+
+    def _candidates(self, category):
+        """Files of the category in eviction order: uploaded first, then oldest first."""
+        uploaded = self._uploaded
+        now = time.time()
+        retain = (self._boot.state[STATE_STORAGE_RETAIN] or {}).get(category)
+        return sorted(
+            (
+                path for path, entry in self._index[category].items()
+                if now - entry.mtime >= MIN_EVICT_AGE and (retain is None or entry.mtime < retain)
+            ),
+            key=lambda path: (path not in uploaded, self._index[category][path].mtime)
+        )
+
+    def _evict(self, category, amount):
+        """Evict at least amount bytes from category, returns number of bytes evicted."""
+        if not self.categories[category].evictable:
+            return 0
+
+        evicted = 0
+        for path in self._candidates(category):
+            if evicted >= amount:
+                break
+
+            entry = self._index[category].pop(path)
+            try:
+                os.remove(path)
+            except OSError:
+                logger.warning("Failed to evict file.", path=path)
+                continue
+
+            self._uploaded.discard(path)
+            evicted += entry.size
+            logger.info("Evicted file.", category=category, path=path, size=entry.size)
+
+        if evicted:
+            self._evicted.inc(evicted, category=category)
+            self._used.set(self.used(category), category=category)
+
+        return evicted
+
+    def request_write(self, category, size=0):
+        """Ask for permission to write size bytes to the given category, evicting files if needed.
+
+        :param category: Storage category
+        :param size: Expected number of bytes to be written
+        :return: True if the write is allowed
+        """
+        self._maybe_rescan()
+
+        # Category budget.
+        over = self.used(category) + size - self.categories[category].budget
+        if self.categories[category].evictable:
+            if over > 0 and self._evict(category, over) < over:
+                logger.warning("Storage category is over its budget, denying write.", category=category)
+                return False
+        else:
+            # Nothing can be evicted to make room, the data is kept and the overrun reported.
+            self._over_budget.set(max(0, over), category=category)
+            if over > 0:
+                logger.warning("Storage category is over its soft budget.", category=category, over=over)
+
+        # Free space on the filesystem, evicting lowest priority categories first.
+        missing = self.reserve + size - self.free_space()
+        for name in self.categories:
+            if missing <= 0:
+                break
+            missing -= self._evict(name, missing)
+
+        if missing > 0:
+            logger.warning("Not enough free storage space, denying write.", category=category)
+            return False
+
+        return True
@@ -0,0 +1,356 @@
+"""
+worker.py
+
+Runs network uploader modules in a separate worker process, so slow network calls and
+TLS/JSON work do not delay sensor sampling in the main loop. The main loop and the
+worker exchange small messages over bounded IPC queues:
+
+    main -> worker: ('tick', status), ('publish', topic, samples, timestamp), ('shutdown',)
+    worker -> main: ('loop', duration), ('counters', deltas), ('iostats', deltas), ('uploaded', path),
+                    ('stopped',)
+
+I/O of worker modules is added to the I/O totals of the main process, so it is included in
+the logged totals and the debug output.
+
+The worker is started before boot starts any threads. Where available (Python 3) it is
+started through a fork server, so restarts are forked from a process without threads as
+well, otherwise the forked worker replaces locks of process-wide services, which another
+thread may have held at fork time.
+
+The worker runs its own loop every UPLOAD_WORKER_INTERVAL seconds and is restarted with
+exponential backoff when it dies. Modules running in the worker only get a reduced boot
+object (clock, config, metrics, bus with forwarded topics, storage that only forwards
+uploaded files, voltage and the names of all modules).
+
+ENV VARS:
+    - UPLOAD_WORKER (default 0), set to 1 to run uploader modules in a worker process
+    - UPLOAD_WORKER_INTERVAL (default LOOP_DELAY), seconds between worker loops
+    - UPLOAD_WORKER_RESTARTS (default 5), number of restarts after which the worker is abandoned
+    - UPLOAD_WORKER_BACKOFF (default 30), delay before the first restart in seconds, doubled for every next restart
+"""
+import importlib
+import multiprocessing
+import os
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from .bus import Bus
+from .clock import create_clock
+from .config import Config
+from .const import TOPIC_CAN_SAMPLES, TOPIC_ULTRASONIC_DISTANCE
+from .logger import get_logger, manager as log_manager
+from .metrics import Metrics
+from . import files
+from . import iostats
+
+logger = get_logger(__name__)
+
+# Modules that may be moved into the worker process.
+UPLOADER_MODULES = (
+    'pira.modules.azure_sync',
+    'pira.modules.azure_images',
+    'pira.modules.m2x_plat',
+    'pira.modules.nodewatcher',
+)
+
+# Bus topics forwarded to the worker.
+FORWARDED_TOPICS = (TOPIC_CAN_SAMPLES, TOPIC_ULTRASONIC_DISTANCE)
+
+# Maximum number of pending messages in each direction.
+QUEUE_SIZE = 100
+
+# Seconds to wait for modules to shut down before the worker is killed.
+SHUTDOWN_TIMEOUT = 300
+
+
+class WorkerStorage(object):
+    """Storage stand-in, reports uploaded files to the storage manager in the main process."""
+
+    def __init__(self, events):
+        self._events = events
+        self._reported = set()
+
+    def mark_uploaded(self, path):
+        if path in self._reported:
+            return
+
+        if _send(self._events, ('uploaded', path)):
+            self._reported.add(path)
+
+
+class WorkerBoot(object):
+    """Reduced boot object given to modules running in the worker."""
+
+    def __init__(self, clock, events):
+        self.clock = clock
+        self.config = Config()
+        self.metrics = Metrics()
+        self.bus = Bus()
+        self.storage = WorkerStorage(events)
+        self.status = {}
+
+    def get_voltage(self):
+        return self.status.get('voltage')
+
+    def get_temperature(self):
+        return self.status.get('temperature')
+
+    @property
+    def is_charging(self):
+        return self.status.get('charging', False)
+
+
+def _send(channel, message):
+    """Put message to queue without blocking, returns False when queue is full."""
+    try:
+        channel.put_nowait(message)
+        return True
+    except queue.Full:
+        return False
+
+
+def _counter_deltas(metrics, previous):
+    """Return counter increments since the previous call."""
+    deltas = []
+    for name, description, labels, value in metrics.counter_values():
+        delta = value - previous.get((name, labels), 0)
+        if delta:
+            previous[(name, labels)] = value
+            deltas.append((name, description, labels, delta))
+
+    return deltas
+
+
+def _iostats_deltas(previous):
+    """Return I/O totals recorded since the previous call."""
+    deltas = {}
+    for subsystem, totals in iostats.stats.totals().items():
+        last = previous.get(subsystem, {})
+        delta = dict((name, value - last.get(name, 0)) for name, value in totals.items())
+        if any(delta.values()):
+            deltas[subsystem] = delta
+        previous[subsystem] = totals
+
+    return deltas
+
+
+def _report(events, metrics, counters, io_totals):
+    _send(events, ('counters', _counter_deltas(metrics, counters)))
+    _send(events, ('iostats', _iostats_deltas(io_totals)))
+
+
+def run_worker(module_names, main_modules, interval, commands, events):
+    """Worker process main loop."""
+    log_manager.after_fork()
+    iostats.stats.after_fork()
+    files.writer.after_fork()
+
+    boot = WorkerBoot(create_clock(os.environ), events)
+    for topic in FORWARDED_TOPICS:
+        boot.bus.declare(topic)
+
+    # Modules in the main loop are visible by name only.
+    modules = dict((name, None) for name in main_modules)
+    instances = []
+    for module_name in module_names:
+        try:
+            instance = importlib.import_module(module_name).Module(boot)
+        except:
+            logger.exception("Error while initializing a worker module.", module=module_name)
+            continue
+
+        modules[module_name] = instance
+        instances.append((module_name, instance))
+
+    counters = {}
+    io_totals = {}
+    next_run = time.time()
+    running = True
+    while running:
+        # Handle messages from the main loop until the next run is due.
+        try:
+            message = commands.get(timeout=max(0, next_run - time.time()))
+        except queue.Empty:
+            message = None
+
+        if message is not None:
+            if message[0] == 'tick':
+                boot.status = message[1]
+            elif message[0] == 'publish':
+                boot.bus.publish(message[1], message[2], timestamp=message[3])
+            elif message[0] == 'shutdown':
+                running = False
+            continue
+
+        boot.config.reload()
+        loop_start = time.time()
+        for name, module in instances:
+            try:
+                module.process(modules)
+            except:
+                logger.exception("Error while running processing in worker module '{}'.", name)
+
+        try:
+            files.sync()
+        except:
+            logger.exception("Error while syncing files in worker.")
+
+        _send(events, ('loop', time.time() - loop_start))
+        _report(events, boot.metrics, counters, io_totals)
+        next_run = loop_start + interval
+
+    for name, module in instances:
+        try:
+            module.shutdown(modules)
+        except:
+            logger.exception("Error while running shutdown in worker module '{}'.", name)
+
+    files.sync()
+    _report(events, boot.metrics, counters, io_totals)
+    _send(events, ('stopped',))
+
+
+class UploadWorker(object):
+    """Manages the worker process from the main loop."""
+
+    def __init__(self, boot, module_names, main_modules, environ=os.environ):
+        self._boot = boot
+        self.module_names = list(module_names)
+        self.main_modules = list(main_modules)
+        self.interval = float(environ.get('UPLOAD_WORKER_INTERVAL', environ.get('LOOP_DELAY', '60')))
+        self.max_restarts = int(environ.get('UPLOAD_WORKER_RESTARTS', '5'))
+        self.backoff = float(environ.get('UPLOAD_WORKER_BACKOFF', '30'))
+        self._context = multiprocessing
+        if hasattr(multiprocessing, 'get_context') and 'forkserver' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('forkserver')
+
+        self.restarts = 0
+        self._process = None
+        self._restart_at = None
+        self._abandoned = False
+        self._cursors = [(topic, boot.bus.cursor(topic, from_start=True)) for topic in FORWARDED_TOPICS]
+
+        self._restarts_total = boot.metrics.counter(
+            'pira_worker_restarts_total',
+            'Number of upload worker restarts.'
+        )
+        self._dropped_total = boot.metrics.counter(
+            'pira_worker_dropped_messages_total',
+            'Number of messages dropped because the upload worker queue was full.'
+        )
+        self._loop_duration = boot.metrics.histogram(
+            'pira_worker_loop_duration_seconds',
+            'Duration of a single upload worker loop iteration.'
+        )
+
+    def start(self):
+        """Start worker process."""
+        self._commands = self._context.Queue(QUEUE_SIZE)
+        self._events = self._context.Queue(QUEUE_SIZE)
+        self._process = self._context.Process(
+            target=run_worker,
+            name='pira-upload-worker',
+            args=(self.module_names, self.main_modules, self.interval, self._commands, self._events),
+        )
+        self._process.daemon = True
+        self._process.start()
+        self._restart_at = None
+        logger.info("Started upload worker.", pid=self._process.pid, modules=','.join(self.module_names))
+
+    @property
+    def is_alive(self):
+        return self._process is not None and self._process.is_alive()
+
+    def _post(self, message):
+        if not _send(self._commands, message):
+            self._dropped_total.inc()
+
+    def tick(self):
+        """Called once per main loop: forward data, collect events and restart crashed worker."""
+        if self._abandoned:
+            return
+
+        if not self.is_alive:
+            self._handle_crash()
+            return
+
+        self._post(('tick', {
+            'voltage': self._boot.get_voltage(),
+            'temperature': self._boot.get_temperature(),
+            'charging': self._boot.is_charging,
+        }))
+        for topic, cursor in self._cursors:
+            for batch in cursor.read():
+                self._post(('publish', topic, batch.samples, batch.timestamp))
+
+        self._collect_events()
+
+    def _collect_events(self):
+        stopped = False
+        while True:
+            try:
+                message = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == 'loop':
+                self._loop_duration.observe(message[1])
+            elif message[0] == 'counters':
+                for name, description, labels, delta in message[1]:
+                    self._boot.metrics.counter(name, description).inc(delta, **dict(labels))
+            elif message[0] == 'iostats':
+                iostats.stats.merge(message[1])
+            elif message[0] == 'uploaded':
+                self._boot.storage.mark_uploaded(message[1])
+            elif message[0] == 'stopped':
+                stopped = True
+
+        return stopped
+
+    def _handle_crash(self):
+        """Restart worker with exponential backoff."""
+        now = time.time()
+        if self._restart_at is None:
+            if self.restarts >= self.max_restarts:
+                logger.error("Upload worker crashed too many times, not restarting.", restarts=self.restarts)
+                self._abandoned = True
+                return
+
+            exitcode = self._process.exitcode if self._process is not None else None
+            self._restart_at = now + self.backoff * 2 ** self.restarts
+            logger.warning("Upload worker is not running, scheduling restart.", exitcode=exitcode, restarts=self.restarts)
+            return
+
+        if now >= self._restart_at:
+            self.restarts += 1
+            self._restarts_total.inc()
+            self.start()
+
+    def shutdown(self):
+        """Ask worker to shut down its modules and wait for it to exit."""
+        if not self.is_alive:
+            return
+
+        logger.info("Shutting down upload worker.")
+        # Shutdown must not be dropped, so wait for space in the queue.
+        try:
+            self._commands.put(('shutdown',), timeout=SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            pass
+
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        while self._process.is_alive() and time.time() < deadline:
+            self._process.join(1)
+            if self._collect_events():
+                break
+
+        self._process.join(1)
+        if self._process.is_alive():
+            logger.warning("Upload worker did not shut down in time, terminating.")
+            self._process.terminate()
+
+        self._abandoned = True